@@ -0,0 +1,189 @@
+"""Engagement reporting from columnar snapshots, away from the live database.
+
+take_snapshot() copies the columns reporting needs out of users, messages,
+likes and follows (archives included) into NumPy .npy files, one per
+column, under ANALYTICS_DIR/<timestamp>-<random suffix>/. Rows are read
+in batches with a server-side cursor; on Postgres all four tables are
+read in one REPEATABLE READ transaction, so they agree with each other.
+
+Aggregates are computed from a loaded Snapshot with vectorized NumPy
+operations, so reports never query the database:
+
+- messages_per_day(): messages posted per (UTC) day
+- likes_per_user_percentiles(): percentiles of likes given per user
+- follower_count_distribution(): how many users have 0, 1, 2-3, 4-7...
+  followers
+
+    flask analytics-snapshot
+    flask analytics-report
+
+Columns are memory-mapped when loaded, and snapshots are written to a
+temporary directory and renamed into place, so a report never sees half a
+snapshot. The newest ANALYTICS_KEEP snapshots are kept.
+"""
+
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+from export import export_query
+from models import db, User, Message, ArchivedMessage, Follows, Likes, ArchivedLike
+
+SNAPSHOT_BATCH_SIZE = 10000
+KEEP = 3
+PERCENTILES = (50, 90, 99)
+
+# table -> (models its rows come from, [(column, dtype)])
+SNAPSHOT_TABLES = {
+    'users': ([User], [('id', 'int64')]),
+    'messages': ([ArchivedMessage, Message],
+                 [('id', 'int64'), ('user_id', 'int64'), ('timestamp', 'datetime64[s]')]),
+    'likes': ([ArchivedLike, Likes], [('user_id', 'int64'), ('message_id', 'int64')]),
+    'follows': ([Follows], [('user_being_followed_id', 'int64'),
+                            ('user_following_id', 'int64')]),
+}
+
+LATEST = 'LATEST'
+
+
+def read_columns(queries, dtypes, batch_size=SNAPSHOT_BATCH_SIZE):
+    """Rows of `queries` as one array per column, converted a batch at a time."""
+
+    chunks = [[] for _ in dtypes]
+
+    def convert(batch):
+        for chunk, values, dtype in zip(chunks, zip(*batch), dtypes):
+            chunk.append(np.array(values, dtype=dtype))
+
+    for query in queries:
+        batch = []
+        for row in query.yield_per(batch_size):
+            batch.append(row)
+            if len(batch) == batch_size:
+                convert(batch)
+                batch = []
+        if batch:
+            convert(batch)
+
+    return [np.concatenate(chunk) if chunk else np.empty(0, dtype=dtype)
+            for chunk, dtype in zip(chunks, dtypes)]
+
+
+def take_snapshot(directory, batch_size=SNAPSHOT_BATCH_SIZE, keep=KEEP):
+    """Write a new snapshot under `directory`; returns its path."""
+
+    # microseconds keep names in order; the suffix keeps two runs that
+    # start at the same moment from sharing a directory
+    taken_at = datetime.utcnow().strftime('%Y%m%dT%H%M%S.%f')
+    name = f"{taken_at}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(directory, name)
+    tmp = os.path.join(directory, f".{name}.tmp")
+    os.makedirs(tmp)
+
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+
+        rows = {}
+        try:
+            for table, (models, columns) in SNAPSHOT_TABLES.items():
+                names = [column for column, _ in columns]
+                queries = [export_query(model, names) for model in models]
+                arrays = read_columns(queries, [dtype for _, dtype in columns], batch_size)
+                for column, array in zip(names, arrays):
+                    np.save(os.path.join(tmp, f"{table}.{column}.npy"), array)
+                rows[table] = len(arrays[0])
+        finally:
+            db.session.commit()
+
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'taken_at': taken_at, 'rows': rows}, f)
+
+        os.rename(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    _write_latest(directory, name)
+    _prune(directory, keep)
+    return path
+
+
+def _write_latest(directory, name):
+    tmp = os.path.join(directory, f".{LATEST}.tmp")
+    with open(tmp, 'w') as f:
+        f.write(name)
+    os.replace(tmp, os.path.join(directory, LATEST))
+
+
+def _prune(directory, keep):
+    snapshots = sorted(entry for entry in os.listdir(directory)
+                       if not entry.startswith('.') and entry != LATEST)
+    for old in snapshots[:-keep]:
+        shutil.rmtree(os.path.join(directory, old))
+
+
+class Snapshot:
+    """A snapshot on disk; columns are memory-mapped as they're asked for."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+    @classmethod
+    def latest(cls, directory):
+        with open(os.path.join(directory, LATEST)) as f:
+            return cls(os.path.join(directory, f.read().strip()))
+
+    def column(self, table, column):
+        return np.load(os.path.join(self.path, f"{table}.{column}.npy"), mmap_mode='r')
+
+
+def per_user_counts(user_ids, ids):
+    """How often each of `user_ids` (sorted) occurs in `ids`. Ids of users
+    not in `user_ids` are ignored."""
+
+    if not len(user_ids):
+        return np.zeros(0, dtype='int64')
+
+    index = np.searchsorted(user_ids, ids)
+    found = index < len(user_ids)
+    found[found] = user_ids[index[found]] == ids[found]
+    return np.bincount(index[found], minlength=len(user_ids))
+
+
+def messages_per_day(snapshot):
+    """(days, counts): each UTC day with messages, and how many."""
+
+    days = snapshot.column('messages', 'timestamp').astype('datetime64[D]')
+    return np.unique(days, return_counts=True)
+
+
+def likes_per_user_percentiles(snapshot, percentiles=PERCENTILES):
+    """{percentile: likes given} across all users, including those with none."""
+
+    counts = per_user_counts(snapshot.column('users', 'id'),
+                             snapshot.column('likes', 'user_id'))
+    if not len(counts):
+        return {}
+    return dict(zip(percentiles, np.percentile(counts, percentiles).tolist()))
+
+
+def follower_count_distribution(snapshot):
+    """(edges, users): users[i] users have from edges[i] up to (not
+    including) edges[i + 1] followers; the bins are 0, 1, 2-3, 4-7, ..."""
+
+    counts = per_user_counts(snapshot.column('users', 'id'),
+                             snapshot.column('follows', 'user_being_followed_id'))
+    top = int(counts.max()) if len(counts) else 0
+
+    edges = [0, 1]
+    while edges[-1] <= top:
+        edges.append(edges[-1] * 2)
+    users, edges = np.histogram(counts, bins=edges)
+    return edges, users
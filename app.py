@@ -1,13 +1,49 @@
+import itertools
+import mimetypes
 import os
+from datetime import datetime, timedelta, timezone
 
-from flask import Flask, render_template, request, flash, redirect, session, g, jsonify
+import click
+from flask import (Flask, render_template, request, flash, redirect, session, g,
+                   jsonify, abort, send_file, safe_join, Response, stream_with_context)
 from flask_debugtoolbar import DebugToolbarExtension
+from sqlalchemy import inspect
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.orm import joinedload
 
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message
+from models import (db, connect_db, User, Message, Likes, Follows, ArchivedMessage,
+                    ArchivedLike)
+from counts import init_counts
+from ids import MAX_ID
+from profile_cache import init_profile_cache
+from realtime import init_realtime, stream as sse_stream
+from trending import init_trending
+from sessions import init_sessions
+from templating import init_templates, render_page
+from assets import init_assets, build_assets, pick_encoding
+from images import (proxy_url, source_url, get_thumbnail, prune_cache, ImageProxyError,
+                    SIZES)
+from compression import init_compression
+from metrics import init_metrics, stats_collector, compression_collector
+from profiler import init_profiler
+from archive import init_archiver, archive_messages, archive_cutoff, ARCHIVE_BATCH_SIZE
+from export import (export_table, EXPORT_BATCH_SIZE, FORMATS as EXPORT_FORMATS,
+                    TABLES as EXPORT_TABLES)
+from purge import purge_user, purge_users, PurgeJob, PURGE_BATCH_SIZE
+from jobs import init_jobs
+from ratelimit import init_ratelimit
 
 CURR_USER_KEY = "curr_user"
+TRENDING_PAGE_SIZE = 50
+
+# Feeds show this many messages per page, fetched this many at a time.
+FEED_PAGE_SIZE = 100
+FEED_BATCH_SIZE = 50
+
+# Followers/following pages show this many users per page.
+FOLLOW_PAGE_SIZE = 48
 
 app = Flask(__name__)
 
@@ -16,13 +52,165 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
 
+# Optional read replicas (comma-separated URLs); GET requests read from these.
+app.config['SQLALCHEMY_REPLICA_URIS'] = [
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+app.config['REPLICA_STICKY_SECONDS'] = int(
+    os.environ.get('REPLICA_STICKY_SECONDS', 10))
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+
+# Where logged-in users' session data lives: "sqlite", "memory" or "cookie"
+# (see sessions.py)
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'sqlite')
+app.config['SESSION_SQLITE_PATH'] = os.environ.get(
+    'SESSION_SQLITE_PATH', os.path.join(app.root_path, 'sessions.db'))
+app.config['SESSION_WRITE_BATCH'] = int(os.environ.get('SESSION_WRITE_BATCH', 1))
+
+# Compiled templates are cached here across restarts and shared by workers;
+# all templates are compiled at startup unless TEMPLATE_WARMUP=0.
+app.config['JINJA_CACHE_DIR'] = os.environ.get(
+    'JINJA_CACHE_DIR', os.path.join(app.root_path, '.jinja_cache'))
+app.config['TEMPLATE_WARMUP'] = os.environ.get('TEMPLATE_WARMUP', '1') == '1'
+
+# Stream feed pages to the browser as they render, instead of all at once.
+app.config['STREAM_TEMPLATES'] = os.environ.get('STREAM_TEMPLATES', '0') == '1'
+
+# Remote user images are fetched, resized and served from here.
+app.config['IMAGE_PROXY_ENABLED'] = os.environ.get('IMAGE_PROXY', '1') == '1'
+app.config['IMAGE_CACHE_DIR'] = os.environ.get(
+    'IMAGE_CACHE_DIR', os.path.join(app.root_path, '.image_cache'))
+# Only for development: let the proxy fetch from localhost/private networks.
+app.config['IMAGE_ALLOW_PRIVATE'] = os.environ.get('IMAGE_ALLOW_PRIVATE') == '1'
+# `flask prune-images` keeps the cache within these.
+app.config['IMAGE_CACHE_MAX_BYTES'] = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 1024 ** 3))
+app.config['IMAGE_CACHE_MAX_AGE_DAYS'] = int(os.environ.get('IMAGE_CACHE_MAX_AGE_DAYS', 30))
+
+# Messages older than this move to the archive tables (see archive.py); with
+# ARCHIVE_INTERVAL set, every process archives that often (in seconds).
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+app.config['ARCHIVE_INTERVAL'] = int(os.environ.get('ARCHIVE_INTERVAL', 0))
+
+# Columnar snapshots for reporting (see analytics.py) are written here.
+app.config['ANALYTICS_DIR'] = os.environ.get(
+    'ANALYTICS_DIR', os.path.join(app.root_path, '.analytics'))
+app.config['ANALYTICS_KEEP'] = int(os.environ.get('ANALYTICS_KEEP', 3))
+
+# Profile pages' user rows and newest message ids are cached (see
+# profile_cache.py); PROFILE_CACHE_SQLITE_PATH adds a tier shared by workers.
+app.config['PROFILE_CACHE_TTL'] = int(os.environ.get('PROFILE_CACHE_TTL', 30))
+app.config['PROFILE_CACHE_SQLITE_PATH'] = os.environ.get('PROFILE_CACHE_SQLITE_PATH')
+app.config['PROFILE_CACHE_RECENT'] = FEED_PAGE_SIZE
+
+# Request threads per worker process: gunicorn's --threads, or ASGI_THREADS
+# under asgi.py (which sets this to match).
+app.config['SERVER_THREADS'] = int(os.environ.get('SERVER_THREADS', 1))
+
+# With REALTIME=1, new messages are pushed to open home pages over
+# /feed/stream (see realtime.py). Each open stream holds one of
+# SERVER_THREADS; REALTIME_MAX_CONNECTIONS defaults to a quarter of them.
+# Set REALTIME_BROKER=sqlite when running several worker processes on a host.
+app.config['REALTIME_ENABLED'] = os.environ.get('REALTIME') == '1'
+app.config['REALTIME_BROKER'] = os.environ.get('REALTIME_BROKER', 'local')
+app.config['REALTIME_SQLITE_PATH'] = os.environ.get(
+    'REALTIME_SQLITE_PATH', os.path.join(app.root_path, 'realtime.db'))
+if os.environ.get('REALTIME_MAX_CONNECTIONS'):
+    app.config['REALTIME_MAX_CONNECTIONS'] = int(os.environ['REALTIME_MAX_CONNECTIONS'])
+app.config['REALTIME_HEARTBEAT'] = int(os.environ.get('REALTIME_HEARTBEAT', 15))
+
+# Trending scores (see trending.py) live in TRENDING_SQLITE_PATH, shared by
+# the worker processes on a host; TRENDING_BACKEND=memory keeps them per process.
+app.config['TRENDING_BACKEND'] = os.environ.get('TRENDING_BACKEND', 'sqlite')
+app.config['TRENDING_SQLITE_PATH'] = os.environ.get(
+    'TRENDING_SQLITE_PATH', os.path.join(app.root_path, 'trending.db'))
+
+# HTML/JSON responses are gzip/brotli compressed when at least this big.
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+
+# Per-endpoint request metrics on /metrics, for Prometheus to scrape; with
+# METRICS_TOKEN set, scrapes must send "Authorization: Bearer <token>".
+# Without it, only requests from loopback that didn't come through a proxy
+# (no X-Forwarded-For) are answered.
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+# Sampling profiler (see profiler.py), off unless one of these is set:
+# profile 1 in PROFILE_SAMPLE_RATE requests, and/or any request sending
+# "X-Warbler-Profile: <PROFILE_TOKEN>". Stacks go to PROFILE_DIR.
+app.config['PROFILE_SAMPLE_RATE'] = int(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+app.config['PROFILE_DIR'] = os.environ.get(
+    'PROFILE_DIR', os.path.join(app.root_path, '.profiles'))
+app.config['PROFILE_INTERVAL'] = int(os.environ.get('PROFILE_INTERVAL', 5))
+app.config['PROFILE_MAX_BYTES'] = int(os.environ.get('PROFILE_MAX_BYTES', 5 * 1024 * 1024))
+
+# Side effects views don't wait for run on a pool of threads (see jobs.py).
+# JOBS_BACKEND=sqlite keeps queued jobs in JOBS_SQLITE_PATH across restarts.
+app.config['JOBS_BACKEND'] = os.environ.get('JOBS_BACKEND', 'memory')
+app.config['JOBS_SQLITE_PATH'] = os.environ.get(
+    'JOBS_SQLITE_PATH', os.path.join(app.root_path, 'jobs.db'))
+app.config['JOBS_WORKERS'] = int(os.environ.get('JOBS_WORKERS', 4))
+app.config['JOBS_MAX_ATTEMPTS'] = int(os.environ.get('JOBS_MAX_ATTEMPTS', 3))
+app.config['JOBS_EAGER'] = os.environ.get('JOBS_EAGER') == '1'
+
+# Token-bucket limits on posting and liking (see ratelimit.py): per user,
+# and for everyone together. RATELIMIT_BACKEND=sqlite shares the buckets
+# between worker processes on a host; an empty budget turns it off.
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+app.config['RATELIMIT_BACKEND'] = os.environ.get('RATELIMIT_BACKEND', 'memory')
+app.config['RATELIMIT_SQLITE_PATH'] = os.environ.get(
+    'RATELIMIT_SQLITE_PATH', os.path.join(app.root_path, 'ratelimit.db'))
+app.config['RATELIMIT_MESSAGES_PER_USER'] = os.environ.get(
+    'RATELIMIT_MESSAGES_PER_USER', '10/minute')
+app.config['RATELIMIT_MESSAGES_TOTAL'] = os.environ.get('RATELIMIT_MESSAGES_TOTAL', '600/minute')
+app.config['RATELIMIT_LIKES_PER_USER'] = os.environ.get('RATELIMIT_LIKES_PER_USER', '60/minute')
+app.config['RATELIMIT_LIKES_TOTAL'] = os.environ.get('RATELIMIT_LIKES_TOTAL', '3000/minute')
+
 toolbar = DebugToolbarExtension(app)
+session_store = init_sessions(app, CURR_USER_KEY)
+init_assets(app)
+compression = init_compression(app)
 
 connect_db(app)
+archiver = init_archiver(app)
+user_counts = init_counts(app)
+profile_cache = init_profile_cache(app)
+realtime = init_realtime(app)
+trending = init_trending(app)
+
+# outermost middleware, so it times and measures what clients get
+metrics = init_metrics(app)
+metrics.add_collector(compression_collector(compression.stats))
+metrics.add_collector(stats_collector(
+    'warbler_session_store', 'Session store counters.',
+    lambda: session_store.stats.as_dict() if session_store else None))
+metrics.add_collector(stats_collector(
+    'warbler_user_counts_cache', 'User counts cache counters.',
+    lambda: user_counts.stats.as_dict()))
+metrics.add_collector(stats_collector(
+    'warbler_profile_cache', 'Profile cache counters, by tier.',
+    lambda: profile_cache.stats.as_dict()))
+metrics.add_collector(stats_collector(
+    'warbler_realtime', 'Event stream connections and events.',
+    lambda: realtime.stats.as_dict()))
+
+profiler = init_profiler(app)
+metrics.add_collector(stats_collector(
+    'warbler_profiler', 'Sampling profiler counters.',
+    lambda: profiler.stats.as_dict() if profiler else None))
+
+jobs = init_jobs(app, metrics)
+
+limiter = init_ratelimit(app)
+metrics.add_collector(stats_collector(
+    'warbler_ratelimit', 'Rate limited and allowed write requests.',
+    lambda: limiter.stats.as_dict()))
 
 
 @app.errorhandler(404)
@@ -55,6 +243,10 @@ def add_user_to_g():
 def do_login(user):
     """Log in user."""
 
+    # new session id on login, so a planted one can't be used to hijack it
+    if hasattr(session, 'regenerate'):
+        session.regenerate()
+
     session[CURR_USER_KEY] = user.id
 
 
@@ -80,6 +272,11 @@ def signup():
     form = UserAddForm()
 
     if form.validate_on_submit():
+        # checked before User.signup() spends a bcrypt hash on the password
+        if User.taken(username=form.username.data, email=form.email.data):
+            flash("Username or email already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
         try:
             user = User.signup(
                 username=form.username.data,
@@ -90,6 +287,8 @@ def signup():
             db.session.commit()
 
         except IntegrityError:
+            # someone else signed up with the same name since we checked
+            db.session.rollback()
             flash("Username or email already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
@@ -101,6 +300,28 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
+@app.route('/api/availability')
+def availability():
+    """Are ?username= and/or ?email= free to sign up with?
+
+    Returns {"username": true/false, "email": true/false} for the ones
+    given; the signup form checks as you type.
+    """
+
+    username = request.args.get('username', '').strip()
+    email = request.args.get('email', '').strip()
+    if not username and not email:
+        return jsonify({'error': 'give a username or email'}), 400
+
+    taken = User.taken(username=username, email=email)
+    result = {}
+    if username:
+        result['username'] = 'username' not in taken
+    if email:
+        result['email'] = 'email' not in taken
+    return jsonify(result)
+
+
 @app.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
@@ -154,17 +375,53 @@ def list_users():
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = profile_cache.profile(user_id)
+    if user is None:
+        abort(404)
 
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    before = feed_cursor()
+    if before is None:
+        messages = profile_cache.recent_messages(user_id)
+    else:
+        messages = user_messages(user_id, FEED_PAGE_SIZE, before=before)
+    return render_page('users/show.html', user=user, messages=messages,
+                       page_size=FEED_PAGE_SIZE)
+
+
+def feed_cursor(name='before'):
+    """The message id a feed is paged from: ?before=<message id> by default,
+    or None for the first page. Anything but a valid id is a 400."""
+
+    value = request.args.get(name)
+    if value is None:
+        return None
+
+    # out of BIGINT range, Postgres would refuse the query
+    if not value.isdigit() or int(value) > MAX_ID:
+        abort(400)
+    return int(value)
+
+
+def user_messages(user_id, limit, before=None):
+    """A user's newest `limit` messages (older than `before`, if given),
+    topped up from the archive if need be.
+    """
+
+    shown = 0
+    for model in (Message, ArchivedMessage):
+        query = model.query.filter(model.user_id == user_id)
+        if before is not None:
+            query = query.filter(model.id < before)
+
+        for msg in (query
+                    .order_by(model.id.desc())
+                    .limit(limit - shown)
+                    .yield_per(FEED_BATCH_SIZE)):
+            shown += 1
+            yield msg
+
+        if shown >= limit:
+            return
 
 
 @app.route('/users/<int:user_id>/following')
@@ -176,8 +433,12 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    
-    return render_template('users/following.html', user=user)
+    users = follow_page(Follows.user_following_id, Follows.user_being_followed_id,
+                        user_id, request.args.get('after', type=int))
+
+    return render_template('users/following.html', user=user, users=users,
+                           following_ids=followed_by_me(users),
+                           page_size=FOLLOW_PAGE_SIZE)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -189,8 +450,43 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    
-    return render_template('users/followers.html', user=user)
+    users = follow_page(Follows.user_being_followed_id, Follows.user_following_id,
+                        user_id, request.args.get('after', type=int))
+
+    return render_template('users/followers.html', user=user, users=users,
+                           following_ids=followed_by_me(users),
+                           page_size=FOLLOW_PAGE_SIZE)
+
+
+def follow_page(this_side, other_side, user_id, after=None):
+    """One page of the users on `other_side` of follows with `user_id` on `this_side`.
+
+    Only the columns the cards show are selected, never whole User rows.
+    Ordered by id; `after` is the last id of the previous page.
+    """
+
+    query = (db.session
+             .query(User.id, User.username, User.image_url,
+                    User.header_image_url, User.bio)
+             .join(Follows, other_side == User.id)
+             .filter(this_side == user_id))
+    if after is not None:
+        query = query.filter(User.id > after)
+
+    return query.order_by(User.id).limit(FOLLOW_PAGE_SIZE).all()
+
+
+def followed_by_me(users):
+    """Ids among `users` that the logged-in user follows, in one query."""
+
+    ids = [u.id for u in users]
+    if not ids:
+        return set()
+
+    return {followed for (followed,) in (db.session
+                                         .query(Follows.user_being_followed_id)
+                                         .filter(Follows.user_following_id == g.user.id,
+                                                 Follows.user_being_followed_id.in_(ids)))}
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -204,6 +500,8 @@ def add_follow(follow_id):
     followed_user = User.query.get_or_404(follow_id)
     g.user.following.append(followed_user)
     db.session.commit()
+    user_counts.invalidate(g.user.id, follow_id)
+    jobs.enqueue('warm_thumbnails', user_id=follow_id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -219,6 +517,7 @@ def stop_following(follow_id):
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
     db.session.commit()
+    user_counts.invalidate(g.user.id, follow_id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -231,11 +530,29 @@ def profile():
         flash("Access unauthorized.", "danger")
         return redirect("/")    
 
-    
-    user = User.query.filter_by(id = g.user.id).first()
+    user = g.user
     form = UserEditForm(obj=user)
 
     if form.validate_on_submit():
+        changes = user.profile_changes(
+            username=form.username.data,
+            email=form.email.data,
+            image_url=form.image_url.data,
+            header_image_url=form.header_image_url.data,
+            location=form.location.data,
+            bio=form.bio.data,
+        )
+
+        # nothing to save, so no need for the (slow) password check either
+        if not changes:
+            flash('Nothing changed')
+            return redirect(f'/users/{user.id}')
+
+        if User.taken(username=changes.get('username'), email=changes.get('email'),
+                      exclude_id=user.id):
+            flash("Username or email already taken", 'danger')
+            return redirect('/users/profile')
+
         # Check password
         entered_pass = form.password.data
         correct_password = user.check_password(entered_pass)
@@ -243,15 +560,8 @@ def profile():
             flash('Incorrect Password')
             return redirect('/users/profile')
 
-        username = form.username.data
-        email = form.email.data
-        image_url = form.image_url.data
-        header_image_url = form.header_image_url.data
-        location = form.location.data
-        bio = form.bio.data
-
         try:
-            user.edit_user(username, email, image_url, header_image_url, location, bio)
+            user.apply_profile_changes(changes)
             flash('user edited')
             return redirect(f'/users/{user.id}')
         except:
@@ -272,14 +582,16 @@ def delete_user():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    user_id = g.user.id
     do_logout()
 
-    db.session.delete(g.user)
-    db.session.commit()
+    # inline, not a job: once we've said the account is gone, it must be
+    purge_user(user_id)
 
     return redirect("/signup")
 
 @app.route('/users/like', methods=["POST"])
+@limiter.limit('likes')
 def add_or_remove_like():
     """Allows users to like or unlike messages"""
 
@@ -289,19 +601,37 @@ def add_or_remove_like():
 
     
 
-    msg_id = request.json['msg_id']
-    msg = Message.query.filter_by(id = msg_id).first()
+    try:
+        msg_id = int(request.json['msg_id'])
+    except (TypeError, ValueError):
+        msg_id = None
+    msg = Message.query.get(msg_id) if msg_id is not None else None
+
+    if msg is None:
+        # gone, or archived (archived messages can't be liked)
+        return jsonify({'result': 'No such message'}), 404
 
     if msg.user_id == g.user.id:
         return jsonify({'result': 'Cant like own message'})
 
-    if msg not in g.user.likes:
-        g.user.likes.append(msg)
-        db.session.commit()
+    like = Likes.query.get((g.user.id, msg.id))
+
+    if like is None:
+        db.session.add(Likes(user_id=g.user.id, message_id=msg.id))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # a double click got there first
+            db.session.rollback()
+            return jsonify({'result': 'like added'})
+        user_counts.invalidate(g.user.id)
+        trending.record_like(msg.id, g.user.id, posted_at=epoch_seconds(msg.timestamp))
         return jsonify({'result': 'like added'})
     else:
-        g.user.likes.remove(msg)
+        db.session.delete(like)
         db.session.commit()
+        user_counts.invalidate(g.user.id)
+        trending.record_unlike(msg.id, g.user.id)
         return jsonify({'result': 'like removed'})
 
 
@@ -311,15 +641,30 @@ def show_likes(user_id):
 
     user = User.query.get_or_404(user_id)
 
-    messages = user.likes
+    hot = (Message
+           .query
+           .join(Likes, Likes.message_id == Message.id)
+           .filter(Likes.user_id == user_id)
+           .options(joinedload(Message.user))
+           .order_by(Message.id.desc())
+           .yield_per(FEED_BATCH_SIZE))
+    archived = (ArchivedMessage
+                .query
+                .join(ArchivedLike, ArchivedLike.message_id == ArchivedMessage.id)
+                .filter(ArchivedLike.user_id == user_id)
+                .options(joinedload(ArchivedMessage.user))
+                .order_by(ArchivedMessage.id.desc())
+                .yield_per(FEED_BATCH_SIZE))
+    messages = itertools.chain(hot, archived)
 
-    return render_template('users/likes.html', messages=messages, user=user)    
+    return render_page('users/likes.html', messages=messages, user=user)
 
 
 ##############################################################################
 # Messages routes:
 
 @app.route('/messages/new', methods=["POST"])
+@limiter.limit('messages')
 def messages_add():
     """Add a message"""
     
@@ -328,19 +673,93 @@ def messages_add():
         return redirect("/")
 
     msg_text = request.json['msg_text']
-    msg = Message(text=msg_text)
-    g.user.messages.append(msg)
+    msg = Message(text=msg_text, user_id=g.user.id)
+    db.session.add(msg)
     
     db.session.commit()
+    trending.record_message(msg.id)
+    user_counts.invalidate(g.user.id)
+    profile_cache.invalidate_messages(g.user.id)
+    jobs.enqueue('publish_message', message_id=msg.id)
 
     return 'Message added'
 
 
+def feed_authors(user_id):
+    """Ids of the users whose messages are on `user_id`'s home feed."""
+
+    authors = [followed for (followed,) in (db.session
+                                            .query(Follows.user_being_followed_id)
+                                            .filter(Follows.user_following_id == user_id))]
+    authors.append(user_id)
+    return authors
+
+
+def message_event(msg):
+    """A new message, as pushed to (or polled by) open home pages."""
+
+    return {
+        'id': str(msg.id),
+        'author_id': msg.user_id,
+        'username': msg.user.username,
+        'image_url': proxy_url(app, msg.user.image_url, 'timeline'),
+        'text': msg.text,
+        'timestamp': msg.timestamp.strftime('%d %B %Y'),
+    }
+
+
+@app.route('/feed/stream')
+def feed_stream():
+    """Server-sent events: new messages from the people the user follows."""
+
+    if not app.config['REALTIME_ENABLED']:
+        abort(404)
+
+    if not g.user:
+        return jsonify({'error': 'log in first'}), 401
+
+    sub = realtime.subscribe(g.user.id, feed_authors(g.user.id))
+    if sub is None:
+        # too many open streams; app.js falls back to polling /feed/new
+        return Response(status=503, headers={'Retry-After': '30'})
+
+    resp = Response(sse_stream(realtime, sub, app.config['REALTIME_HEARTBEAT']),
+                    mimetype='text/event-stream')
+    resp.call_on_close(lambda: realtime.unsubscribe(sub))
+    # no-transform keeps the compression middleware from buffering events
+    resp.headers['Cache-Control'] = 'no-cache, no-transform'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+@app.route('/feed/new')
+def feed_new():
+    """Messages newer than ?after=<message id> from the people the user
+    follows, oldest first: for home pages that couldn't get a stream."""
+
+    if not g.user:
+        return jsonify({'error': 'log in first'}), 401
+
+    after = feed_cursor('after')
+    if after is None:
+        return jsonify({'error': 'after is required'}), 400
+
+    messages = (Message
+                .query
+                .filter(Message.user_id.in_(feed_authors(g.user.id)), Message.id > after)
+                .options(joinedload(Message.user))
+                .order_by(Message.id.desc())
+                .limit(FEED_PAGE_SIZE)
+                .all())
+
+    return jsonify(messages=[message_event(msg) for msg in reversed(messages)])
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get_or_404(message_id)
+    msg = Message.query.get(message_id) or ArchivedMessage.query.get_or_404(message_id)
     return render_template('messages/show.html', message=msg)
 
 
@@ -352,17 +771,413 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
+    msg = Message.query.get(message_id) or ArchivedMessage.query.get_or_404(message_id)
     if msg.user_id != g.user.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     db.session.delete(msg)
     db.session.commit()
+    trending.forget(message_id)
+    user_counts.invalidate(g.user.id)
+    profile_cache.invalidate_messages(g.user.id)
 
     return redirect(f"/users/{g.user.id}")
 
 
+@app.route('/trending')
+def trending_page():
+    """Show recent messages ranked by (time-decayed) likes."""
+
+    messages = trending_messages(TRENDING_PAGE_SIZE)
+    return render_template('messages/trending.html', messages=messages)
+
+
+@app.route('/api/trending')
+def trending_api():
+    """JSON list of trending messages, best first."""
+
+    limit = request.args.get('limit', TRENDING_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, TRENDING_PAGE_SIZE))
+
+    return jsonify({'messages': [
+        {
+            # as a string: snowflake ids don't fit in a JavaScript number
+            'id': str(msg.id),
+            'text': msg.text,
+            'user_id': msg.user_id,
+            'username': msg.user.username,
+            'timestamp': msg.timestamp.isoformat(),
+            'score': round(score, 2),
+        }
+        for msg, score in trending_messages(limit)
+    ]})
+
+
+def trending_messages(limit):
+    """Load the messages in the current trending snapshot, as (msg, score) pairs.
+
+    This is a primary-key lookup of at most `limit` rows; the ranking itself
+    comes from the in-memory tracker, never from aggregating `likes`.
+    """
+
+    # a new process, or a new TRENDING_SQLITE_PATH: start from existing likes
+    if not trending.is_loaded():
+        trending.load(trending_window())
+
+    ranked = trending.top(limit)
+    if not ranked:
+        return []
+
+    by_id = {}
+    for model in (Message, ArchivedMessage):
+        missing = [msg_id for msg_id, _ in ranked if msg_id not in by_id]
+        if not missing:
+            break
+        by_id.update((msg.id, msg) for msg in (model.query
+                                               .filter(model.id.in_(missing))
+                                               .options(joinedload(model.user))))
+
+    return [(by_id[msg_id], score) for msg_id, score in ranked if msg_id in by_id]
+
+
+def trending_window():
+    """Every message in the trending window, as (msg_id, posted_at, [liker
+    ids]), to build the tracker from."""
+
+    cutoff = datetime.utcnow() - timedelta(seconds=trending.window)
+    rows = (db.session
+            .query(Message.id, Message.timestamp, Likes.user_id)
+            .outerjoin(Likes, Likes.message_id == Message.id)
+            .filter(Message.timestamp >= cutoff)
+            .order_by(Message.id)
+            .yield_per(FEED_BATCH_SIZE))
+
+    for msg_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+        group = list(group)
+        yield (msg_id, epoch_seconds(group[0][1]),
+               [user_id for _, _, user_id in group if user_id is not None])
+
+
+def epoch_seconds(timestamp):
+    """Convert one of our naive UTC timestamps to seconds since the epoch."""
+
+    return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+
+
+##############################################################################
+# Image proxy:
+
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@app.template_filter('thumbnail')
+def thumbnail_filter(url, size):
+    """Template filter: serve a user's remote image through the proxy."""
+
+    return proxy_url(app, url, size)
+
+
+@app.route('/images/<size>/<token>')
+def proxied_image(size, token):
+    """Serve a resized, locally cached copy of a remote image."""
+
+    url = source_url(app, token)
+    if size not in SIZES or url is None:
+        abort(404)
+
+    try:
+        path, digest = get_thumbnail(app.config['IMAGE_CACHE_DIR'], url, size,
+                                     app.config['IMAGE_ALLOW_PRIVATE'])
+    except ImageProxyError:
+        # let the browser try the original
+        return redirect(url)
+
+    resp = send_file(path, conditional=True)
+    resp.set_etag(digest)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = IMAGE_MAX_AGE
+    return resp.make_conditional(request)
+
+
+##############################################################################
+# Built static assets:
+
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@app.route('/static/dist/<path:filename>')
+def static_dist(filename):
+    """Serve a fingerprinted asset, precompressed if the client allows."""
+
+    path = safe_join(app.static_folder, 'dist', filename)
+    if not os.path.isfile(path):
+        abort(404)
+
+    served, encoding = pick_encoding(request.headers.get('Accept-Encoding', ''), path)
+
+    resp = send_file(served, mimetype=mimetypes.guess_type(path)[0],
+                     conditional=True)
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    resp.vary.add('Accept-Encoding')
+    resp.cache_control.public = True
+    resp.cache_control.max_age = ASSET_MAX_AGE
+    return resp
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Minify, fingerprint and precompress static assets into static/dist."""
+
+    manifest = build_assets(app.static_folder)
+    for source, built in manifest.items():
+        click.echo(f"{source} -> {built}")
+
+
+##############################################################################
+# Background jobs:
+
+@jobs.task('publish_message')
+def publish_message(message_id):
+    """Push a new message to its author's followers' open event streams."""
+
+    msg = Message.query.get(message_id)
+    if msg is None:
+        # deleted before we got to it
+        return
+
+    realtime.publish(message_event(msg))
+
+
+@jobs.task('warm_thumbnails')
+def warm_thumbnails(user_id):
+    """Resize a newly followed user's card images into the image cache, so
+    the following page doesn't wait on their image host."""
+
+    user = User.query.get(user_id)
+    if user is None or not app.config['IMAGE_PROXY_ENABLED']:
+        return
+
+    for url, size in ((user.image_url, 'card'), (user.header_image_url, 'card-hero')):
+        if url and url.startswith(('http://', 'https://')):
+            try:
+                get_thumbnail(app.config['IMAGE_CACHE_DIR'], url, size,
+                              app.config['IMAGE_ALLOW_PRIVATE'])
+            except ImageProxyError:
+                # the proxy redirects to the original instead
+                pass
+
+
+##############################################################################
+# Admin routes:
+
+@app.route('/admin/users/purge', methods=["POST"])
+def admin_purge_users():
+    """Start deleting a batch of users in the background.
+
+    Takes JSON {"user_ids": [...]} and returns the job's progress report;
+    poll /admin/purge/<job_id> to follow it.
+    """
+
+    if not g.user or not g.user.is_admin:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user_ids = [int(user_id) for user_id in request.json['user_ids']]
+    job = PurgeJob.start(app, user_ids)
+
+    return jsonify(job.serialize()), 202
+
+
+@app.route('/admin/purge/<job_id>')
+def admin_purge_progress(job_id):
+    """Progress of a background purge."""
+
+    if not g.user or not g.user.is_admin:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    job = PurgeJob.jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'no such job'}), 404
+
+    return jsonify(job.serialize())
+
+
+@app.route('/admin/export/<table>')
+def admin_export(table):
+    """Stream a table as CSV or NDJSON (?format=), optionally only rows
+    after ?since_id= or ?since=<ISO time>; see export.py."""
+
+    if not g.user or not g.user.is_admin:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    fmt = request.args.get('format', 'csv')
+    since = request.args.get('since')
+    try:
+        chunks = export_table(table, fmt,
+                              since_id=request.args.get('since_id', type=int),
+                              since=datetime.fromisoformat(since) if since else None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{table}.{fmt}"'})
+
+
+@app.route('/admin/stats')
+def admin_stats():
+    """Internal counters, as JSON."""
+
+    if not g.user or not g.user.is_admin:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    return jsonify({
+        'session_store': session_store.stats.as_dict() if session_store else None,
+        'compression': compression.stats.as_dict(),
+        'archiver': archiver.serialize() if archiver else None,
+        'user_counts': user_counts.stats.as_dict(),
+        'profile_cache': profile_cache.stats.as_dict(),
+        'realtime': realtime.stats.as_dict(),
+        'profiler': profiler.stats.as_dict() if profiler else None,
+        'jobs': jobs.serialize(),
+        'ratelimit': limiter.stats.as_dict(),
+    })
+
+
+@app.cli.command('purge-users')
+@click.argument('user_ids', nargs=-1, type=int, required=True)
+@click.option('--batch-size', default=PURGE_BATCH_SIZE, help='Max rows deleted per transaction.')
+def purge_users_command(user_ids, batch_size):
+    """Delete users (and all their data) by id."""
+
+    def report(done, total, rows_deleted):
+        click.echo(f"{done}/{total} users purged, {rows_deleted} rows deleted")
+
+    purge_users(user_ids, batch_size, progress=report)
+
+
+@app.cli.command('archive-messages')
+@click.option('--days', default=None, type=int, help='Archive messages older than this (default ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, help='Max messages moved per transaction.')
+def archive_messages_command(days, batch_size):
+    """Move old messages (and their likes) to the archive tables."""
+
+    cutoff = archive_cutoff(days if days is not None else app.config['ARCHIVE_AFTER_DAYS'])
+
+    def report(moved):
+        click.echo(f"{moved} messages archived")
+
+    archive_messages(cutoff, batch_size, progress=report)
+
+
+@app.cli.command('prune-images')
+@click.option('--max-bytes', default=None, type=int,
+              help='Cache size to stay within (default IMAGE_CACHE_MAX_BYTES).')
+@click.option('--max-age-days', default=None, type=int,
+              help='Drop thumbnails not served for this long (default IMAGE_CACHE_MAX_AGE_DAYS).')
+def prune_images_command(max_bytes, max_age_days):
+    """Drop the least recently served thumbnails from IMAGE_CACHE_DIR."""
+
+    if max_bytes is None:
+        max_bytes = app.config['IMAGE_CACHE_MAX_BYTES']
+    if max_age_days is None:
+        max_age_days = app.config['IMAGE_CACHE_MAX_AGE_DAYS']
+
+    deleted, freed = prune_cache(app.config['IMAGE_CACHE_DIR'], max_bytes,
+                                 max_age_days * 24 * 60 * 60)
+    click.echo(f"{deleted} files deleted, {freed} bytes freed")
+
+
+@app.cli.command('rebuild-trending')
+def rebuild_trending_command():
+    """Rebuild trending scores from the messages in the window and their likes."""
+
+    trending.load(trending_window())
+    click.echo(f"{len(trending)} messages ranked")
+
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(sorted(EXPORT_TABLES)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv')
+@click.option('--since-id', type=int, help='Only rows with a larger id (users, messages).')
+@click.option('--since', type=click.DateTime(), help='Only messages posted after this.')
+@click.option('--output', '-o', type=click.File('w'), default='-', help='File to write (default stdout).')
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, help='Rows fetched and written at a time.')
+def export_command(table, fmt, since_id, since, output, batch_size):
+    """Export a table as CSV or NDJSON."""
+
+    try:
+        chunks = export_table(table, fmt, since_id, since, batch_size)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    for chunk in chunks:
+        output.write(chunk)
+
+
+@app.cli.command('analytics-snapshot')
+@click.option('--batch-size', default=10000, help='Rows read at a time.')
+def analytics_snapshot_command(batch_size):
+    """Snapshot the tables reporting needs into ANALYTICS_DIR."""
+
+    # imported here so web workers don't load NumPy
+    from analytics import take_snapshot
+
+    path = take_snapshot(app.config['ANALYTICS_DIR'], batch_size,
+                         keep=app.config['ANALYTICS_KEEP'])
+    click.echo(f"snapshot written to {path}")
+
+
+@app.cli.command('analytics-report')
+@click.option('--days', default=14, help='How many of the latest days to list.')
+def analytics_report_command(days):
+    """Engagement numbers from the latest snapshot (no database queries)."""
+
+    from analytics import (Snapshot, messages_per_day, likes_per_user_percentiles,
+                           follower_count_distribution)
+
+    snapshot = Snapshot.latest(app.config['ANALYTICS_DIR'])
+    click.echo(f"snapshot {snapshot.meta['taken_at']}: {snapshot.meta['rows']}")
+
+    click.echo("\nmessages per day:")
+    for day, count in list(zip(*messages_per_day(snapshot)))[-days:]:
+        click.echo(f"  {day}  {count}")
+
+    click.echo("\nlikes given per user:")
+    for percentile, likes in likes_per_user_percentiles(snapshot).items():
+        click.echo(f"  p{percentile}  {likes:g}")
+
+    click.echo("\nfollowers per user:")
+    edges, users = follower_count_distribution(snapshot)
+    for low, high, count in zip(edges, edges[1:], users):
+        label = str(low) if high == low + 1 else f"{low}-{high - 1}"
+        click.echo(f"  {label:>11}  {count}")
+
+
+@app.cli.command('create-indexes')
+def create_indexes_command():
+    """Add indexes the models define but an existing database lacks.
+
+    Fails on a unique index whose rows aren't unique (e.g. two users whose
+    usernames differ only in case); rename one and run it again.
+    """
+
+    tables = set(inspect(db.engine).get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        for index in table.indexes:
+            # (reflection can't see expression indexes, so let the database
+            # skip the ones it has)
+            ddl = str(CreateIndex(index).compile(dialect=db.engine.dialect))
+            db.engine.execute(ddl.replace(' INDEX ', ' INDEX IF NOT EXISTS ', 1))
+            click.echo(f"{index.name} ok")
 
 
 ##############################################################################
@@ -374,7 +1189,8 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users,
+      paged with ?before=<message id>
     """
 
     if g.user:
@@ -383,14 +1199,20 @@ def homepage():
         for ele in g.user.following:
             following_ids.append(ele.id)
 
-        messages = (Message
-                    .query
-                    .filter((Message.user == g.user) | (Message.user_id.in_(following_ids))  )
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())             
+        query = (Message
+                 .query
+                 .filter((Message.user == g.user) | (Message.user_id.in_(following_ids))  ))
+        before = feed_cursor()
+        if before is not None:
+            query = query.filter(Message.id < before)
+
+        messages = (query
+                    .options(joinedload(Message.user))
+                    .order_by(Message.id.desc())
+                    .limit(FEED_PAGE_SIZE)
+                    .yield_per(FEED_BATCH_SIZE))
 
-        return render_template('home.html', messages=messages)
+        return render_page('home.html', messages=messages, page_size=FEED_PAGE_SIZE)
 
     else:
         return render_template('home-anon.html')
@@ -403,12 +1225,26 @@ def homepage():
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
+# These endpoints set their own caching headers: long-lived ones for
+# content that never changes under a given URL, and the event stream's.
+OWN_CACHE_HEADERS_ENDPOINTS = {'proxied_image', 'static_dist', 'feed_stream'}
+
+
 @app.after_request
 def add_header(req):
     """Add non-caching headers on every request."""
 
+    if request.endpoint in OWN_CACHE_HEADERS_ENDPOINTS:
+        return req
+
     req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     req.headers["Pragma"] = "no-cache"
     req.headers["Expires"] = "0"
     req.headers['Cache-Control'] = 'public, max-age=0'
     return req
+
+
+##############################################################################
+# Compile templates now that every filter and global they use is registered.
+
+template_warmup = init_templates(app)
@@ -0,0 +1,143 @@
+"""Moving old messages out of the hot `messages` table.
+
+`messages` is what every feed sorts and pages through, so we keep it to
+recent warbles: anything older than ARCHIVE_AFTER_DAYS is moved, along
+with its likes, to `messages_archive` and `likes_archive`. Profiles,
+likes pages and message permalinks fall back to the archive.
+
+Rows move in batches of at most `batch_size` messages, one transaction
+per batch. Batches are claimed with SELECT ... FOR UPDATE SKIP LOCKED,
+so archivers in several workers don't trip over each other.
+
+Run it from cron (`flask archive-messages`) or set ARCHIVE_INTERVAL to
+have each app process archive in a background thread.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from models import db, Message, Likes, ArchivedMessage, ArchivedLike
+
+ARCHIVE_BATCH_SIZE = 500
+
+
+def archive_cutoff(days):
+    """Messages from before this time belong in the archive."""
+
+    return datetime.utcnow() - timedelta(days=days)
+
+
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move up to `batch_size` messages older than `cutoff`, oldest first.
+
+    Returns the number of messages moved.
+    """
+
+    msg_ids = [m for (m,) in (db.session.query(Message.id)
+                              .filter(Message.timestamp < cutoff)
+                              .order_by(Message.timestamp)
+                              .limit(batch_size)
+                              .with_for_update(skip_locked=True))]
+    if not msg_ids:
+        db.session.rollback()
+        return 0
+
+    db.session.execute(ArchivedMessage.__table__.insert().from_select(
+        ['id', 'text', 'timestamp', 'user_id'],
+        select([Message.id, Message.text, Message.timestamp, Message.user_id])
+        .where(Message.id.in_(msg_ids))))
+
+    db.session.execute(ArchivedLike.__table__.insert().from_select(
+        ['user_id', 'message_id'],
+        select([Likes.user_id, Likes.message_id])
+        .where(Likes.message_id.in_(msg_ids))
+        .distinct()))
+
+    (Likes.query
+     .filter(Likes.message_id.in_(msg_ids))
+     .delete(synchronize_session=False))
+    (Message.query
+     .filter(Message.id.in_(msg_ids))
+     .delete(synchronize_session=False))
+    db.session.commit()
+
+    return len(msg_ids)
+
+
+def archive_messages(cutoff, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+    """Move every message older than `cutoff` into the archive.
+
+    `progress`, if given, is called as progress(moved so far) after each
+    batch. Returns the number of messages moved.
+    """
+
+    moved = 0
+    while True:
+        n = archive_batch(cutoff, batch_size)
+        if not n:
+            return moved
+        moved += n
+        if progress:
+            progress(moved)
+
+
+class Archiver:
+    """Background thread archiving old messages every `interval` seconds."""
+
+    def __init__(self, app, days, interval, batch_size=ARCHIVE_BATCH_SIZE):
+        self.app = app
+        self.days = days
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.moved = 0
+        self.last_run = None
+        self.error = None
+
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.moved += archive_messages(
+                        archive_cutoff(self.days), self.batch_size)
+                    self.error = None
+                except Exception as e:
+                    db.session.rollback()
+                    self.error = str(e)
+                finally:
+                    db.session.remove()
+            self.last_run = time.time()
+            self._stop.wait(self.interval)
+
+    def serialize(self):
+        """Status as a dict, for JSON."""
+
+        return {
+            'moved': self.moved,
+            'last_run': self.last_run,
+            'error': self.error,
+        }
+
+
+def init_archiver(app):
+    """Start a background Archiver if ARCHIVE_INTERVAL is set; returns it or None."""
+
+    interval = app.config.get('ARCHIVE_INTERVAL')
+    if not interval:
+        return None
+
+    return Archiver(app, app.config['ARCHIVE_AFTER_DAYS'], interval).start()
@@ -0,0 +1,178 @@
+"""ASGI entry point: serve the Flask app from an asyncio event loop.
+
+    uvicorn asgi:application --port 5000
+
+The views, Flask-SQLAlchemy and psycopg2 are all synchronous, so each
+request still runs on a thread, taken from a pool of ASGI_THREADS. The
+event loop owns every connection and does all the socket I/O: idle
+keep-alive connections, request bodies still uploading and requests
+queued for a thread cost no thread.
+
+Response bodies are handed to the loop chunk by chunk, so streamed pages
+(STREAM_TEMPLATES) stay streamed. The worker blocks until each chunk is
+accepted, which keeps one slow client from buffering a whole page in
+memory, but it means a request holds its thread until the client has
+taken all but the last chunk, however slowly it reads.
+
+If the client disconnects, the response is abandoned at its next chunk
+and its iterator closed, which frees the thread. An event stream
+(/feed/stream) notices within one heartbeat.
+"""
+
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 16))
+
+# the app sizes its live feed's stream cap from its request threads
+os.environ.setdefault('SERVER_THREADS', str(ASGI_THREADS))
+
+from app import app
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the response was finished."""
+
+
+class AsgiAdapter:
+    """Run a WSGI app under ASGI on a bounded thread pool."""
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError(f"unsupported ASGI scope type {scope['type']!r}")
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+
+        environ = build_environ(scope, b''.join(body))
+        loop = asyncio.get_running_loop()
+        disconnected = threading.Event()
+
+        async def watch():
+            # after the body, the next message is the client going away
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = loop.create_task(watch())
+        try:
+            await loop.run_in_executor(
+                self.executor, self.run_wsgi, environ, loop, send, disconnected)
+        finally:
+            watcher.cancel()
+
+    def run_wsgi(self, environ, loop, send, disconnected):
+        """Call the WSGI app on a worker thread, sending through `loop`,
+        until it's done or `disconnected` is set."""
+
+        def call(message):
+            if disconnected.is_set():
+                raise ClientDisconnected()
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                                   for k, v in headers]
+            return write
+
+        def start():
+            # headers can still change until the first body chunk goes out
+            if not response.get('started'):
+                response['started'] = True
+                call({'type': 'http.response.start',
+                      'status': response['status'],
+                      'headers': response['headers']})
+
+        def write(data):
+            if data:
+                start()
+                call({'type': 'http.response.body', 'body': data,
+                      'more_body': True})
+
+        app_iter = None
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+            for chunk in app_iter:
+                write(chunk)
+            start()
+            call({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        except ClientDisconnected:
+            # nobody to send the rest to
+            pass
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI http scope."""
+
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+application = AsgiAdapter(app)
@@ -0,0 +1,122 @@
+"""Static asset build: minified, fingerprinted, precompressed bundles.
+
+`flask build-assets` writes each file in ASSETS to static/dist/ as
+<name>.<content hash>.<ext>, next to .gz (and, if the brotli package is
+installed, .br) copies, plus a manifest.json mapping source paths to
+built ones. Templates link assets with static_url('app.js'), which gives
+the fingerprinted path when there's a build and the plain /static path
+when there isn't. A fingerprinted URL's contents never change, so it can
+be cached for a year.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from compression import accepted_encodings
+
+ASSETS = ['app.js', 'stylesheets/style.css']
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+
+def minify_css(css):
+    """Strip comments and collapse whitespace."""
+
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{}:;,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    """Drop blank lines, indentation and whole-line // comments.
+
+    Deliberately conservative: nothing inside a line is touched, so no
+    string or regex literal can be mangled.
+    """
+
+    lines = (line.strip() for line in js.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def build_assets(static_folder, assets=ASSETS):
+    """Build every asset into <static_folder>/dist; returns the manifest."""
+
+    dist = os.path.join(static_folder, DIST)
+    manifest = {}
+
+    for asset in assets:
+        root, ext = os.path.splitext(asset)
+        with open(os.path.join(static_folder, asset), encoding='utf-8') as f:
+            source = f.read()
+
+        minify = MINIFIERS.get(ext)
+        data = (minify(source) if minify else source).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()[:12]
+
+        built = f"{DIST}/{root}.{digest}{ext}"
+        path = os.path.join(static_folder, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9))
+        if brotli:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data))
+
+        manifest[asset] = built
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+
+def load_manifest(static_folder):
+    """The manifest from the last build, or {} if assets haven't been built."""
+
+    try:
+        with open(os.path.join(static_folder, DIST, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def init_assets(app):
+    """Register the static_url() template helper."""
+
+    app.extensions['asset_manifest'] = load_manifest(app.static_folder)
+    url_path = app.static_url_path
+
+    @app.template_global()
+    def static_url(path):
+        built = app.extensions['asset_manifest'].get(path, path)
+        return f"{url_path}/{built}"
+
+
+def pick_encoding(accept_encoding, path):
+    """Best precompressed variant of `path` the client accepts.
+
+    Returns (file path, Content-Encoding or None).
+    """
+
+    accept = accepted_encodings(accept_encoding)
+
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding in accept and os.path.exists(path + suffix):
+            return path + suffix, encoding
+
+    return path, None
@@ -0,0 +1,187 @@
+"""Compare the sync WSGI app with the ASGI entry point under equal load.
+
+Both servers get the same number of threads for running views:
+
+- sync: a plain WSGI server (wsgiref) with a pool of THREADS workers,
+  one connection per thread, as a threaded gunicorn/waitress would.
+- asgi: uvicorn serving asgi:application with ASGI_THREADS=THREADS.
+
+Each route is hit CONCURRENCY requests at a time, logged in as the first
+user in the database. Run against a seeded database:
+
+    DATABASE_URL=postgresql:///warbler python bench_asgi.py
+    python bench_asgi.py --concurrency 200 --threads 8 --requests 2000
+
+The post route adds real messages, so use a throwaway database.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+SERVER = r'''
+import os, sys
+from flask import session
+from app import app, CURR_USER_KEY
+
+user_id = int(os.environ['BENCH_USER_ID'])
+
+def log_in():
+    session[CURR_USER_KEY] = user_id
+
+# before add_user_to_g, so every request is logged in
+app.before_request_funcs.setdefault(None, []).insert(0, log_in)
+
+mode, port, threads = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+
+if mode == 'asgi':
+    import uvicorn
+    from asgi import AsgiAdapter
+    uvicorn.run(AsgiAdapter(app, threads), port=port, log_level='warning')
+else:
+    from concurrent.futures import ThreadPoolExecutor
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+    class PoolServer(ThreadingMixIn, WSGIServer):
+        pool = ThreadPoolExecutor(threads)
+        request_queue_size = 1024
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.process_request_thread, request, client_address)
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    make_server('127.0.0.1', port, app, PoolServer, QuietHandler).serve_forever()
+'''
+
+SETUP = r'''
+import json
+from app import app
+from models import User
+
+with app.app_context():
+    print(json.dumps({'user_id': User.query.first().id}))
+'''
+
+# (name, method, path, JSON body)
+ROUTES = [
+    ('feed', 'GET', '/', None),
+    ('profile', 'GET', '/users/{user_id}', None),
+    ('trending', 'GET', '/api/trending', None),
+    ('post', 'POST', '/messages/new', {'msg_text': 'benchmark warble'}),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def request(port, method, path, body):
+    """One HTTP/1.1 request on a fresh connection; returns the status code."""
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = json.dumps(body).encode() if body is not None else b''
+    head = (f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+            f"Connection: close\r\nContent-Length: {len(data)}\r\n")
+    if body is not None:
+        head += "Content-Type: application/json\r\n"
+    writer.write(head.encode() + b"\r\n" + data)
+    await writer.drain()
+
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def load(port, method, path, body, total, concurrency):
+    """Run `total` requests, `concurrency` at a time; returns latencies."""
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def client():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                status = await request(port, method, path, body)
+            except OSError:
+                status = None
+            latencies.append(time.perf_counter() - start)
+            if status is None or status >= 500:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def wait_for(port, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"server exited with {proc.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    sys.exit("server didn't start")
+
+
+def bench(mode, ids, args):
+    port = free_port()
+    env = dict(os.environ, BENCH_USER_ID=str(ids['user_id']), TEMPLATE_WARMUP='1')
+    proc = subprocess.Popen(
+        [sys.executable, '-c', SERVER, mode, str(port), str(args.threads)], env=env)
+
+    try:
+        wait_for(port, proc)
+        for name, method, path, body in ROUTES:
+            path = path.format(**ids)
+            if body is not None:
+                body = {k: v.format(**ids) for k, v in body.items()}
+
+            latencies, errors, elapsed = asyncio.run(
+                load(port, method, path, body, args.requests, args.concurrency))
+            latencies.sort()
+            p99 = latencies[int(len(latencies) * 0.99) - 1]
+            print(f"{mode:6}{name:10}{len(latencies) / elapsed:10.0f}"
+                  f"{statistics.median(latencies) * 1000:10.1f}{p99 * 1000:10.1f}"
+                  f"{errors:8}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    ids = json.loads(subprocess.run([sys.executable, '-c', SETUP],
+                                    capture_output=True, text=True, check=True).stdout)
+
+    print(f"{args.requests} requests per route, {args.concurrency} concurrent, "
+          f"{args.threads} threads")
+    print(f"{'mode':6}{'route':10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for mode in ('sync', 'asgi'):
+        bench(mode, ids, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Measure what request metrics cost per request.
+
+Two parts:
+
+- observe: the raw cost of Histogram.observe() and Counter.inc(), from
+  one thread and from THREADS threads at once (there's no lock to contend
+  on, so the per-call cost should barely move)
+- requests: the same routes served in a process with METRICS_ENABLED=1
+  and one with METRICS_ENABLED=0; the difference in mean time per
+  request is the overhead of the middleware, SQL and template hooks
+
+Run against a seeded database:
+
+    DATABASE_URL=postgresql:///warbler python bench_metrics.py
+    python bench_metrics.py --requests 1000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from metrics import Counter, Histogram
+
+THREADS = 8
+OBSERVATIONS = 200000
+
+CHILD = r'''
+import json, sys, time
+from app import app
+from models import User, Message
+
+with app.app_context():
+    user_id = User.query.first().id
+    msg_id = Message.query.first().id
+
+client = app.test_client()
+with client.session_transaction() as sess:
+    sess['curr_user'] = user_id
+
+requests = int(sys.argv[1])
+results = {}
+for route in json.loads(sys.argv[2]):
+    url = route.format(user_id=user_id, msg_id=msg_id)
+    for _ in range(10):
+        client.get(url).data
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(url).data
+    results[route] = (time.perf_counter() - start) / requests
+print(json.dumps(results))
+'''
+
+ROUTES = [
+    '/',
+    '/users/{user_id}',
+    '/messages/{msg_id}',
+    '/login',
+]
+
+
+def time_observe(threads):
+    """Mean seconds per observe()+inc() pair with `threads` threads recording."""
+
+    hist = Histogram('bench_seconds', 'Bench.', ['endpoint'])
+    counter = Counter('bench_total', 'Bench.', ['endpoint'])
+    per_thread = OBSERVATIONS // threads
+
+    def work():
+        for i in range(per_thread):
+            hist.observe(i / per_thread, 'home')
+            counter.inc('home')
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (per_thread * threads)
+
+
+def time_requests(enabled, requests):
+    env = dict(os.environ, METRICS_ENABLED='1' if enabled else '0', TEMPLATE_WARMUP='1')
+    out = subprocess.run([sys.executable, '-c', CHILD, str(requests), json.dumps(ROUTES)],
+                         env=env, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=300, help='requests per route')
+    args = parser.parse_args()
+
+    print("observe + inc, per pair:")
+    for threads in (1, THREADS):
+        print(f"  {threads} thread(s): {time_observe(threads) * 1e9:8.0f} ns")
+
+    on = time_requests(True, args.requests)
+    off = time_requests(False, args.requests)
+
+    print()
+    print(f"{'route':<24}{'off (ms)':>10}{'on (ms)':>10}{'overhead (us)':>15}")
+    for route in ROUTES:
+        print(f"{route:<24}{off[route] * 1000:>10.2f}{on[route] * 1000:>10.2f}"
+              f"{(on[route] - off[route]) * 1e6:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
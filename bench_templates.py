@@ -0,0 +1,92 @@
+"""Measure first-request latency per route, cold vs. warm.
+
+Each measurement starts a fresh Python process (a stand-in for a freshly
+started worker), imports the app and times the first request to a route:
+
+- cold: no bytecode cache, no warmup (how it used to be)
+- bytecode: warmup off, but compiled templates come from the on-disk cache
+- warm: templates compiled during startup, before the first request
+
+Run against a seeded database:
+
+    DATABASE_URL=postgresql:///warbler python bench_templates.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+RUNS = 5
+
+CHILD = r'''
+import json, sys, time
+from app import app
+from models import User, Message
+
+with app.app_context():
+    user_id = User.query.first().id
+    msg_id = Message.query.first().id
+
+route = sys.argv[1].format(user_id=user_id, msg_id=msg_id)
+client = app.test_client()
+if sys.argv[2]:
+    with client.session_transaction() as sess:
+        sess['curr_user'] = user_id
+
+start = time.perf_counter()
+resp = client.get(route)
+elapsed = time.perf_counter() - start
+print(json.dumps({'status': resp.status_code, 'seconds': elapsed}))
+'''
+
+# (route, logged in?)
+ROUTES = [
+    ('/', True),
+    ('/users', False),
+    ('/users/{user_id}', False),
+    ('/users/{user_id}/likes', False),
+    ('/users/{user_id}/following', True),
+    ('/messages/{msg_id}', False),
+    ('/trending', False),
+    ('/login', False),
+    ('/signup', False),
+]
+
+
+def first_request(route, logged_in, env):
+    """Time the first request to `route` in a brand new process."""
+
+    out = subprocess.run(
+        [sys.executable, '-c', CHILD, route, '1' if logged_in else ''],
+        env=env, check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])['seconds']
+
+
+def median_ms(route, logged_in, env):
+    times = sorted(first_request(route, logged_in, env) for _ in range(RUNS))
+    return times[len(times) // 2] * 1000
+
+
+def main():
+    cache_dir = tempfile.mkdtemp(prefix='warbler-jinja-')
+
+    modes = {
+        'cold': dict(os.environ, TEMPLATE_WARMUP='0', JINJA_CACHE_DIR=''),
+        'bytecode': dict(os.environ, TEMPLATE_WARMUP='0', JINJA_CACHE_DIR=cache_dir),
+        'warm': dict(os.environ, TEMPLATE_WARMUP='1', JINJA_CACHE_DIR=cache_dir),
+    }
+
+    # fill the bytecode cache once
+    first_request('/login', False, modes['warm'])
+
+    print(f"first-request latency, median of {RUNS} fresh processes (ms)")
+    print(f"{'route':30}" + ''.join(f"{mode:>10}" for mode in modes))
+    for route, logged_in in ROUTES:
+        row = [median_ms(route, logged_in, env) for env in modes.values()]
+        print(f"{route:30}" + ''.join(f"{ms:10.1f}" for ms in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""gzip/brotli compression of HTML and JSON responses.
+
+CompressionMiddleware wraps the WSGI app. It compresses responses when:
+
+- the client accepts gzip or br (br wins if the brotli package is installed)
+- the response is a text-ish type and not already encoded
+- the body is at least `min_size` bytes
+
+Streamed responses are compressed chunk by chunk and flushed as they go,
+so streaming keeps working. For each endpoint we keep bytes in, bytes
+out and seconds spent compressing, to weigh CPU against bandwidth.
+"""
+
+import threading
+import time
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/event-stream',
+    'application/json', 'application/javascript', 'image/svg+xml',
+    'text/csv', 'application/x-ndjson',
+)
+
+ENDPOINT_KEY = 'warbler.endpoint'
+
+
+def accepted_encodings(header):
+    """Set of codings an Accept-Encoding header allows (anything with q > 0)."""
+
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        params = params.strip()
+        q = params[2:] if params.startswith('q=') else '1'
+        try:
+            if float(q) > 0:
+                accepted.add(name.strip().lower())
+        except ValueError:
+            pass
+
+    return accepted
+
+
+def _gzip_compressor(level):
+    obj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (obj.compress,
+            lambda: obj.flush(zlib.Z_SYNC_FLUSH),
+            obj.flush)
+
+
+def _brotli_compressor(quality):
+    obj = brotli.Compressor(quality=quality)
+    return obj.process, obj.flush, obj.finish
+
+
+class CompressionStats:
+    """Per-endpoint totals."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, bytes_in, bytes_out, seconds):
+        with self._lock:
+            entry = self.endpoints.setdefault(endpoint or '(none)', {
+                'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0})
+            entry['responses'] += 1
+            entry['bytes_in'] += bytes_in
+            entry['bytes_out'] += bytes_out
+            entry['seconds'] += seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                endpoint: dict(entry, bytes_saved=entry['bytes_in'] - entry['bytes_out'])
+                for endpoint, entry in self.endpoints.items()
+            }
+
+
+class CompressionMiddleware:
+    """WSGI middleware compressing eligible responses."""
+
+    def __init__(self, app, level=6, brotli_quality=4, min_size=500):
+        self.app = app
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        self.stats = CompressionStats()
+
+    def choose(self, environ):
+        """The coding to use for this request, or None."""
+
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return None
+
+        accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli and 'br' in accepted:
+            return 'br'
+        if 'gzip' in accepted:
+            return 'gzip'
+        return None
+
+    def __call__(self, environ, start_response):
+        coding = self.choose(environ)
+        if coding is None:
+            return self.app(environ, start_response)
+
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return lambda data: None
+
+        app_iter = self.app(environ, capture)
+        status, headers, exc_info = captured
+
+        if not self._compressible(status, headers):
+            start_response(status, headers, exc_info)
+            return app_iter
+
+        length = _header(headers, 'Content-Length')
+        if length is not None and int(length) < self.min_size:
+            start_response(status, headers, exc_info)
+            return app_iter
+
+        return self._compress(environ, start_response, status, headers, exc_info,
+                              app_iter, coding, streamed=length is None)
+
+    def _compressible(self, status, headers):
+        if status[:3] in ('204', '206', '304') or status[0] == '1':
+            return False
+        if _header(headers, 'Content-Encoding'):
+            return False
+        if 'no-transform' in (_header(headers, 'Cache-Control') or ''):
+            return False
+
+        content_type = (_header(headers, 'Content-Type') or '').split(';')[0].strip()
+        return content_type in COMPRESSIBLE_TYPES
+
+    def _compress(self, environ, start_response, status, headers, exc_info,
+                  app_iter, coding, streamed):
+        """Generator yielding the compressed body; starts the response itself."""
+
+        try:
+            chunks = iter(app_iter)
+
+            # hold back a streamed body until we know it's big enough to bother
+            head = []
+            size = 0
+            for chunk in chunks:
+                head.append(chunk)
+                size += len(chunk)
+                if size >= self.min_size:
+                    break
+            else:
+                body = b''.join(head)
+                headers = _set_header(headers, 'Content-Length', str(len(body)))
+                start_response(status, headers, exc_info)
+                yield body
+                return
+
+            headers = [(k, v) for k, v in headers if k.lower() != 'content-length']
+            headers.append(('Content-Encoding', coding))
+            headers = _add_vary(headers)
+            start_response(status, headers, exc_info)
+
+            compress, flush, finish = (
+                _brotli_compressor(self.brotli_quality) if coding == 'br'
+                else _gzip_compressor(self.level))
+
+            bytes_in = bytes_out = 0
+            seconds = 0.0
+
+            def pieces():
+                yield b''.join(head)
+                yield from chunks
+
+            for piece in pieces():
+                start = time.perf_counter()
+                out = compress(piece)
+                if streamed:
+                    # push what we have to the client now
+                    out += flush()
+                seconds += time.perf_counter() - start
+                bytes_in += len(piece)
+                bytes_out += len(out)
+                if out:
+                    yield out
+
+            start = time.perf_counter()
+            out = finish()
+            seconds += time.perf_counter() - start
+            bytes_out += len(out)
+            yield out
+
+            self.stats.record(environ.get(ENDPOINT_KEY), bytes_in, bytes_out, seconds)
+
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+def _header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _set_header(headers, name, value):
+    return [(k, v) for k, v in headers if k.lower() != name.lower()] + [(name, value)]
+
+
+def _add_vary(headers):
+    vary = _header(headers, 'Vary')
+    if vary is None:
+        return headers + [('Vary', 'Accept-Encoding')]
+    if 'accept-encoding' in vary.lower():
+        return headers
+    return _set_header(headers, 'Vary', f"{vary}, Accept-Encoding")
+
+
+def init_compression(app):
+    """Wrap `app` in CompressionMiddleware, configured from app.config."""
+
+    middleware = CompressionMiddleware(
+        app.wsgi_app,
+        level=app.config['COMPRESS_LEVEL'],
+        brotli_quality=app.config['COMPRESS_BROTLI_QUALITY'],
+        min_size=app.config['COMPRESS_MIN_SIZE'])
+    app.wsgi_app = middleware
+
+    @app.before_request
+    def note_endpoint():
+        request.environ[ENDPOINT_KEY] = request.endpoint
+
+    return middleware
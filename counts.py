@@ -0,0 +1,85 @@
+"""Cached per-user totals: messages, following, followers, likes.
+
+Profile headers and the home sidebar show these on every page, and used
+to get them by loading whole relationships and taking their length. Now
+they come from one query of four COUNT subqueries, cached per user.
+
+The views that change a total call `invalidate()` for the users involved,
+and purging a user invalidates everyone they followed or were followed
+by (the user_purged signal). Everything else (a liked message being
+deleted) is covered by the cache entries' TTL of COUNTS_TTL seconds,
+which also bounds how stale another worker's copy can get.
+"""
+
+from sqlalchemy import func
+
+from models import db, Message, ArchivedMessage, Follows, Likes, ArchivedLike
+from signals import user_purged
+from stores import LRUStore
+
+COUNTS_TTL = 60
+
+
+def _count(model, condition):
+    return (db.session.query(func.count())
+            .select_from(model)
+            .filter(condition)
+            .as_scalar())
+
+
+def query_counts(user_id):
+    """The user's totals, straight from the database."""
+
+    row = db.session.query(
+        (_count(Message, Message.user_id == user_id)
+         + _count(ArchivedMessage, ArchivedMessage.user_id == user_id)).label('messages'),
+        _count(Follows, Follows.user_following_id == user_id).label('following'),
+        _count(Follows, Follows.user_being_followed_id == user_id).label('followers'),
+        (_count(Likes, Likes.user_id == user_id)
+         + _count(ArchivedLike, ArchivedLike.user_id == user_id)).label('likes'),
+    ).one()
+
+    return dict(zip(('messages', 'following', 'followers', 'likes'), row))
+
+
+class UserCounts:
+    """Read-through cache of query_counts()."""
+
+    def __init__(self, store=None, ttl=COUNTS_TTL):
+        self.store = store if store is not None else LRUStore()
+        self.ttl = ttl
+
+    def get(self, user_id):
+        counts = self.store.get(user_id)
+        if counts is None:
+            counts = query_counts(user_id)
+            self.store.set(user_id, counts, ttl=self.ttl)
+        return counts
+
+    def invalidate(self, *user_ids):
+        for user_id in user_ids:
+            self.store.delete(user_id)
+
+    def clear(self):
+        self.store.clear()
+
+    @property
+    def stats(self):
+        return self.store.stats
+
+
+def init_counts(app):
+    """Set up the counts cache and the user_counts() template helper."""
+
+    counts = UserCounts(
+        LRUStore(app.config.setdefault('COUNTS_MAX_ENTRIES', 10000)),
+        ttl=app.config.setdefault('COUNTS_TTL', COUNTS_TTL))
+    app.extensions.setdefault('caches', {})['user_counts'] = counts
+
+    def drop_purged_user(user_id, related_user_ids=(), **extra):
+        counts.invalidate(user_id, *related_user_ids)
+
+    user_purged.connect(drop_purged_user, weak=False)
+
+    app.add_template_global(counts.get, 'user_counts')
+    return counts
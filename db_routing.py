@@ -0,0 +1,107 @@
+"""Send read-only requests to database replicas.
+
+GET/HEAD requests read from one of the replica databases listed in
+SQLALCHEMY_REPLICA_URIS; everything else, and any flush, goes to the
+primary (SQLALCHEMY_DATABASE_URI). After a request writes, that browser
+session sticks to the primary for REPLICA_STICKY_SECONDS so users always
+see their own changes even if the replicas are lagging.
+
+With no replicas configured, everything goes to the primary as before.
+"""
+
+import random
+import time
+
+from flask import current_app, g, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.sql.expression import UpdateBase
+
+READ_METHODS = ('GET', 'HEAD')
+STICKY_KEY = 'db_primary_until'
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from a replica when the current request allows it."""
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.extensions.get('db_replicas')
+
+        writing = self._flushing or isinstance(clause, UpdateBase)
+
+        if replicas and not writing:
+            replica = g.get('db_replica') if request else None
+            if replica is not None:
+                return replicas[replica]
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with read-replica routing."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        super().init_app(app)
+
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+        self.configure_replicas(app, app.config['SQLALCHEMY_REPLICA_URIS'])
+
+        app.before_request(choose_database)
+        app.after_request(remember_writes)
+
+    def configure_replicas(self, app, uris):
+        """(Re)build the replica engines for `app` from a list of URIs."""
+
+        for engine in app.extensions.get('db_replicas', []):
+            engine.dispose()
+
+        app.config['SQLALCHEMY_REPLICA_URIS'] = list(uris)
+        app.extensions['db_replicas'] = [create_engine(uri) for uri in uris]
+
+
+def choose_database():
+    """Before each request: pick a replica if this request may read from one."""
+
+    g.db_replica = None
+    g.db_wrote = False
+
+    replicas = _replicas()
+    if (replicas
+            and request.method in READ_METHODS
+            and session.get(STICKY_KEY, 0) < time.time()):
+        g.db_replica = random.randrange(len(replicas))
+
+
+def remember_writes(response):
+    """After each request: stick to the primary for a while if we wrote."""
+
+    if g.get('db_wrote') and _replicas():
+        sticky_for = current_app.config['REPLICA_STICKY_SECONDS']
+        session[STICKY_KEY] = time.time() + sticky_for
+
+    return response
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def note_write(db_session, flush_context):
+    """Session after_flush hook: remember that this request wrote."""
+
+    if request:
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_bulk_update')
+@event.listens_for(RoutingSession, 'after_bulk_delete')
+def note_bulk_write(context):
+    """Same as note_write, for Query.update() and Query.delete()."""
+
+    if request:
+        g.db_wrote = True
+
+
+def _replicas():
+    return current_app.extensions.get('db_replicas')
@@ -0,0 +1,135 @@
+"""Streaming exports of users, messages, follows and likes.
+
+Tables are written as CSV, in the columns generator/*.csv use (so seed.py
+style loaders can read them), or as NDJSON, one object per line:
+
+- users: id + USERS_CSV_HEADERS
+- messages: id + MESSAGES_CSV_HEADERS (archived messages included)
+- follows: FOLLOWS_CSV_HEADERS
+- likes: LIKES_CSV_HEADERS (archived likes included)
+
+Rows are read EXPORT_BATCH_SIZE at a time through a server-side cursor
+(Query.yield_per) and written out a batch at a time, so memory use stays
+the same however big the table is.
+
+Exports can be incremental: `since_id` keeps users and messages with a
+larger id, `since` keeps messages posted after that time. follows and
+likes have neither, so they're always exported whole.
+
+    flask export messages --format ndjson --since 2021-06-01 -o messages.ndjson
+    GET /admin/export/users?format=csv&since_id=300
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import BigInteger
+
+from generator.helpers import (USERS_CSV_HEADERS, MESSAGES_CSV_HEADERS,
+                               FOLLOWS_CSV_HEADERS, LIKES_CSV_HEADERS)
+from models import db, User, Message, ArchivedMessage, Follows, Likes, ArchivedLike
+
+EXPORT_BATCH_SIZE = 1000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# table -> (columns, models its rows come from, oldest first)
+TABLES = {
+    'users': (['id'] + USERS_CSV_HEADERS, [User]),
+    'messages': (['id'] + MESSAGES_CSV_HEADERS, [ArchivedMessage, Message]),
+    'follows': (FOLLOWS_CSV_HEADERS, [Follows]),
+    'likes': (LIKES_CSV_HEADERS, [ArchivedLike, Likes]),
+}
+
+
+def export_query(model, columns, since_id=None, since=None):
+    """Query for `columns` of `model`'s rows, in primary key order."""
+
+    query = db.session.query(*(getattr(model, column) for column in columns))
+    if since_id is not None:
+        query = query.filter(model.id > since_id)
+    if since is not None:
+        query = query.filter(model.timestamp > since)
+    return query.order_by(*model.__table__.primary_key)
+
+
+def _check(table, fmt, since_id, since):
+    if table not in TABLES:
+        raise ValueError(f"Unknown table {table!r}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}")
+
+    columns, models = TABLES[table]
+    if since_id is not None and 'id' not in columns:
+        raise ValueError(f"{table} has no id to export since")
+    if since is not None and not hasattr(models[0], 'timestamp'):
+        raise ValueError(f"{table} has no timestamp to export since")
+
+
+def export_table(table, fmt='csv', since_id=None, since=None, batch_size=EXPORT_BATCH_SIZE):
+    """Generator of chunks of text (a batch of rows each) exporting `table`.
+
+    Raises ValueError straight away, before anything is written, for an
+    unknown table or format, or a `since` the table can't filter on.
+    """
+
+    _check(table, fmt, since_id, since)
+    columns, models = TABLES[table]
+    queries = [export_query(model, columns, since_id, since).yield_per(batch_size)
+               for model in models]
+
+    writer = _csv_writer if fmt == 'csv' else _ndjson_writer
+    return _chunks(writer, columns, models[-1], queries, batch_size)
+
+
+def _chunks(writer, columns, model, queries, batch_size):
+    buffer = io.StringIO()
+    write = writer(buffer, columns, model)
+
+    rows = 0
+    for query in queries:
+        for row in query:
+            write(row)
+            rows += 1
+            if rows % batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _csv_writer(buffer, columns, model):
+    """Write the CSV header; returns a function writing a row."""
+
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    return writer.writerow
+
+
+def _ndjson_writer(buffer, columns, model):
+    """Returns a function writing a row as a JSON object. Ids too big for
+    JavaScript numbers (message snowflakes) become strings, as in
+    /api/trending."""
+
+    as_str = {column for column in columns
+              if isinstance(getattr(model, column).type, BigInteger)}
+
+    def value(column, v):
+        if isinstance(v, datetime):
+            return v.isoformat()
+        if column in as_str and v is not None:
+            return str(v)
+        return v
+
+    def write(row):
+        buffer.write(json.dumps({column: value(column, v) for column, v in zip(columns, row)}))
+        buffer.write('\n')
+
+    return write
@@ -10,14 +10,11 @@ from random import choice, randint, sample
 from itertools import permutations
 import requests
 from faker import Faker
-from helpers import get_random_datetime
+from helpers import (get_random_datetime, USERS_CSV_HEADERS, MESSAGES_CSV_HEADERS,
+                     FOLLOWS_CSV_HEADERS)
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
-FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
-
 NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
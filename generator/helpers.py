@@ -3,6 +3,12 @@
 from datetime import datetime
 from random import uniform
 
+# The CSV columns seed.py loads, and export.py writes (with an id first)
+USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
+
 
 def get_random_datetime(year_gap=2):
     """Get a random datetime within the last few years."""
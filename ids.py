@@ -0,0 +1,116 @@
+"""Time-ordered 64-bit ids ("snowflakes") for messages.
+
+An id is, from the top bit down:
+
+- 41 bits: milliseconds since EPOCH (good until 2079)
+- 10 bits: worker id, so processes never hand out the same id
+- 12 bits: sequence within the millisecond
+
+Ids made later sort higher, so a feed can be ordered and paged on the
+primary key alone (WHERE id < :before ORDER BY id DESC). Ids from the old
+serial column are all far smaller than any snowflake, which keeps them in
+the right order too.
+
+The worker id is WORKER_ID from the environment, or else the process id,
+modulo 1024. Set WORKER_ID explicitly (and distinctly) when processes
+might share a pid modulo 1024, e.g. across hosts.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+EPOCH = datetime(2010, 1, 1, tzinfo=timezone.utc)
+EPOCH_MS = int(EPOCH.timestamp() * 1000)
+
+TIMESTAMP_BITS = 41
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# the largest id a BIGINT column holds
+MAX_ID = (1 << 63) - 1
+
+
+def default_worker_id():
+    return int(os.environ.get('WORKER_ID', os.getpid())) & MAX_WORKER
+
+
+def make_id(ms, worker_id=0, sequence=0):
+    """Id for epoch milliseconds `ms` (Unix time, not since EPOCH)."""
+
+    return (((ms - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS))
+            | ((worker_id & MAX_WORKER) << SEQUENCE_BITS)
+            | (sequence & MAX_SEQUENCE))
+
+
+def id_for_datetime(dt, worker_id=0, sequence=0):
+    """Id for a naive UTC datetime (like our timestamps).
+
+    With the defaults, this is the smallest id made at or after `dt`, so
+    it works as a cursor bound too.
+    """
+
+    ms = int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    return make_id(ms, worker_id, sequence)
+
+
+def datetime_for_id(snowflake):
+    """The naive UTC time `snowflake` was made."""
+
+    ms = (snowflake >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).replace(tzinfo=None)
+
+
+class SnowflakeGenerator:
+    """Thread-safe source of unique, increasing ids for one process."""
+
+    def __init__(self, worker_id=None, clock=time.time):
+        self._worker_id = worker_id
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_ms = -1
+        self._sequence = 0
+
+    @property
+    def worker_id(self):
+        if self._worker_id is not None:
+            return self._worker_id
+
+        # recomputed after a fork, so forked workers don't share an id
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._default_worker = default_worker_id()
+        return self._default_worker
+
+    def _now_ms(self):
+        return int(self.clock() * 1000)
+
+    def __call__(self):
+        with self._lock:
+            ms = self._now_ms()
+
+            # clock went backwards (NTP step): keep using the last millisecond
+            # rather than risk reissuing ids
+            if ms < self._last_ms:
+                ms = self._last_ms
+
+            if ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # 4096 ids this millisecond already; wait for the next one
+                    while ms <= self._last_ms:
+                        time.sleep(0.0001)
+                        ms = max(self._now_ms(), ms)
+            else:
+                self._sequence = 0
+
+            self._last_ms = ms
+            return make_id(ms, self.worker_id, self._sequence)
+
+
+next_message_id = SnowflakeGenerator()
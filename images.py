@@ -0,0 +1,328 @@
+"""Image proxy: fetch remote avatars/headers once, resize, serve from disk.
+
+Users' image_url/header_image_url point at third-party hosts and used to be
+hotlinked at full size. Templates now run them through the `thumbnail`
+filter, which points at /images/<size>/<token> instead; the token is the
+source URL, signed so the proxy only fetches URLs we handed out.
+
+On disk, thumbnails are stored by the hash of their contents
+(blobs/<sha256>.<ext>), with a small index file per (size, source URL)
+pointing at the blob. Identical thumbnails are stored once, and the
+content hash doubles as the ETag. A fetch that fails leaves a
+<index>.failed marker instead, so a broken URL is retried at most every
+FAILURE_TTL seconds rather than on every page view. Blobs are touched
+when served; prune_cache() (the prune-images command) drops the least
+recently used ones.
+
+Since the URLs are user-supplied, fetches only go to public addresses:
+hosts resolving to loopback, private, link-local or reserved addresses
+are refused, on every redirect too, and the address actually connected
+to is checked again (so DNS can't change its answer in between).
+"""
+
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+from itsdangerous import BadSignature, URLSafeSerializer
+from PIL import Image
+
+# name -> (width, height, crop). Twice the CSS size, for high-dpi screens.
+SIZES = {
+    'nav': (64, 64, True),            # .nav > li > a > img
+    'timeline': (96, 96, True),       # .timeline-image
+    'card': (140, 140, True),         # .card-image
+    'avatar': (400, 400, True),       # #profile-avatar
+    'card-hero': (700, 252, True),    # .card-hero
+    'hero': (1920, 1920, False),      # #warbler-hero
+}
+
+FETCH_TIMEOUT = 5
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+JPEG_QUALITY = 85
+FAILURE_TTL = 10 * 60
+
+
+class ImageProxyError(Exception):
+    """The source image couldn't be fetched or decoded."""
+
+
+def _serializer(app):
+    return URLSafeSerializer(app.config['SECRET_KEY'], salt='image-proxy')
+
+
+def proxy_url(app, url, size):
+    """Proxied URL for `url` at `size`. Local (/static/...) URLs pass through."""
+
+    if (not url or not app.config['IMAGE_PROXY_ENABLED']
+            or not url.startswith(('http://', 'https://'))):
+        return url
+
+    return f"/images/{size}/{_serializer(app).dumps(url)}"
+
+
+def source_url(app, token):
+    """The source URL signed into `token`, or None if it's been tampered with."""
+
+    try:
+        return _serializer(app).loads(token)
+    except BadSignature:
+        return None
+
+
+def _index_path(cache_dir, size, url):
+    digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, size, digest)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _is_public(ip):
+    return ip.is_global and not ip.is_multicast
+
+
+def _check_address(address):
+    """Raise ImageProxyError unless `address` (an IP string) is public."""
+
+    if not _is_public(ipaddress.ip_address(address.split('%')[0])):
+        raise ImageProxyError(f"refusing to fetch from {address}")
+
+
+def _check_url(url):
+    """Raise ImageProxyError unless `url` is http(s) on a public host."""
+
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageProxyError(f"refusing to fetch {url}")
+
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, parts.port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError, ValueError) as e:
+        raise ImageProxyError(f"couldn't resolve {url}: {e}")
+
+    for *_, sockaddr in addresses:
+        _check_address(sockaddr[0])
+
+
+class _PublicOnly:
+    """Connection mixin checking the address it actually connected to."""
+
+    def connect(self):
+        super().connect()
+        try:
+            _check_address(self.sock.getpeername()[0])
+        except ImageProxyError:
+            self.close()
+            raise
+
+
+class _PublicHTTPConnection(_PublicOnly, http.client.HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicOnly, http.client.HTTPSConnection):
+    pass
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context,
+                            check_hostname=self._check_hostname)
+
+
+class _CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        _check_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def _opener(allow_private):
+    if allow_private:
+        return urllib.request.build_opener()
+    # no proxies: one could fetch internal addresses on our behalf
+    return urllib.request.build_opener(urllib.request.ProxyHandler({}), _PublicHTTPHandler,
+                                       _PublicHTTPSHandler, _CheckedRedirectHandler)
+
+
+def fetch(url, timeout=FETCH_TIMEOUT, max_bytes=MAX_SOURCE_BYTES, allow_private=False):
+    """Download `url`, refusing anything larger than `max_bytes`, and
+    (unless `allow_private`, for development) anything not on a public
+    address."""
+
+    if not allow_private:
+        _check_url(url)
+
+    try:
+        with _opener(allow_private).open(url, timeout=timeout) as resp:
+            data = resp.read(max_bytes + 1)
+    except (OSError, ValueError) as e:
+        raise ImageProxyError(f"couldn't fetch {url}: {e}")
+
+    if len(data) > max_bytes:
+        raise ImageProxyError(f"{url} is over {max_bytes} bytes")
+
+    return data
+
+
+def resize(data, size):
+    """Thumbnail image bytes to `size`; returns (bytes, extension)."""
+
+    width, height, crop = SIZES[size]
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageProxyError(f"not an image we can read: {e}")
+
+    if crop:
+        # scale to cover the box, then trim the overflow from the middle
+        scale = max(width / img.width, height / img.height)
+        if scale < 1:
+            img = img.resize((round(img.width * scale), round(img.height * scale)),
+                             Image.LANCZOS)
+        left = max((img.width - width) // 2, 0)
+        top = max((img.height - height) // 2, 0)
+        img = img.crop((left, top, left + min(width, img.width),
+                        top + min(height, img.height)))
+    else:
+        img.thumbnail((width, height), Image.LANCZOS)
+
+    out = io.BytesIO()
+    has_alpha = (img.mode in ('RGBA', 'LA')
+                 or (img.mode == 'P' and 'transparency' in img.info))
+    if has_alpha:
+        img.save(out, 'PNG', optimize=True)
+        return out.getvalue(), 'png'
+
+    img.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True,
+                            progressive=True)
+    return out.getvalue(), 'jpg'
+
+
+def get_thumbnail(cache_dir, url, size, allow_private=False, failure_ttl=FAILURE_TTL):
+    """Path to the cached thumbnail of `url` at `size`, making it if needed.
+
+    Returns (path, content hash). Raises ImageProxyError if it can't be
+    made, or couldn't be in the last `failure_ttl` seconds.
+    """
+
+    index = _index_path(cache_dir, size, url)
+
+    try:
+        with open(index) as f:
+            blob_name = f.read().strip()
+        blob = os.path.join(cache_dir, 'blobs', blob_name)
+        # last used, for prune_cache()
+        os.utime(blob)
+        return blob, blob_name.split('.')[0]
+    except FileNotFoundError:
+        pass
+
+    failed = f"{index}.failed"
+    try:
+        if time.time() - os.path.getmtime(failed) < failure_ttl:
+            with open(failed) as f:
+                raise ImageProxyError(f.read())
+    except FileNotFoundError:
+        pass
+
+    try:
+        data, ext = resize(fetch(url, allow_private=allow_private), size)
+    except ImageProxyError as e:
+        _write_atomic(failed, str(e).encode('utf-8'))
+        raise
+    digest = hashlib.sha256(data).hexdigest()
+    blob_name = f"{digest}.{ext}"
+    blob = os.path.join(cache_dir, 'blobs', blob_name)
+
+    if not os.path.exists(blob):
+        _write_atomic(blob, data)
+    _write_atomic(index, blob_name.encode('ascii'))
+
+    return blob, digest
+
+
+def prune_cache(cache_dir, max_bytes=None, max_age=None, failure_ttl=FAILURE_TTL):
+    """Delete thumbnails not served in `max_age` seconds, then the least
+    recently served until the rest fit in `max_bytes`, along with index
+    files pointing at them and expired failure markers.
+
+    Returns (files deleted, bytes freed). A thumbnail deleted while in use
+    is just made again.
+    """
+
+    blob_dir = os.path.join(cache_dir, 'blobs')
+    blobs = []
+    try:
+        for entry in os.scandir(blob_dir):
+            # (skipping temp files still being written)
+            if entry.is_file() and not entry.name.startswith('tmp'):
+                stat = entry.stat()
+                blobs.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        pass
+    # least recently served first
+    blobs.sort()
+
+    now = time.time()
+    total = sum(blob_size for _, blob_size, _ in blobs)
+    deleted = freed = 0
+
+    for served_at, blob_size, path in blobs:
+        too_old = max_age is not None and now - served_at > max_age
+        too_big = max_bytes is not None and total > max_bytes
+        if not (too_old or too_big):
+            break
+        _remove(path)
+        total -= blob_size
+        deleted += 1
+        freed += blob_size
+
+    for size in SIZES:
+        try:
+            entries = list(os.scandir(os.path.join(cache_dir, size)))
+        except FileNotFoundError:
+            continue
+
+        for entry in entries:
+            if entry.name.endswith('.failed'):
+                stale = now - entry.stat().st_mtime >= failure_ttl
+            elif entry.name.startswith('tmp'):
+                continue
+            else:
+                try:
+                    with open(entry.path) as f:
+                        stale = not os.path.exists(os.path.join(blob_dir, f.read().strip()))
+                except FileNotFoundError:
+                    continue
+            if stale:
+                _remove(entry.path)
+                deleted += 1
+
+    return deleted, freed
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,329 @@
+"""Deferred work, run on a pool of background threads.
+
+Views enqueue side effects that the response doesn't have to wait for:
+
+    @jobs.task('publish_message')
+    def publish_message(message_id):
+        ...
+
+    jobs.enqueue('publish_message', message_id=msg.id)
+
+A task is looked up by name and called with the keyword arguments it was
+enqueued with, so those must be JSON-serializable. Tasks run inside an
+app context, JOBS_WORKERS at a time. A task that raises is retried up to
+JOBS_MAX_ATTEMPTS times, backing off exponentially from JOBS_RETRY_DELAY
+seconds, and then logged and recorded as failed.
+
+Backends (JOBS_BACKEND):
+
+- memory: a heap in this process. Jobs still queued when the process
+  exits are lost.
+- sqlite: a table in JOBS_SQLITE_PATH, shared by the processes on the
+  host, so queued jobs survive restarts. A job whose worker died is
+  picked up again once its lease (JOBS_LEASE seconds) runs out, so tasks
+  should be safe to run twice.
+
+With JOBS_EAGER set (as in the tests), enqueue() runs the task right away
+on the calling thread, and exceptions propagate.
+
+Queue depth, time spent waiting and running, and outcomes per task are
+exported on /metrics.
+"""
+
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from metrics import Counter, Histogram, Registry
+from models import db
+
+WORKERS = 4
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 1.0
+LEASE = 300
+POLL_INTERVAL = 1.0
+
+
+class Job:
+    """One call of a task, and its retry state."""
+
+    def __init__(self, name, kwargs, attempts=0, enqueued_at=None, run_at=None, id=None):
+        self.id = id
+        self.name = name
+        self.kwargs = kwargs
+        self.attempts = attempts
+        self.enqueued_at = enqueued_at if enqueued_at is not None else time.time()
+        self.run_at = run_at if run_at is not None else self.enqueued_at
+
+
+class MemoryBackend:
+    """Jobs in a heap ordered by when they're due."""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._order = itertools.count()
+        self.failed = deque(maxlen=100)
+
+    def push(self, job):
+        with self._cond:
+            heapq.heappush(self._heap, (job.run_at, next(self._order), job))
+            self._cond.notify()
+
+    def pop(self, timeout):
+        """The next due job, or None if there's none within `timeout` seconds."""
+
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                if now >= deadline:
+                    return None
+                wait = deadline - now
+                if self._heap:
+                    wait = min(wait, self._heap[0][0] - now)
+                self._cond.wait(wait)
+
+    def done(self, job):
+        pass
+
+    def retry(self, job):
+        self.push(job)
+
+    def fail(self, job, error):
+        self.failed.append((job, error))
+
+    def depth(self):
+        return len(self._heap)
+
+
+class SqliteBackend:
+    """Jobs in a SQLite table, shared by every process on the host."""
+
+    name = 'sqlite'
+
+    def __init__(self, path, lease=LEASE, poll_interval=POLL_INTERVAL):
+        self.path = path
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._pushed = threading.Condition()
+
+        self._conn().execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    name TEXT NOT NULL,
+                                    kwargs TEXT NOT NULL,
+                                    attempts INTEGER NOT NULL DEFAULT 0,
+                                    enqueued_at REAL NOT NULL,
+                                    run_at REAL NOT NULL,
+                                    status TEXT NOT NULL DEFAULT 'queued',
+                                    claimed_at REAL,
+                                    error TEXT)""")
+        self._conn().execute("CREATE INDEX IF NOT EXISTS ix_jobs_due ON jobs (status, run_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # autocommit; claim() manages its own transaction
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def push(self, job):
+        cursor = self._conn().execute(
+            "INSERT INTO jobs (name, kwargs, attempts, enqueued_at, run_at) VALUES (?, ?, ?, ?, ?)",
+            (job.name, json.dumps(job.kwargs), job.attempts, job.enqueued_at, job.run_at))
+        job.id = cursor.lastrowid
+        with self._pushed:
+            self._pushed.notify()
+
+    def claim(self):
+        """Mark the next due job (or one whose lease ran out) running; return it."""
+
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                """SELECT id, name, kwargs, attempts, enqueued_at, run_at FROM jobs
+                   WHERE (status = 'queued' AND run_at <= ?)
+                      OR (status = 'running' AND claimed_at < ?)
+                   ORDER BY run_at LIMIT 1""", (now, now - self.lease)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', claimed_at = ? WHERE id = ?",
+                             (now, row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if row is None:
+            return None
+        id, name, kwargs, attempts, enqueued_at, run_at = row
+        return Job(name, json.loads(kwargs), attempts, enqueued_at, run_at, id=id)
+
+    def pop(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            job = self.claim()
+            if job is not None or time.time() >= deadline:
+                return job
+            # woken early by a push from this process; other processes' are polled for
+            with self._pushed:
+                self._pushed.wait(min(self.poll_interval, max(deadline - time.time(), 0)))
+
+    def done(self, job):
+        self._conn().execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def retry(self, job):
+        self._conn().execute(
+            "UPDATE jobs SET status = 'queued', attempts = ?, run_at = ?, claimed_at = NULL "
+            "WHERE id = ?", (job.attempts, job.run_at, job.id))
+
+    def fail(self, job, error):
+        self._conn().execute(
+            "UPDATE jobs SET status = 'failed', attempts = ?, error = ? WHERE id = ?",
+            (job.attempts, error, job.id))
+
+    def depth(self):
+        return self._conn().execute(
+            "SELECT count(*) FROM jobs WHERE status != 'failed'").fetchone()[0]
+
+
+class JobQueue:
+    """Registered tasks, and the worker threads running them."""
+
+    def __init__(self, app, backend=None, workers=WORKERS, max_attempts=MAX_ATTEMPTS,
+                 retry_delay=RETRY_DELAY, registry=None):
+        self.app = app
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.tasks = {}
+
+        registry = registry if registry is not None else Registry()
+        self.wait_time = registry.register(Histogram(
+            'warbler_job_wait_seconds', 'Time jobs spent queued before running.', ['job']))
+        self.run_time = registry.register(Histogram(
+            'warbler_job_run_seconds', 'Time jobs spent running.', ['job']))
+        self.outcomes = registry.register(Counter(
+            'warbler_jobs_total', 'Job runs by outcome.', ['job', 'outcome']))
+        registry.add_collector(lambda: [
+            ('warbler_job_queue_depth', 'gauge', 'Jobs queued or running.',
+             [({'backend': self.backend.name}, self.backend.depth())])])
+
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._stop = threading.Event()
+
+    def task(self, name):
+        """Decorator registering a function as the task `name`."""
+
+        def register(func):
+            self.tasks[name] = func
+            return func
+        return register
+
+    def enqueue(self, name, **kwargs):
+        """Run task `name` with `kwargs` in the background."""
+
+        if name not in self.tasks:
+            raise KeyError(f"No task named {name!r}")
+
+        if self.app.config.get('JOBS_EAGER'):
+            self.tasks[name](**kwargs)
+            return
+
+        self._ensure_workers()
+        self.backend.push(Job(name, kwargs))
+
+    def _ensure_workers(self):
+        # started on first use, and again in each forked worker process
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [threading.Thread(target=self._work, daemon=True)
+                             for _ in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def _work(self):
+        while not self._stop.is_set():
+            job = self.backend.pop(timeout=1)
+            if job is not None:
+                self.run(job)
+
+    def run(self, job):
+        """Run `job` once, then mark it done or schedule its retry."""
+
+        started = time.time()
+        self.wait_time.observe(max(started - job.run_at, 0), job.name)
+        try:
+            with self.app.app_context():
+                try:
+                    self.tasks[job.name](**job.kwargs)
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            job.attempts += 1
+            if job.attempts < self.max_attempts:
+                job.run_at = time.time() + self.retry_delay * 2 ** (job.attempts - 1)
+                self.backend.retry(job)
+                self.outcomes.inc(job.name, 'retried')
+            else:
+                self.app.logger.exception("job %s failed after %d attempts",
+                                          job.name, job.attempts)
+                self.backend.fail(job, repr(e))
+                self.outcomes.inc(job.name, 'failed')
+        else:
+            self.backend.done(job)
+            self.outcomes.inc(job.name, 'completed')
+        finally:
+            self.run_time.observe(time.time() - started, job.name)
+
+    def stop(self):
+        self._stop.set()
+
+    def serialize(self):
+        return {
+            'backend': self.backend.name,
+            'depth': self.backend.depth(),
+            'workers': len(self._threads),
+        }
+
+
+def init_jobs(app, registry=None):
+    """Create the job queue, with the backend named by JOBS_BACKEND."""
+
+    backend = app.config.setdefault('JOBS_BACKEND', 'memory')
+    if backend == 'memory':
+        backend = MemoryBackend()
+    elif backend == 'sqlite':
+        backend = SqliteBackend(
+            app.config.setdefault('JOBS_SQLITE_PATH', os.path.join(app.root_path, 'jobs.db')),
+            lease=app.config.setdefault('JOBS_LEASE', LEASE))
+    else:
+        raise ValueError(f"Unknown JOBS_BACKEND {backend!r}")
+
+    queue = JobQueue(app, backend,
+                     workers=app.config.setdefault('JOBS_WORKERS', WORKERS),
+                     max_attempts=app.config.setdefault('JOBS_MAX_ATTEMPTS', MAX_ATTEMPTS),
+                     retry_delay=app.config.setdefault('JOBS_RETRY_DELAY', RETRY_DELAY),
+                     registry=registry)
+    app.config.setdefault('JOBS_EAGER', False)
+
+    app.extensions['jobs'] = queue
+    return queue
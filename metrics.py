@@ -0,0 +1,360 @@
+"""Request metrics, served in Prometheus text format on /metrics.
+
+MetricsMiddleware wraps the WSGI app and, for every request, records by
+endpoint:
+
+- warbler_request_seconds: time from the request arriving until the last
+  byte of the body is sent (streamed pages included)
+- warbler_response_bytes: body size as sent (after compression)
+- warbler_db_seconds / warbler_template_seconds: time spent in SQL
+  queries and in Jinja rendering during the request
+- warbler_requests_total: requests by endpoint and status code
+
+Histograms have fixed buckets. Counts are kept in per-thread shards that
+only their own thread writes to, so recording takes no lock; shards are
+summed when /metrics is scraped. Other stats the app keeps (sessions,
+compression, realtime, caches) are exported through collectors.
+
+With METRICS_TOKEN set, scrapes need "Authorization: Bearer <token>";
+without one, only direct requests from loopback are answered.
+"""
+
+import bisect
+import ipaddress
+import threading
+import time
+
+from flask import Response, has_request_context, request, g, abort
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from compression import ENDPOINT_KEY
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+TIMINGS_KEY = 'warbler.timings'
+
+
+class _Shards:
+    """Per-thread lists of numbers, summed on read.
+
+    Each thread only ever writes its own list. Lists belonging to threads
+    that have exited are folded into `_retired`, so thread-per-request
+    servers don't grow the shard list forever.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._live = []
+        self._retired = [0] * size
+
+    def mine(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = [0] * self.size
+            with self._lock:
+                self._fold_dead()
+                self._live.append((threading.current_thread(), values))
+            return values
+
+    def _fold_dead(self):
+        alive = []
+        for thread, values in self._live:
+            if thread.is_alive():
+                alive.append((thread, values))
+            else:
+                self._retired = [a + b for a, b in zip(self._retired, values)]
+        self._live = alive
+
+    def totals(self):
+        with self._lock:
+            self._fold_dead()
+            totals = list(self._retired)
+            for _, values in self._live:
+                totals = [a + b for a, b in zip(totals, values)]
+        return totals
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self):
+        """(suffix, labels dict, value) for every sample."""
+
+        for values, child in sorted(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            yield from self._child_samples(labels, child.totals())
+
+
+class Counter(_Metric):
+    """Monotonic counter."""
+
+    type = 'counter'
+
+    def _new_child(self):
+        return _Shards(1)
+
+    def inc(self, *labels, amount=1):
+        self.labels(*labels).mine()[0] += amount
+
+    def _child_samples(self, labels, totals):
+        yield '', labels, totals[0]
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets, plus their sum."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        # one slot per bucket, one for +Inf, one for the sum
+        return _Shards(len(self.buckets) + 2)
+
+    def observe(self, value, *labels):
+        values = self.labels(*labels).mine()
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def _child_samples(self, labels, totals):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), totals[:-1]):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield '_bucket', dict(labels, le=le), cumulative
+        yield '_sum', labels, totals[-1]
+        yield '_count', labels, cumulative
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+             for k, v in labels.items())
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Registry:
+    """Metrics and collectors, rendered together for /metrics."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """`collector()` returns [(name, type, help, [(labels dict, value)])]."""
+
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+
+        for collector in self.collectors:
+            for name, type, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics:
+    """The per-request metrics MetricsMiddleware records."""
+
+    def __init__(self, registry):
+        self.latency = registry.register(Histogram(
+            'warbler_request_seconds', 'Time to send the full response.', ['endpoint']))
+        self.size = registry.register(Histogram(
+            'warbler_response_bytes', 'Response body size as sent.', ['endpoint'],
+            buckets=SIZE_BUCKETS))
+        self.db = registry.register(Histogram(
+            'warbler_db_seconds', 'Time in SQL queries per request.', ['endpoint']))
+        self.template = registry.register(Histogram(
+            'warbler_template_seconds', 'Time rendering templates per request.', ['endpoint']))
+        self.requests = registry.register(Counter(
+            'warbler_requests_total', 'Requests by endpoint and status.', ['endpoint', 'status']))
+
+
+class MetricsMiddleware:
+    """WSGI middleware recording RequestMetrics for every request."""
+
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        timings = environ[TIMINGS_KEY] = {'db': 0.0, 'template': 0.0}
+        status = []
+
+        def capture(code, headers, exc_info=None):
+            status[:] = [code[:3]]
+            return start_response(code, headers, exc_info)
+
+        app_iter = self.app(environ, capture)
+        return self._body(environ, app_iter, start, timings, status)
+
+    def _body(self, environ, app_iter, start, timings, status):
+        size = 0
+        try:
+            for chunk in app_iter:
+                size += len(chunk)
+                yield chunk
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+            endpoint = environ.get(ENDPOINT_KEY) or 'none'
+            m = self.metrics
+            m.latency.observe(time.perf_counter() - start, endpoint)
+            m.size.observe(size, endpoint)
+            m.db.observe(timings['db'], endpoint)
+            m.template.observe(timings['template'], endpoint)
+            m.requests.inc(endpoint, status[0] if status else '500')
+
+
+def _timings():
+    if has_request_context():
+        return request.environ.get(TIMINGS_KEY)
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['warbler_query_start'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['warbler_query_start']
+    timings = _timings()
+    if timings is not None:
+        timings['db'] += elapsed
+
+
+def _template_started(app, template, context):
+    g.setdefault('_template_starts', []).append(time.perf_counter())
+
+
+def _template_finished(app, template, context):
+    starts = g.get('_template_starts')
+    timings = _timings()
+    if starts and timings is not None:
+        elapsed = time.perf_counter() - starts.pop()
+        # a render started inside another one is part of the outer one's time
+        if not starts:
+            timings['template'] += elapsed
+
+
+def stats_collector(name, help, get_stats):
+    """Collector exporting a flat dict of numbers (StoreStats.as_dict() and
+    the like) as one gauge, labelled by key."""
+
+    def collect():
+        stats = get_stats()
+        if stats is None:
+            return []
+        return [(name, 'gauge', help,
+                 [({'stat': key}, value) for key, value in sorted(stats.items())])]
+
+    return collect
+
+
+def compression_collector(stats):
+    """Collector for CompressionStats: bytes in and out per endpoint."""
+
+    def collect():
+        endpoints = sorted(stats.as_dict().items())
+        return [
+            ('warbler_compression_input_bytes_total', 'counter', 'Bytes before compression.',
+             [({'endpoint': e}, entry['bytes_in']) for e, entry in endpoints]),
+            ('warbler_compression_output_bytes_total', 'counter', 'Bytes after compression.',
+             [({'endpoint': e}, entry['bytes_out']) for e, entry in endpoints]),
+        ]
+
+    return collect
+
+
+def is_local_request(environ):
+    """Did this request come straight from this host (not via a proxy)?"""
+
+    if environ.get('HTTP_X_FORWARDED_FOR'):
+        return False
+    try:
+        return ipaddress.ip_address(environ.get('REMOTE_ADDR') or '').is_loopback
+    except ValueError:
+        return False
+
+
+def init_metrics(app, registry=None):
+    """Wrap `app` in MetricsMiddleware and add the /metrics endpoint.
+
+    Call after any other WSGI middleware is installed, so the time and
+    bytes measured are what the client sees.
+    """
+
+    registry = registry or Registry()
+    metrics = RequestMetrics(registry)
+
+    if not app.config.setdefault('METRICS_ENABLED', True):
+        return registry
+
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app, metrics)
+
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Prometheus text exposition of the app's metrics."""
+
+        token = app.config.get('METRICS_TOKEN')
+        if token:
+            if request.headers.get('Authorization') != f"Bearer {token}":
+                abort(403)
+        elif not is_local_request(request.environ):
+            abort(403)
+
+        return Response(registry.render(),
+                        mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    app.extensions['metrics'] = registry
+    return registry
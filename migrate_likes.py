@@ -0,0 +1,124 @@
+"""Rebuild `likes` with a (user_id, message_id) primary key.
+
+The old table had a surrogate id and a unique constraint on message_id
+alone, so only one user could ever like a given message. This copies it
+into a new table keyed on (user_id, message_id) with an index on
+message_id, then swaps the two:
+
+    python migrate_likes.py                   # copy in batches, swap, keep likes_old
+    python migrate_likes.py --drop-old        # ... and drop likes_old afterwards
+
+Rows are copied in ranges of the old id, one transaction per batch, so
+the app keeps running meanwhile. Likes added or removed during the copy
+are caught up in the final swap. On Postgres the swap takes a lock on
+`likes`, so writes pause only for that last short step.
+"""
+
+import argparse
+
+from sqlalchemy import inspect, text
+
+from app import app
+from models import db
+
+MIGRATE_BATCH_SIZE = 5000
+
+CREATE_NEW = """
+CREATE TABLE likes_new (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    message_id BIGINT NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    PRIMARY KEY (user_id, message_id)
+)
+"""
+
+# WHERE is required before ON CONFLICT in INSERT ... SELECT on SQLite
+COPY_RANGE = """
+INSERT INTO likes_new (user_id, message_id)
+SELECT DISTINCT user_id, message_id FROM likes
+WHERE id > :low AND id <= :high
+  AND user_id IS NOT NULL AND message_id IS NOT NULL
+ON CONFLICT DO NOTHING
+"""
+
+
+def is_migrated(conn):
+    """Has likes already lost its surrogate id?"""
+
+    columns = {c['name'] for c in inspect(conn).get_columns('likes')}
+    return 'id' not in columns
+
+
+def copy_likes(engine, batch_size=MIGRATE_BATCH_SIZE, progress=None):
+    """Create likes_new and copy likes into it; returns the last old id copied."""
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS likes_new"))
+        conn.execute(text(CREATE_NEW))
+        high_water = conn.execute(text("SELECT max(id) FROM likes")).scalar() or 0
+
+    low = 0
+    while low < high_water:
+        high = min(low + batch_size, high_water)
+        with engine.begin() as conn:
+            conn.execute(text(COPY_RANGE), low=low, high=high)
+        low = high
+        if progress:
+            progress(low, high_water)
+
+    return high_water
+
+
+def swap_tables(engine, copied_up_to, drop_old=False):
+    """Catch likes_new up with changes made during the copy, then swap it in."""
+
+    postgres = engine.dialect.name == 'postgresql'
+
+    with engine.begin() as conn:
+        if postgres:
+            conn.execute(text("LOCK TABLE likes IN EXCLUSIVE MODE"))
+
+        # likes added during the copy...
+        conn.execute(text(COPY_RANGE), low=copied_up_to,
+                     high=conn.execute(text("SELECT max(id) FROM likes")).scalar() or 0)
+        # ...and likes removed during it
+        conn.execute(text("""
+            DELETE FROM likes_new WHERE NOT EXISTS (
+                SELECT 1 FROM likes
+                WHERE likes.user_id = likes_new.user_id
+                  AND likes.message_id = likes_new.message_id)
+        """))
+
+        conn.execute(text("ALTER TABLE likes RENAME TO likes_old"))
+        conn.execute(text("ALTER TABLE likes_new RENAME TO likes"))
+        if postgres:
+            conn.execute(text("ALTER INDEX likes_pkey RENAME TO likes_old_pkey"))
+            conn.execute(text("ALTER INDEX likes_new_pkey RENAME TO likes_pkey"))
+        conn.execute(text("CREATE INDEX ix_likes_message_id ON likes (message_id)"))
+
+        if drop_old:
+            conn.execute(text("DROP TABLE likes_old"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=MIGRATE_BATCH_SIZE)
+    parser.add_argument('--drop-old', action='store_true', help='drop likes_old when done')
+    args = parser.parse_args()
+
+    with app.app_context():
+        engine = db.engine
+        with engine.connect() as conn:
+            if is_migrated(conn):
+                print("likes is already keyed on (user_id, message_id)")
+                return
+
+        def report(done, total):
+            print(f"copied likes up to id {done} of {total}")
+
+        copied = copy_likes(engine, args.batch_size, progress=report)
+        swap_tables(engine, copied, drop_old=args.drop_old)
+        print("likes migrated")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Widen message id columns to BIGINT, for snowflake ids (see ids.py).
+
+Message ids used to come from a serial INTEGER column; snowflakes need 64
+bits, so on a database created before they came in, the first new message
+overflows. This alters, wherever they're still INTEGER:
+
+- messages.id (dropping the old serial default; ids.py assigns them now)
+- likes.message_id
+- messages_archive.id and likes_archive.message_id
+
+    python migrate_message_ids.py             # alter the columns
+    python migrate_message_ids.py --dry-run   # just print the statements
+
+Existing ids keep their values, and are all smaller than any snowflake,
+so feeds stay in order. On Postgres each ALTER rewrites its table under an
+exclusive lock, so the app can't use it until the migration commits; run
+it at a quiet time. SQLite's INTEGER is already 64 bits, so there's
+nothing to do there.
+"""
+
+import argparse
+
+from sqlalchemy import BigInteger, inspect, text
+
+from app import app
+from models import db
+
+# (table, column) pairs holding message ids
+COLUMNS = [
+    ('messages', 'id'),
+    ('likes', 'message_id'),
+    ('messages_archive', 'id'),
+    ('likes_archive', 'message_id'),
+]
+
+
+def pending_statements(conn):
+    """The ALTERs still needed on the database behind `conn`."""
+
+    if conn.dialect.name != 'postgresql':
+        return []
+
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    statements = []
+
+    for table, column in COLUMNS:
+        if table not in tables:
+            continue
+        info = {c['name']: c for c in inspector.get_columns(table)}[column]
+        if isinstance(info['type'], BigInteger):
+            continue
+
+        statements.append(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT")
+        if (table, column) == ('messages', 'id') and info.get('default'):
+            statements.append("ALTER TABLE messages ALTER COLUMN id DROP DEFAULT")
+
+    return statements
+
+
+def widen_ids(engine):
+    """Alter every message id column still INTEGER; returns the statements run."""
+
+    # one transaction, so a failure leaves every column as it was
+    with engine.begin() as conn:
+        statements = pending_statements(conn)
+        for statement in statements:
+            conn.execute(text(statement))
+
+    return statements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help='print, but don\'t run, the ALTERs')
+    args = parser.parse_args()
+
+    with app.app_context():
+        engine = db.engine
+        if args.dry_run:
+            with engine.connect() as conn:
+                statements = pending_statements(conn)
+        else:
+            statements = widen_ids(engine)
+
+        for statement in statements:
+            print(statement)
+        if not statements:
+            print("message ids are already BIGINT")
+        elif not args.dry_run:
+            print("message ids widened")
+
+
+if __name__ == '__main__':
+    main()
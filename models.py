@@ -3,10 +3,13 @@
 from datetime import datetime
 
 from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+
+from db_routing import RoutingSQLAlchemy
+from ids import next_message_id
+from signals import profile_updated
 
 bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -28,24 +31,26 @@ class Follows(db.Model):
 
 
 class Likes(db.Model):
-    """Mapping user likes to warbles."""
+    """Mapping user likes to warbles.
 
-    __tablename__ = 'likes' 
+    Keyed on (user_id, message_id): "has this user liked this message" is
+    a primary-key lookup, and the index on message_id serves the other
+    direction (everyone who liked a message).
+    """
 
-    id = db.Column(
-        db.Integer,
-        primary_key=True
-    )
+    __tablename__ = 'likes' 
 
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
-        db.Integer,
+        db.BigInteger,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
+        index=True,
     )
 
 
@@ -94,25 +99,43 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    is_admin = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+    )
+
+    # usernames and emails are unique regardless of case; these indexes
+    # enforce that and serve User.taken()'s lookups
+    __table_args__ = (
+        db.Index('ix_users_username_lower', db.func.lower(username), unique=True),
+        db.Index('ix_users_email_lower', db.func.lower(email), unique=True),
+    )
+
+    # passive_deletes: leave child/association rows to the database's
+    # ON DELETE CASCADE instead of loading them to delete one by one
+    messages = db.relationship('Message', passive_deletes=True)
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        passive_deletes=True
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        passive_deletes=True
     )
 
     likes = db.relationship(
         'Message',
-        secondary="likes"
+        secondary="likes",
+        passive_deletes=True
     )
 
     def __repr__(self):
@@ -121,15 +144,20 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
+        found_user_list = [user for user in self.followers if user.id == other_user.id]
         return len(found_user_list) == 1
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
+        found_user_list = [user for user in self.following if user.id == other_user.id]
         return len(found_user_list) == 1
 
+    def has_liked(self, message):
+        """Has this user liked `message`? (A primary-key lookup, not a load of self.likes.)"""
+
+        return Likes.query.get((self.id, message.id)) is not None
+
     @classmethod
     def signup(cls, username, email, password, image_url):
         """Sign up user.
@@ -149,6 +177,26 @@ class User(db.Model):
         db.session.add(user)
         return user
 
+    @classmethod
+    def taken(cls, username=None, email=None, exclude_id=None):
+        """Which of `username` and `email` another user already has
+        (ignoring case), as a list of field names.
+
+        Cheap (an index lookup each), so signup calls it before hashing
+        the password. `exclude_id` skips that user, for profile edits.
+        """
+
+        taken = []
+        for name, value in (('username', username), ('email', email)):
+            if not value:
+                continue
+            query = cls.query.filter(db.func.lower(getattr(cls, name)) == value.lower())
+            if exclude_id is not None:
+                query = query.filter(cls.id != exclude_id)
+            if db.session.query(query.exists()).scalar():
+                taken.append(name)
+        return taken
+
     @classmethod
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
@@ -170,16 +218,41 @@ class User(db.Model):
         return False
 
     def edit_user(self, username, email, image_url, header_img_url, location, bio):
-        """Allows user to edit profile"""
-        self.username = username
-        self.email = email
-        self.image_url = image_url
-        self.header_image_url = header_img_url
-        self.location = location
-        self.bio = bio
+        """Allows user to edit profile. Returns the changes made (see profile_changes)."""
+
+        changes = self.profile_changes(
+            username=username, email=email, image_url=image_url,
+            header_image_url=header_img_url, location=location, bio=bio)
+        self.apply_profile_changes(changes)
+        return changes
+
+    def profile_changes(self, **fields):
+        """The subset of `fields` whose values differ from this user's.
 
+        Empty and missing (None) count as the same, so an untouched
+        optional field in a form isn't a change.
+        """
+
+        return {name: value for name, value in fields.items()
+                if (getattr(self, name) or '') != (value or '')}
+
+    def apply_profile_changes(self, changes):
+        """Write `changes` (from profile_changes) and send profile_updated.
+
+        Only the changed columns are set, so the UPDATE only names those;
+        with no changes there's no UPDATE and no commit at all.
+        """
+
+        if not changes:
+            return
+
+        previous = {name: getattr(self, name) for name in changes}
+        for name, value in changes.items():
+            setattr(self, name, value)
         db.session.commit()
 
+        profile_updated.send(self, changes=changes, previous=previous)
+
     def check_password(self, entered_password):
         """Checks that user enters correct password"""
 
@@ -192,9 +265,12 @@ class Message(db.Model):
 
     __tablename__ = 'messages'
 
+    # time-ordered, so feeds sort and page on id alone (see ids.py)
     id = db.Column(
-        db.Integer,
+        db.BigInteger,
         primary_key=True,
+        autoincrement=False,
+        default=next_message_id,
     )
 
     text = db.Column(
@@ -205,7 +281,8 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
+        index=True,
     )
 
     user_id = db.Column(
@@ -216,10 +293,72 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    archived = False
+
     def __repr__(self):
         return f"<Message #{self.id}, Text: {self.text}, user_id: {self.user_id}>"
 
 
+class ArchivedMessage(db.Model):
+    """A message old enough to have been moved out of `messages`.
+
+    `messages` only holds recent warbles, which is all the feeds read;
+    archive.py moves older ones here, keeping their ids.
+    """
+
+    __tablename__ = 'messages_archive'
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    text = db.Column(
+        db.String(140),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        index=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True,
+    )
+
+    user = db.relationship('User')
+
+    archived = True
+
+    def __repr__(self):
+        return f"<ArchivedMessage #{self.id}, Text: {self.text}, user_id: {self.user_id}>"
+
+
+class ArchivedLike(db.Model):
+    """A like of an archived message."""
+
+    __tablename__ = 'likes_archive'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages_archive.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -228,3 +367,4 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    bcrypt.init_app(app)
@@ -0,0 +1,201 @@
+"""Cached profile page data: a user's profile fields and newest message ids.
+
+users_show() used to load the user and run an ordered query for their
+newest FEED_PAGE_SIZE messages on every view. Profiles are read far more
+often than they change, so both results are cached per user:
+
+- profile(user_id): the columns the profile pages show, as a UserProfile
+- recent_messages(user_id): the first page of messages, from a cached list
+  of ids (loading rows by primary key is much cheaper than the ordered
+  scan that finds them)
+
+Entries live in an in-process LRU tier and, with PROFILE_CACHE_SQLITE_PATH
+set, a SQLite tier shared by the workers on the host. Writes invalidate
+both tiers in the writing process:
+
+- messages_add / messages_destroy: invalidate_messages()
+- profile edits: the profile_updated signal
+- account deletion (self-service, admin or CLI purges): the user_purged
+  signal
+
+Other workers' in-process tiers catch up within PROFILE_CACHE_TTL, which is
+why it's kept short. The shared tier is dropped on every write, so its
+entries can live longer (PROFILE_CACHE_SHARED_TTL); that TTL only bounds
+the rare read that races a write and caches what it read before it.
+"""
+
+import json
+from collections import namedtuple
+
+from models import db, User, Message, ArchivedMessage
+from signals import profile_updated, user_purged
+from stores import LRUStore, SqliteStore
+
+PROFILE_TTL = 30
+SHARED_TTL = 300
+RECENT_MESSAGES = 100
+
+PROFILE_FIELDS = ('id', 'username', 'image_url', 'header_image_url', 'bio', 'location')
+
+UserProfile = namedtuple('UserProfile', PROFILE_FIELDS)
+
+
+class TieredStats:
+    """Both tiers' StoreStats, as one flat dict."""
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+
+    def as_dict(self):
+        stats = {}
+        for name, store in self.tiers.items():
+            for field, value in store.stats.as_dict().items():
+                stats[f"{name}_{field}"] = value
+        return stats
+
+
+class TieredStore:
+    """An LRUStore in front of an optional shared store."""
+
+    def __init__(self, local, shared=None, ttl=PROFILE_TTL, shared_ttl=SHARED_TTL):
+        self.local = local
+        self.shared = shared
+        self.ttl = ttl
+        self.shared_ttl = shared_ttl
+
+        tiers = {'local': local}
+        if shared is not None:
+            tiers['shared'] = shared
+        self.stats = TieredStats(tiers)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value, ttl=self.ttl)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value, ttl=self.ttl)
+        if self.shared is not None:
+            self.shared.set(key, value, ttl=self.shared_ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+
+def query_recent_message_ids(user_id, limit):
+    """Ids of the user's newest `limit` messages, topped up from the archive."""
+
+    ids = []
+    for model in (Message, ArchivedMessage):
+        ids.extend(row.id for row in (db.session.query(model.id)
+                                      .filter(model.user_id == user_id)
+                                      .order_by(model.id.desc())
+                                      .limit(limit - len(ids))))
+        if len(ids) >= limit:
+            break
+    return ids
+
+
+def load_messages(ids):
+    """Messages with these ids, in the same order, skipping any since deleted."""
+
+    found = {msg.id: msg for msg in Message.query.filter(Message.id.in_(ids))}
+    missing = [msg_id for msg_id in ids if msg_id not in found]
+    if missing:
+        found.update((msg.id, msg) for msg in
+                     ArchivedMessage.query.filter(ArchivedMessage.id.in_(missing)))
+    return [found[msg_id] for msg_id in ids if msg_id in found]
+
+
+class ProfileCache:
+    """Read-through cache of profile fields and recent message ids."""
+
+    def __init__(self, store=None, recent=RECENT_MESSAGES):
+        self.store = store if store is not None else TieredStore(LRUStore())
+        self.recent = recent
+
+    def profile(self, user_id):
+        """The user's UserProfile, or None if there's no such user."""
+
+        key = f"profile:{user_id}"
+        fields = self.store.get(key)
+        if fields is None:
+            user = User.query.get(user_id)
+            if user is None:
+                return None
+            fields = {name: getattr(user, name) for name in PROFILE_FIELDS}
+            self.store.set(key, fields)
+        return UserProfile(**fields)
+
+    def recent_message_ids(self, user_id):
+        key = f"messages:{user_id}"
+        ids = self.store.get(key)
+        if ids is None:
+            ids = query_recent_message_ids(user_id, self.recent)
+            self.store.set(key, ids)
+        return ids
+
+    def recent_messages(self, user_id):
+        """The user's newest messages, newest first."""
+
+        return load_messages(self.recent_message_ids(user_id))
+
+    def invalidate_profile(self, *user_ids):
+        for user_id in user_ids:
+            self.store.delete(f"profile:{user_id}")
+
+    def invalidate_messages(self, *user_ids):
+        for user_id in user_ids:
+            self.store.delete(f"messages:{user_id}")
+
+    def invalidate(self, *user_ids):
+        self.invalidate_profile(*user_ids)
+        self.invalidate_messages(*user_ids)
+
+    def clear(self):
+        self.store.clear()
+
+    @property
+    def stats(self):
+        return self.store.stats
+
+
+def init_profile_cache(app):
+    """Set up the profile cache and its invalidation on profile edits and
+    purges."""
+
+    local = LRUStore(app.config.setdefault('PROFILE_CACHE_MAX_ENTRIES', 10000))
+
+    shared = None
+    path = app.config.setdefault('PROFILE_CACHE_SQLITE_PATH', None)
+    if path:
+        shared = SqliteStore(path, serializer=json, table='profile_cache')
+        shared.purge_expired()
+
+    cache = ProfileCache(
+        TieredStore(local, shared,
+                    ttl=app.config.setdefault('PROFILE_CACHE_TTL', PROFILE_TTL),
+                    shared_ttl=app.config.setdefault('PROFILE_CACHE_SHARED_TTL', SHARED_TTL)),
+        recent=app.config.setdefault('PROFILE_CACHE_RECENT', RECENT_MESSAGES))
+
+    def drop_edited_profile(user, **extra):
+        cache.invalidate_profile(user.id)
+
+    def drop_purged_user(user_id, **extra):
+        cache.invalidate(user_id)
+
+    profile_updated.connect(drop_edited_profile, weak=False)
+    user_purged.connect(drop_purged_user, weak=False)
+
+    app.extensions.setdefault('caches', {})['profile_cache'] = cache
+    return cache
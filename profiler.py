@@ -0,0 +1,243 @@
+"""Sampling profiler for live requests.
+
+Opt-in: a request is profiled when PROFILE_SAMPLE_RATE is N > 0 and it
+wins a 1-in-N draw, or when it carries an X-Warbler-Profile header equal
+to PROFILE_TOKEN. While a profiled request runs, a background thread
+snapshots its stack every PROFILE_INTERVAL milliseconds.
+
+When the request finishes (after the last byte, for streamed pages), its
+stacks are appended to PROFILE_DIR/<endpoint>.folded in the "collapsed
+stack" format flamegraph.pl and speedscope read:
+
+    app.py:homepage;models.py:__repr__ 12
+
+Repeated stacks across requests are summed by those tools, so appending
+is enough. Each file is rotated to .1, .2, ... once it reaches
+PROFILE_MAX_BYTES, keeping PROFILE_KEEP old files.
+
+Overhead is bounded: unprofiled requests pay for one random draw, at most
+PROFILE_MAX_ACTIVE requests are profiled at once, and each stops being
+sampled after MAX_SAMPLES samples.
+"""
+
+import collections
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from flask import request, g
+
+PROFILE_HEADER = 'X-Warbler-Profile'
+INTERVAL = 5
+MAX_ACTIVE = 4
+MAX_SAMPLES = 2000
+MAX_DEPTH = 100
+MAX_BYTES = 5 * 1024 * 1024
+KEEP = 3
+
+
+class ProfilerStats:
+    """Counters for profiled requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profiled = 0
+        self.skipped = 0
+        self.samples = 0
+        self.rotations = 0
+
+    def incr(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'profiled': self.profiled,
+                'skipped': self.skipped,
+                'samples': self.samples,
+                'rotations': self.rotations,
+            }
+
+
+class Profile:
+    """Stacks sampled from one request's thread."""
+
+    def __init__(self, thread_id, endpoint):
+        self.thread_id = thread_id
+        self.endpoint = endpoint
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+
+def _frame_label(code, _cache={}):
+    label = _cache.get(code)
+    if label is None:
+        filename = os.path.basename(code.co_filename)
+        label = _cache[code] = f"{filename}:{code.co_name}"
+    return label
+
+
+def fold(frame, max_depth=MAX_DEPTH):
+    """`frame`'s stack as one collapsed line, outermost call first."""
+
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class Profiler:
+    """Samples profiled requests' threads and writes their stacks to disk."""
+
+    def __init__(self, directory, sample_rate=0, token=None, interval=INTERVAL,
+                 max_active=MAX_ACTIVE, max_bytes=MAX_BYTES, keep=KEEP):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        self.interval = interval / 1000
+        self.max_active = max_active
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.stats = ProfilerStats()
+
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._active = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def wants(self, headers):
+        """Should a request with these headers be profiled?"""
+
+        if self.token:
+            sent = headers.get(PROFILE_HEADER)
+            if sent and hmac.compare_digest(sent, self.token):
+                return True
+        return self.sample_rate > 0 and random.randrange(self.sample_rate) == 0
+
+    def start(self, endpoint):
+        """Start sampling the calling thread; returns a Profile, or None if
+        too many requests are being profiled already."""
+
+        profile = Profile(threading.get_ident(), endpoint or 'none')
+        with self._lock:
+            if len(self._active) >= self.max_active:
+                self.stats.incr('skipped')
+                return None
+            self._ensure_thread()
+            self._active[profile.thread_id] = profile
+            self._wake.set()
+        return profile
+
+    def stop(self, profile):
+        """Stop sampling and append the profile's stacks to its file."""
+
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+        self.stats.incr('profiled')
+        self.stats.incr('samples', profile.samples)
+        if profile.stacks:
+            self.write(profile)
+
+    def _ensure_thread(self):
+        # (re)started after a fork, since threads don't survive one
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._wake.clear()
+                    continue
+                self.sample()
+
+    def sample(self):
+        """Take one sample of every active profile. Call with _lock held."""
+
+        frames = sys._current_frames()
+        for profile in self._active.values():
+            frame = frames.get(profile.thread_id)
+            if frame is not None and profile.samples < MAX_SAMPLES:
+                profile.stacks[fold(frame)] += 1
+                profile.samples += 1
+
+    def path_for(self, endpoint):
+        return os.path.join(self.directory, re.sub(r'[^\w.-]', '_', endpoint) + '.folded')
+
+    def write(self, profile):
+        path = self.path_for(profile.endpoint)
+        lines = ''.join(f"{stack} {count}\n" for stack, count in profile.stacks.items())
+
+        with self._write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            try:
+                if os.path.getsize(path) >= self.max_bytes:
+                    self._rotate(path)
+            except FileNotFoundError:
+                pass
+            # one O_APPEND write per request, so workers sharing the file
+            # don't interleave their lines
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, lines.encode('utf-8'))
+            finally:
+                os.close(fd)
+
+    def _rotate(self, path):
+        for n in range(self.keep - 1, 0, -1):
+            if os.path.exists(f"{path}.{n}"):
+                os.replace(f"{path}.{n}", f"{path}.{n + 1}")
+        if self.keep:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+        self.stats.incr('rotations')
+
+
+def init_profiler(app):
+    """Profile requests if PROFILE_SAMPLE_RATE or PROFILE_TOKEN is set;
+    returns the Profiler or None."""
+
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+    token = app.config.get('PROFILE_TOKEN')
+    if not sample_rate and not token:
+        return None
+
+    profiler = Profiler(
+        app.config.get('PROFILE_DIR') or os.path.join(app.root_path, '.profiles'),
+        sample_rate=sample_rate,
+        token=token,
+        interval=app.config.get('PROFILE_INTERVAL', INTERVAL),
+        max_active=app.config.get('PROFILE_MAX_ACTIVE', MAX_ACTIVE),
+        max_bytes=app.config.get('PROFILE_MAX_BYTES', MAX_BYTES),
+        keep=app.config.get('PROFILE_KEEP', KEEP))
+
+    def start_profile():
+        if profiler.wants(request.headers):
+            g._profile = profiler.start(request.endpoint)
+
+    # teardown runs after a streamed body has been sent, so that's included
+    @app.teardown_request
+    def stop_profile(exc):
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            profiler.stop(profile)
+
+    # ahead of every other before_request hook, so they're profiled too
+    app.before_request_funcs.setdefault(None, []).insert(0, start_profile)
+
+    app.extensions['profiler'] = profiler
+    return profiler
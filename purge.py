@@ -0,0 +1,197 @@
+"""Set-based deletion of user accounts.
+
+Deleting a user through the ORM loads their messages, likes and follows
+so it can clean up after them. Here everything is deleted with plain
+DELETE statements in batches of at most `batch_size` rows, committing
+between batches so no single transaction (or lock) grows with the size
+of the account.
+"""
+
+import threading
+import time
+import uuid
+
+from sqlalchemy import tuple_
+
+from models import db, User, Message, Follows, Likes, ArchivedMessage, ArchivedLike
+from signals import user_purged
+
+PURGE_BATCH_SIZE = 1000
+
+# finished jobs' progress can be polled for this long
+KEEP_FINISHED = 24 * 60 * 60
+
+
+def _delete_in_batches(model, key, condition, batch_size):
+    """Delete rows of `model` matching `condition`, `batch_size` at a time.
+
+    `key` is a column, or a tuple of columns, that together with
+    `condition` picks out a single row (e.g. the followed user for one
+    follower). Returns rows deleted.
+    """
+
+    columns = key if isinstance(key, tuple) else (key,)
+    match = tuple_(*columns) if len(columns) > 1 else columns[0]
+
+    deleted = 0
+    while True:
+        keys = [k if len(columns) > 1 else k[0]
+                for k in (db.session.query(*columns)
+                          .filter(condition)
+                          .limit(batch_size))]
+        if not keys:
+            return deleted
+
+        deleted += (model.query
+                    .filter(condition, match.in_(keys))
+                    .delete(synchronize_session=False))
+        db.session.commit()
+
+
+def purge_user(user_id, batch_size=PURGE_BATCH_SIZE):
+    """Delete one user and everything that belongs to them, then send
+    user_purged.
+
+    Returns the number of rows deleted.
+    """
+
+    deleted = 0
+    message_ids = []
+
+    # their messages, along with everyone's likes of those messages,
+    # from both the live and archive tables
+    for msg_model, like_model in ((Message, Likes), (ArchivedMessage, ArchivedLike)):
+        while True:
+            msg_ids = [m for (m,) in (db.session.query(msg_model.id)
+                                      .filter(msg_model.user_id == user_id)
+                                      .limit(batch_size))]
+            if not msg_ids:
+                break
+            message_ids.extend(msg_ids)
+
+            deleted += _delete_in_batches(
+                like_model, (like_model.user_id, like_model.message_id),
+                like_model.message_id.in_(msg_ids), batch_size)
+            deleted += (msg_model.query
+                        .filter(msg_model.id.in_(msg_ids))
+                        .delete(synchronize_session=False))
+            db.session.commit()
+
+    deleted += _delete_in_batches(
+        Likes, Likes.message_id, Likes.user_id == user_id, batch_size)
+    deleted += _delete_in_batches(
+        ArchivedLike, ArchivedLike.message_id, ArchivedLike.user_id == user_id, batch_size)
+    # whoever they followed or were followed by; their totals change
+    related_user_ids = (
+        {u for (u,) in (db.session.query(Follows.user_being_followed_id)
+                        .filter(Follows.user_following_id == user_id))}
+        | {u for (u,) in (db.session.query(Follows.user_following_id)
+                          .filter(Follows.user_being_followed_id == user_id))})
+
+    deleted += _delete_in_batches(
+        Follows, Follows.user_being_followed_id,
+        Follows.user_following_id == user_id, batch_size)
+    deleted += _delete_in_batches(
+        Follows, Follows.user_following_id,
+        Follows.user_being_followed_id == user_id, batch_size)
+
+    deleted += (User.query
+                .filter(User.id == user_id)
+                .delete(synchronize_session=False))
+    db.session.commit()
+
+    user_purged.send(user_id, message_ids=message_ids,
+                     related_user_ids=sorted(related_user_ids))
+    return deleted
+
+
+def purge_users(user_ids, batch_size=PURGE_BATCH_SIZE, progress=None):
+    """Delete many users, one at a time.
+
+    `progress`, if given, is called as progress(done, total, rows_deleted)
+    after each user. Returns the total number of rows deleted.
+    """
+
+    user_ids = list(user_ids)
+    deleted = 0
+
+    for done, user_id in enumerate(user_ids, start=1):
+        deleted += purge_user(user_id, batch_size)
+        if progress:
+            progress(done, len(user_ids), deleted)
+
+    return deleted
+
+
+class PurgeJob:
+    """A purge running on a background thread, with pollable progress.
+
+    Jobs are kept in `jobs` until KEEP_FINISHED seconds after they finish.
+    """
+
+    jobs = {}
+    _jobs_lock = threading.Lock()
+
+    def __init__(self, app, user_ids, batch_size=PURGE_BATCH_SIZE):
+        self.id = uuid.uuid4().hex
+        self.app = app
+        self.user_ids = list(user_ids)
+        self.batch_size = batch_size
+
+        self.done = 0
+        self.rows_deleted = 0
+        self.status = 'pending'
+        self.error = None
+        self.finished_at = None
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    @classmethod
+    def start(cls, app, user_ids, batch_size=PURGE_BATCH_SIZE):
+        """Start purging `user_ids` in the background; return the job."""
+
+        job = cls(app, user_ids, batch_size)
+        with cls._jobs_lock:
+            cls.prune()
+            cls.jobs[job.id] = job
+        job.thread.start()
+        return job
+
+    @classmethod
+    def prune(cls, keep=KEEP_FINISHED):
+        """Forget jobs that finished more than `keep` seconds ago."""
+
+        cutoff = time.time() - keep
+        for job_id, job in list(cls.jobs.items()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                del cls.jobs[job_id]
+
+    def _progress(self, done, total, rows_deleted):
+        self.done = done
+        self.rows_deleted = rows_deleted
+
+    def _run(self):
+        self.status = 'running'
+        with self.app.app_context():
+            try:
+                purge_users(self.user_ids, self.batch_size, self._progress)
+                self.status = 'finished'
+            except Exception as e:
+                db.session.rollback()
+                self.status = 'failed'
+                self.error = str(e)
+            finally:
+                db.session.remove()
+                self.finished_at = time.time()
+
+    def serialize(self):
+        """Progress report as a dict, for JSON."""
+
+        return {
+            'id': self.id,
+            'status': self.status,
+            'total': len(self.user_ids),
+            'done': self.done,
+            'rows_deleted': self.rows_deleted,
+            'error': self.error,
+        }
@@ -0,0 +1,232 @@
+"""Token-bucket rate limits on write endpoints.
+
+Each limited endpoint has two budgets, written like "10/minute":
+
+- per user: how fast one user may call it
+- total: how fast everyone together may, which caps the commits the
+  endpoint can cost us
+
+A budget of "N/period" is a bucket holding up to N tokens, refilled at N
+per period; a request takes a token from both the user's bucket and the
+endpoint's, or, if either is empty, from neither. It then gets a 429
+with a Retry-After header saying when it can go ahead. (So retries
+against an exhausted total budget don't use up the user's own.)
+Anonymous requests aren't limited (the views turn them away anyway).
+
+Buckets live in a store with a single method:
+
+    take([(key, rate, capacity), ...]) -> seconds to wait; 0 if a token
+        was taken from every bucket, otherwise none was
+
+MemoryBuckets keeps them in this process; SqliteBuckets in a local SQLite
+file shared by all workers on the machine (RATELIMIT_BACKEND=sqlite).
+"""
+
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import g, jsonify
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 60 * 60, 'day': 24 * 60 * 60}
+
+# tokens added per second, and the most the bucket holds
+Limit = namedtuple('Limit', 'rate capacity')
+
+
+def parse_limit(spec):
+    """Limit for "N/period" (e.g. "10/minute"), or None for an empty spec."""
+
+    if not spec:
+        return None
+
+    count, _, period = spec.partition('/')
+    if period not in PERIODS or not count.isdigit() or int(count) == 0:
+        raise ValueError(f"Bad rate limit {spec!r}; expected e.g. '10/minute'")
+
+    return Limit(int(count) / PERIODS[period], int(count))
+
+
+class RateLimitStats:
+    """Allowed and limited request counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def incr(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def as_dict(self):
+        with self._lock:
+            return {'allowed': self.allowed, 'limited': self.limited}
+
+
+def _wait(buckets, levels):
+    """Seconds until every bucket has a token, given their current levels."""
+
+    return max([(1 - tokens) / rate
+                for (_, rate, _), tokens in zip(buckets, levels) if tokens < 1], default=0)
+
+
+class MemoryBuckets:
+    """Buckets in this process. Past `max_keys`, the longest idle bucket is
+    dropped; it would have refilled by now anyway."""
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        # key -> (tokens, last updated), least recently used first
+        self._buckets = OrderedDict()
+
+    def take(self, buckets):
+        now = self.clock()
+
+        with self._lock:
+            levels = []
+            for key, rate, capacity in buckets:
+                tokens, updated = self._buckets.pop(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - updated) * rate))
+
+            wait = _wait(buckets, levels)
+            for (key, _, _), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens if wait else tokens - 1, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SqliteBuckets:
+    """Buckets in a local SQLite file, shared by every process on the host."""
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._local = threading.local()
+
+        self._connect().execute("CREATE TABLE IF NOT EXISTS buckets ("
+                                "key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # autocommit; take() manages its own transaction
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, buckets):
+        now = self.clock()
+        conn = self._connect()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            for key, rate, capacity in buckets:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?",
+                                   (key,)).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                levels.append(min(capacity, tokens + max(now - updated, 0) * rate))
+
+            wait = _wait(buckets, levels)
+            conn.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated) "
+                             "VALUES (?, ?, ?)",
+                             [(key, tokens if wait else tokens - 1, now)
+                              for (key, _, _), tokens in zip(buckets, levels)])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        return wait
+
+    def clear(self):
+        self._connect().execute("DELETE FROM buckets")
+
+
+class RateLimiter:
+    """Per-user and per-endpoint budgets for named endpoints."""
+
+    def __init__(self, app, store, limits):
+        self.app = app
+        self.store = store
+        # name -> (per user Limit or None, total Limit or None)
+        self.limits = limits
+        self.stats = RateLimitStats()
+
+    def check(self, name, user_id):
+        """Take a token from each of `name`'s buckets for `user_id`. Returns
+        0 if the request may go ahead, otherwise seconds until it may be
+        retried (and no token was taken)."""
+
+        per_user, total = self.limits[name]
+        buckets = []
+        if per_user:
+            buckets.append((f"{name}:user:{user_id}",) + per_user)
+        if total:
+            buckets.append((f"{name}:all",) + total)
+
+        wait = self.store.take(buckets) if buckets else 0
+
+        self.stats.incr('limited' if wait else 'allowed')
+        return wait
+
+    def limit(self, name):
+        """Decorator applying budget `name` to a view."""
+
+        if name not in self.limits:
+            raise KeyError(f"No rate limit named {name!r}")
+
+        def decorator(view):
+            @wraps(view)
+            def limited(*args, **kwargs):
+                if self.app.config['RATELIMIT_ENABLED'] and g.user:
+                    wait = self.check(name, g.user.id)
+                    if wait:
+                        resp = jsonify({'result': 'Too many requests'})
+                        resp.status_code = 429
+                        resp.headers['Retry-After'] = str(math.ceil(wait))
+                        return resp
+
+                return view(*args, **kwargs)
+            return limited
+        return decorator
+
+
+def init_ratelimit(app):
+    """Create the rate limiter, with budgets from the RATELIMIT_* config."""
+
+    app.config.setdefault('RATELIMIT_ENABLED', True)
+    backend = app.config.setdefault('RATELIMIT_BACKEND', 'memory')
+    if backend == 'memory':
+        store = MemoryBuckets()
+    elif backend == 'sqlite':
+        store = SqliteBuckets(app.config['RATELIMIT_SQLITE_PATH'])
+    else:
+        raise ValueError(f"Unknown RATELIMIT_BACKEND {backend!r}")
+
+    limits = {
+        'messages': (parse_limit(app.config.get('RATELIMIT_MESSAGES_PER_USER')),
+                     parse_limit(app.config.get('RATELIMIT_MESSAGES_TOTAL'))),
+        'likes': (parse_limit(app.config.get('RATELIMIT_LIKES_PER_USER')),
+                  parse_limit(app.config.get('RATELIMIT_LIKES_TOTAL'))),
+    }
+
+    limiter = RateLimiter(app, store, limits)
+    # so the tests can start each one with full buckets
+    app.extensions.setdefault('caches', {})['ratelimit'] = store
+    app.extensions['ratelimit'] = limiter
+    return limiter
@@ -0,0 +1,321 @@
+"""Pushing new messages to open home pages with server-sent events.
+
+A browser on the home page opens GET /feed/stream and keeps it open. It
+is subscribed to the authors it follows (and itself). When someone posts,
+messages_add publishes the message and every subscriber following its
+author gets it as an SSE event, which static/app.js adds to the top of
+the feed.
+
+- Hub: the subscribers in this process, indexed by author.
+- Brokers carry published events to hubs. LocalBroker hands them
+  straight to this process's hub. SqliteBroker goes through a shared
+  SQLite file, so every worker on the host sees every post. Each worker
+  polls the file and delivers to its own subscribers.
+- Backpressure: each subscriber has a queue of at most `queue_size`
+  events. A client that falls that far behind is sent a `resync` event
+  and disconnected, rather than letting its queue grow without limit.
+  app.js reloads the page on resync.
+
+Every open stream holds a server thread for as long as the page is open,
+so live feed is off unless REALTIME_ENABLED is set, and each process
+holds at most REALTIME_MAX_CONNECTIONS streams. By default that's a
+quarter of its request threads (SERVER_THREADS), leaving the rest for
+everything else; a cap that would leave none raises at startup. Home
+pages without a stream (live feed off, or the cap reached) poll
+/feed/new every 30 seconds instead.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+QUEUE_SIZE = 100
+HEARTBEAT = 15
+# share of a process's request threads that streams may hold
+STREAM_SHARE = 4
+
+RESYNC = object()
+
+
+class HubStats:
+    """Connection and event counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.connections_total = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def incr(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'connections': self.connections,
+                'connections_total': self.connections_total,
+                'published': self.published,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'rejected': self.rejected,
+            }
+
+
+class Subscription:
+    """One open stream: a bounded queue of events for one user."""
+
+    def __init__(self, user_id, authors, queue_size):
+        self.user_id = user_id
+        self.authors = frozenset(authors)
+        self.queue = queue.Queue(queue_size)
+        self.lagging = False
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def offer(self, event):
+        """Queue `event`; False (and mark lagging) if the queue is full."""
+
+        with self._lock:
+            if self.lagging:
+                return False
+            try:
+                self.queue.put_nowait(event)
+                return True
+            except queue.Full:
+                self.lagging = True
+                # swap the oldest event for the resync marker so the stream notices
+                self.queue.get_nowait()
+                self.queue.put_nowait(RESYNC)
+                return False
+
+    def get(self, timeout):
+        """Next event, RESYNC, or None after `timeout` seconds of nothing."""
+
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Hub:
+    """This process's subscribers, and delivery of events to them."""
+
+    def __init__(self, queue_size=QUEUE_SIZE, max_connections=None):
+        self.queue_size = queue_size
+        self.max_connections = max_connections
+        self.broker = LocalBroker(self)
+        self.stats = HubStats()
+        self._lock = threading.Lock()
+        self._by_author = {}
+
+    def subscribe(self, user_id, authors):
+        """New Subscription to `authors`' posts, or None if we're at capacity
+        (`max_connections`; None for no cap)."""
+
+        sub = Subscription(user_id, authors, self.queue_size)
+        with self._lock:
+            if (self.max_connections is not None
+                    and self.stats.connections >= self.max_connections):
+                self.stats.incr('rejected')
+                return None
+            for author in sub.authors:
+                self._by_author.setdefault(author, set()).add(sub)
+            self.stats.incr('connections')
+            self.stats.incr('connections_total')
+        return sub
+
+    def unsubscribe(self, sub):
+        """Forget `sub`. Safe to call more than once."""
+
+        with self._lock:
+            if sub.closed:
+                return
+            sub.closed = True
+            for author in sub.authors:
+                subs = self._by_author.get(author)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._by_author[author]
+            self.stats.incr('connections', -1)
+
+    def publish(self, event):
+        """Send `event` (a dict with an 'author_id') to subscribers everywhere."""
+
+        self.stats.incr('published')
+        self.broker.publish(event)
+
+    def deliver(self, event):
+        """Hand `event` to this process's subscribers to its author."""
+
+        with self._lock:
+            subs = list(self._by_author.get(event['author_id'], ()))
+
+        for sub in subs:
+            self.stats.incr('delivered' if sub.offer(event) else 'dropped')
+
+    def close(self):
+        self.broker.close()
+
+
+class LocalBroker:
+    """Single process: publishing is delivering."""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, event):
+        self.hub.deliver(event)
+
+    def close(self):
+        pass
+
+
+class SqliteBroker:
+    """Events shared by every process on the host through a SQLite file.
+
+    publish() appends a row; a thread in each process polls for rows it
+    hasn't seen every `poll_interval` seconds and delivers them to its hub.
+    Rows older than `keep` seconds are pruned.
+    """
+
+    def __init__(self, hub, path, poll_interval=0.25, keep=60):
+        self.hub = hub
+        self.path = path
+        self.poll_interval = poll_interval
+        self.keep = keep
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute("""CREATE TABLE IF NOT EXISTS events (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            created REAL NOT NULL,
+                            payload TEXT NOT NULL)""")
+        conn.commit()
+
+        # only events published from now on
+        self._last_id = conn.execute("SELECT coalesce(max(id), 0) FROM events").fetchone()[0]
+
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._poll, daemon=True)
+        self.thread.start()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def publish(self, event):
+        conn = self._conn()
+        conn.execute("INSERT INTO events (created, payload) VALUES (?, ?)",
+                     (time.time(), json.dumps(event)))
+        conn.commit()
+
+    def poll(self):
+        """Deliver events we haven't seen yet; returns how many."""
+
+        conn = self._conn()
+        rows = conn.execute("SELECT id, payload FROM events WHERE id > ? ORDER BY id",
+                            (self._last_id,)).fetchall()
+        for row_id, payload in rows:
+            self._last_id = row_id
+            self.hub.deliver(json.loads(payload))
+        return len(rows)
+
+    def _poll(self):
+        last_prune = 0
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+                if time.time() - last_prune > self.keep:
+                    conn = self._conn()
+                    conn.execute("DELETE FROM events WHERE created < ?",
+                                 (time.time() - self.keep,))
+                    conn.commit()
+                    last_prune = time.time()
+            except sqlite3.Error:
+                # a busy/locked file: try again next tick
+                pass
+
+    def close(self):
+        self._stop.set()
+        self.thread.join()
+
+
+def sse(event=None, data=None, id=None, retry=None, comment=None):
+    """One server-sent event, encoded."""
+
+    lines = []
+    if comment is not None:
+        lines.append(f": {comment}")
+    if retry is not None:
+        lines.append(f"retry: {retry}")
+    if id is not None:
+        lines.append(f"id: {id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    if data is not None:
+        lines.extend(f"data: {line}" for line in json.dumps(data).splitlines())
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def stream(hub, sub, heartbeat=HEARTBEAT):
+    """Generator of SSE bytes for `sub`, until the client goes or falls behind."""
+
+    try:
+        yield sse(retry=5000)
+        while True:
+            event = sub.get(timeout=heartbeat)
+            if event is None:
+                # keeps proxies from timing the connection out, and
+                # notices clients that have gone away
+                yield sse(comment='keepalive')
+            elif event is RESYNC:
+                yield sse(event='resync', data={})
+                return
+            else:
+                yield sse(event='message', id=event['id'], data=event)
+    finally:
+        hub.unsubscribe(sub)
+
+
+def max_connections(threads, configured=None):
+    """How many streams a process with `threads` request threads may hold:
+    `configured`, if it leaves threads over, or a STREAM_SHARE of them."""
+
+    if configured is None:
+        return threads // STREAM_SHARE
+    if configured >= threads:
+        raise ValueError(f"REALTIME_MAX_CONNECTIONS ({configured}) must be below "
+                         f"the {threads} request threads (SERVER_THREADS), or open "
+                         f"streams would leave none for other requests")
+    return configured
+
+
+def init_realtime(app):
+    """Create the hub, with the broker named by REALTIME_BROKER."""
+
+    app.config.setdefault('REALTIME_ENABLED', False)
+    threads = app.config.setdefault('SERVER_THREADS', 1)
+    hub = Hub(app.config.setdefault('REALTIME_QUEUE_SIZE', QUEUE_SIZE),
+              max_connections(threads, app.config.get('REALTIME_MAX_CONNECTIONS')))
+
+    broker = app.config.setdefault('REALTIME_BROKER', 'local')
+    if broker == 'sqlite':
+        hub.broker = SqliteBroker(hub, app.config.setdefault(
+            'REALTIME_SQLITE_PATH', os.path.join(app.root_path, 'realtime.db')))
+    elif broker != 'local':
+        raise ValueError(f"Unknown REALTIME_BROKER {broker!r}")
+
+    app.extensions['realtime'] = hub
+    return hub
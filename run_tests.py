@@ -0,0 +1,103 @@
+"""Run the test modules in parallel, each worker with its own database.
+
+    python run_tests.py                 # one worker per CPU
+    python run_tests.py -j 4            # four workers
+    python run_tests.py test_user_views.py test_user_model.py
+
+Worker N runs its modules against TEST_DATABASE_URL with "_N" added to
+the database name (postgresql:///warbler_test_3, or warbler_test_3.db for
+SQLite). Missing Postgres databases are created first.
+"""
+
+import argparse
+import glob
+import os
+import queue
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+DEFAULT_URL = "postgresql:///warbler_test"
+
+
+def worker_url(base_url, n):
+    """URL for worker `n`'s database."""
+
+    url = make_url(base_url)
+    if url.get_backend_name() == 'sqlite':
+        root, ext = os.path.splitext(url.database)
+        url.database = f"{root}_{n}{ext or '.db'}"
+    else:
+        url.database = f"{url.database}_{n}"
+    return str(url)
+
+
+def ensure_database(url):
+    """Create the Postgres database at `url` if it's missing."""
+
+    url = make_url(url)
+    if url.get_backend_name() != 'postgresql':
+        return
+
+    name = url.database
+    url.database = 'postgres'
+    engine = create_engine(str(url), isolation_level='AUTOCOMMIT')
+    with engine.connect() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM pg_database WHERE datname = %s", (name,)).scalar()
+        if not exists:
+            conn.execute(f'CREATE DATABASE "{name}"')
+    engine.dispose()
+
+
+def run_module(module, databases):
+    """Run one test module with a free worker database; return (ok, output)."""
+
+    url = databases.get()
+    try:
+        env = dict(os.environ, TEST_DATABASE_URL=url)
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-m', 'unittest', module[:-len('.py')]],
+            env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+    finally:
+        databases.put(url)
+
+    return result.returncode == 0, f"{module} ({elapsed:.1f}s)\n{result.stderr}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', help='test modules (default: test_*.py)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    modules = args.modules or sorted(glob.glob('test_*.py'))
+    jobs = max(1, min(args.jobs, len(modules)))
+    base_url = os.environ.get('TEST_DATABASE_URL', DEFAULT_URL)
+
+    databases = queue.Queue()
+    for n in range(jobs):
+        url = worker_url(base_url, n)
+        ensure_database(url)
+        databases.put(url)
+
+    with ThreadPoolExecutor(jobs) as pool:
+        results = list(pool.map(lambda module: run_module(module, databases), modules))
+
+    failed = 0
+    for ok, output in results:
+        print(output)
+        failed += not ok
+
+    print(f"{len(modules) - failed}/{len(modules)} modules passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
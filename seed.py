@@ -1,10 +1,22 @@
 """Seed database with sample data from CSV Files."""
 
 from csv import DictReader
+from datetime import datetime
+
 from app import db
+from ids import id_for_datetime
 from models import User, Message, Follows
 
 
+def message_rows(rows):
+    """Give each message the snowflake id it would have got when it was posted."""
+
+    for n, row in enumerate(rows):
+        timestamp = datetime.fromisoformat(row['timestamp'])
+        yield dict(row, timestamp=timestamp,
+                   id=id_for_datetime(timestamp, sequence=n))
+
+
 db.drop_all()
 db.create_all()
 
@@ -12,7 +24,7 @@ with open('generator/users.csv') as users:
     db.session.bulk_insert_mappings(User, DictReader(users))
 
 with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+    db.session.bulk_insert_mappings(Message, message_rows(DictReader(messages)))
 
 with open('generator/follows.csv') as follows:
     db.session.bulk_insert_mappings(Follows, DictReader(follows))
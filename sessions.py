@@ -0,0 +1,168 @@
+"""Server-side sessions.
+
+A logged-in user's session data lives in a store (see stores.py) on our
+side; the cookie only carries a random session id, so it stays small no
+matter how many flash messages pile up, and nothing has to be signed or
+verified per request. Anonymous sessions (just flashes, usually) stay in
+a signed cookie, as with Flask's own sessions, so they cost the store
+nothing and can't crowd logged-in users out of it.
+
+A session id that's new (a login, or a fresh session) is written through
+to the store at once, so the next request sees it whichever worker it
+lands on, even when SESSION_WRITE_BATCH batches other writes.
+
+Pick the backend with SESSION_BACKEND:
+
+- "sqlite": a local SQLite file at SESSION_SQLITE_PATH, shared by all
+  workers on the machine and kept across restarts (the default)
+- "memory": an LRU in this process (one worker only; everyone is logged
+  out when it restarts)
+- "cookie": Flask's usual signed-cookie session, for everything
+"""
+
+import atexit
+import copy
+import os
+import secrets
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from itsdangerous import BadSignature
+from werkzeug.datastructures import CallbackDict
+
+from stores import LRUStore, SqliteStore
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id (None until it's first stored)
+    and whether it was changed."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.old_sid = None
+
+    def regenerate(self):
+        """Move this session to a fresh id (e.g. on login, against fixation)."""
+
+        self.old_sid = self.old_sid or self.sid
+        self.sid = None
+        self.modified = True
+
+
+def new_session_id():
+    return secrets.token_urlsafe(24)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface storing sessions that hold `user_key` (i.e.
+    logged-in ones) in `store`, and the rest in a signed cookie."""
+
+    def __init__(self, store, user_key):
+        self.store = store
+        self.user_key = user_key
+        self.cookie_interface = SecureCookieSessionInterface()
+
+    def open_session(self, app, request):
+        value = request.cookies.get(app.session_cookie_name)
+
+        # session ids are URL-safe base64, which never has the dots of a
+        # signed cookie
+        if value and '.' not in value:
+            data = self.store.get(value)
+            if data is not None:
+                return ServerSideSession(copy.deepcopy(data), sid=value)
+
+        elif value:
+            serializer = self.cookie_interface.get_signing_serializer(app)
+            try:
+                data = serializer.loads(
+                    value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+                return ServerSideSession(data)
+            except BadSignature:
+                pass
+
+        return ServerSideSession(new=True)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.old_sid:
+            self.store.delete(session.old_sid)
+
+        if not session:
+            if session.modified and not session.new:
+                if session.sid:
+                    self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+
+        # Only touch the store when something changed, or when a permanent
+        # session's expiry is being pushed back. The cookie itself only needs
+        # sending when its value changes or its expiry does.
+        refresh = session.permanent and self.should_set_cookie(app, session)
+
+        if self.user_key not in session:
+            # logged out (or never logged in): back to a signed cookie
+            if session.sid:
+                self.store.delete(session.sid)
+            if session.modified or session.sid or refresh:
+                value = self.cookie_interface.get_signing_serializer(app).dumps(dict(session))
+                self._set_cookie(app, session, response, value)
+            return
+
+        fresh = session.sid is None
+        if fresh:
+            session.sid = new_session_id()
+
+        if fresh or session.modified or refresh:
+            ttl = app.permanent_session_lifetime.total_seconds()
+            self.store.set(session.sid, dict(session), ttl=ttl)
+            if fresh:
+                # the next request may go to another worker; it has to find this
+                self.store.flush()
+
+        if fresh or refresh:
+            self._set_cookie(app, session, response, session.sid)
+
+    def _set_cookie(self, app, session, response, value):
+        response.set_cookie(app.session_cookie_name, value,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=self.get_cookie_domain(app),
+                            path=self.get_cookie_path(app),
+                            secure=self.get_cookie_secure(app))
+
+
+def init_sessions(app, user_key):
+    """Install the session backend named by app.config['SESSION_BACKEND'];
+    sessions holding `user_key` are the ones kept in its store."""
+
+    backend = app.config.setdefault('SESSION_BACKEND', 'sqlite')
+
+    if backend == 'memory':
+        store = LRUStore(app.config.setdefault('SESSION_MAX_ENTRIES', 10000))
+    elif backend == 'sqlite':
+        store = SqliteStore(
+            app.config.setdefault('SESSION_SQLITE_PATH',
+                                  os.path.join(app.root_path, 'sessions.db')),
+            serializer=TaggedJSONSerializer(),
+            table='sessions',
+            batch_size=app.config.setdefault('SESSION_WRITE_BATCH', 1),
+            write_interval=app.config.setdefault('SESSION_WRITE_INTERVAL', 1.0))
+        store.purge_expired()
+        atexit.register(store.flush)
+    elif backend == 'cookie':
+        return None
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND {backend!r}")
+
+    app.session_interface = ServerSideSessionInterface(store, user_key)
+    return store
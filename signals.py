@@ -0,0 +1,23 @@
+"""Signals the app sends, for caches and the like to hook into.
+
+    from signals import profile_updated
+
+    @profile_updated.connect
+    def forget_profile(user, changes, previous):
+        ...
+"""
+
+from flask.signals import Namespace
+
+warbler_signals = Namespace()
+
+# Sent by User.apply_profile_changes after the commit, with the user as
+# sender. `changes` maps each changed column to its new value, `previous`
+# to its old one; unchanged columns are in neither.
+profile_updated = warbler_signals.signal('profile-updated')
+
+# Sent by purge_user once a user and their rows are deleted, with the
+# user's id as sender. `message_ids` are the ids of their deleted messages
+# (live and archived), `related_user_ids` the users they followed or were
+# followed by.
+user_purged = warbler_signals.signal('user-purged')
@@ -31,6 +31,45 @@ try {
 
 
 
+// Signup form: say whether the username/email is free while it's typed,
+// instead of after submitting
+const signupForm = document.querySelector('form[data-check-availability]')
+
+function checkAvailability(input) {
+    let timer = null
+    const note = document.createElement('small')
+    input.after(note)
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer)
+        note.textContent = ''
+        const value = input.value.trim()
+        if (!value) {
+            return
+        }
+        timer = setTimeout(async function () {
+            try {
+                const res = await axios.get('/api/availability', {
+                    params: { [input.name]: value }
+                })
+                if (input.value.trim() !== value) {
+                    return
+                }
+                const free = res.data[input.name]
+                note.className = free ? 'text-success' : 'text-danger'
+                note.textContent = free ? `${input.name} available` : `${input.name} already taken`
+            } catch {
+                console.log('availability check failed')
+            }
+        }, 300)
+    })
+}
+
+if (signupForm) {
+    signupForm.querySelectorAll('[name=username], [name=email]').forEach(checkAvailability)
+}
+
+
 // When the user clicks on the button, open the modal
 msgBtn.addEventListener('click', function () {
     modal.style.display = "block";
@@ -65,3 +104,89 @@ try {
 } catch {
     console.log('submit btn not found')
 }
+
+
+// Live feed: new messages from people we follow arrive over server-sent
+// events and are added to the top of the home page feed. If the server
+// has live feed off, or no stream to spare, we poll for them instead.
+const liveFeed = document.querySelector('[data-poll]')
+const POLL_INTERVAL = 30 * 1000
+
+function messageItem(msg) {
+    const li = document.createElement('li')
+    li.className = 'list-group-item'
+
+    const permalink = document.createElement('a')
+    permalink.href = `/messages/${msg.id}`
+    permalink.className = 'message-link'
+    li.append(permalink)
+
+    const avatarLink = document.createElement('a')
+    avatarLink.href = `/users/${msg.author_id}`
+    const avatar = document.createElement('img')
+    avatar.src = msg.image_url
+    avatar.alt = ''
+    avatar.className = 'timeline-image'
+    avatarLink.append(avatar)
+    li.append(avatarLink)
+
+    const area = document.createElement('div')
+    area.className = 'message-area'
+    const userLink = document.createElement('a')
+    userLink.href = `/users/${msg.author_id}`
+    userLink.textContent = `@${msg.username}`
+    const date = document.createElement('span')
+    date.className = 'text-muted'
+    date.textContent = ` ${msg.timestamp}`
+    const text = document.createElement('p')
+    text.textContent = msg.text
+    area.append(userLink, date, text)
+    li.append(area)
+
+    return li
+}
+
+// ids are strings: they're too big for JavaScript numbers
+function newestId() {
+    const link = liveFeed.querySelector('.message-link')
+    return link ? link.getAttribute('href').split('/').pop() : '0'
+}
+
+function poll() {
+    let after = newestId()
+    setInterval(async function () {
+        try {
+            const res = await axios.get(liveFeed.dataset.poll, { params: { after } })
+            for (const msg of res.data.messages) {
+                liveFeed.prepend(messageItem(msg))
+                after = msg.id
+            }
+        }
+        catch {
+            console.log('poll failed')
+        }
+    }, POLL_INTERVAL)
+}
+
+if (liveFeed && liveFeed.dataset.stream && window.EventSource) {
+    const events = new EventSource(liveFeed.dataset.stream)
+
+    events.addEventListener('message', function (e) {
+        liveFeed.prepend(messageItem(JSON.parse(e.data)))
+    })
+
+    // we fell too far behind and missed messages; start over
+    events.addEventListener('resync', function () {
+        events.close()
+        window.location.reload()
+    })
+
+    // refused (the server is at its cap): the browser won't retry, so poll
+    events.addEventListener('error', function () {
+        if (events.readyState === EventSource.CLOSED) {
+            poll()
+        }
+    })
+} else if (liveFeed) {
+    poll()
+}
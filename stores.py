@@ -0,0 +1,210 @@
+"""Small key/value stores with hit/miss stats.
+
+LRUStore keeps entries in this process's memory. SqliteStore keeps them
+in a local SQLite file, so several worker processes on one machine can
+share them. Both take an optional per-entry TTL (in seconds).
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class StoreStats:
+    """Counters shared by the stores."""
+
+    FIELDS = ('hits', 'misses', 'writes', 'deletes', 'evictions')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class LRUStore:
+    """In-process store holding at most `max_entries`, least recently used out first."""
+
+    def __init__(self, max_entries=10000, clock=time.time):
+        self.max_entries = max_entries
+        self.clock = clock
+        self.stats = StoreStats()
+
+        self._lock = threading.Lock()
+        # key -> (value, expires_at or None)
+        self._data = OrderedDict()
+
+    def get(self, key):
+        """Value for `key`, or None if missing or expired."""
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= self.clock():
+                del self._data[key]
+                entry = None
+
+            if entry is None:
+                self.stats.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires = self.clock() + ttl if ttl else None
+
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            self.stats.writes += 1
+
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.stats.deletes += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def flush(self):
+        """Nothing is buffered in memory; here for symmetry with SqliteStore."""
+
+    def __len__(self):
+        return len(self._data)
+
+
+_DELETED = object()
+
+
+class SqliteStore:
+    """Store backed by a local SQLite file.
+
+    Values go through `serializer` (anything with dumps/loads). Writes are
+    buffered and sent to SQLite together once `batch_size` have piled up
+    or `write_interval` seconds have passed; reads from this process see
+    buffered writes straight away (and while they're being flushed), other
+    processes once they're flushed. The default (batch_size=1) writes
+    straight through.
+    """
+
+    def __init__(self, path, serializer, table='store', batch_size=1,
+                 write_interval=1.0, clock=time.time):
+        self.path = path
+        self.serializer = serializer
+        self.table = table
+        self.batch_size = batch_size
+        self.write_interval = write_interval
+        self.clock = clock
+        self.stats = StoreStats()
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = {}
+        # the batch being written, until it's committed; one flush at a time
+        self._flushing = {}
+        self._flush_lock = threading.Lock()
+        self._last_flush = clock()
+
+        with self._connect() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ("
+                         "key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+
+    def _connect(self):
+        """This thread's connection to the store (sqlite3 connections can't be shared)."""
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Value for `key`, or None if missing or expired."""
+
+        now = self.clock()
+
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._flushing.get(key)
+
+        if entry is None:
+            row = self._connect().execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?",
+                (key,)).fetchone()
+            entry = (self.serializer.loads(row[0]), row[1]) if row else None
+
+        if entry is None or entry is _DELETED or (entry[1] is not None and entry[1] <= now):
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires = self.clock() + ttl if ttl else None
+        self._buffer(key, (value, expires))
+        self.stats.writes += 1
+
+    def delete(self, key):
+        self._buffer(key, _DELETED)
+        self.stats.deletes += 1
+
+    def _buffer(self, key, entry):
+        with self._lock:
+            self._pending[key] = entry
+            due = (len(self._pending) >= self.batch_size
+                   or self.clock() - self._last_flush >= self.write_interval)
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered sets and deletes to SQLite in one transaction."""
+
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+                self._last_flush = self.clock()
+
+            try:
+                if self._flushing:
+                    self._write(self._flushing)
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def _write(self, entries):
+        upserts = [(key, self.serializer.dumps(entry[0]), entry[1])
+                   for key, entry in entries.items() if entry is not _DELETED]
+        deletes = [(key,) for key, entry in entries.items() if entry is _DELETED]
+
+        with self._connect() as conn:
+            conn.executemany(f"INSERT OR REPLACE INTO {self.table} "
+                             "(key, value, expires) VALUES (?, ?, ?)", upserts)
+            conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", deletes)
+
+    def purge_expired(self):
+        """Drop expired rows. Returns how many were removed."""
+
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"DELETE FROM {self.table} WHERE expires IS NOT NULL AND expires <= ?",
+                (self.clock(),))
+        self.stats.evictions += cursor.rowcount
+        return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._pending = {}
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
@@ -0,0 +1,105 @@
+"""Jinja template compilation: on-disk bytecode cache and startup warmup.
+
+Without this each worker compiles a template the first time a request
+needs it, so the first hits after a deploy are slow. With it, templates
+are compiled once (or loaded from the bytecode cache, which survives
+restarts and is shared by every worker) while the app starts up.
+
+render_page() renders long pages (feeds) either as usual or, with
+STREAM_TEMPLATES on, as a stream: base.html's head and nav go out while
+the messages are still being rendered.
+"""
+
+import os
+import time
+
+from flask import (Response, current_app, get_flashed_messages, render_template,
+                   _request_ctx_stack, before_render_template, template_rendered)
+from jinja2 import FileSystemBytecodeCache
+
+
+def init_templates(app):
+    """Set up the bytecode cache and, if TEMPLATE_WARMUP is on, warm up."""
+
+    cache_dir = app.config.setdefault('JINJA_CACHE_DIR', None)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    if app.config.setdefault('TEMPLATE_WARMUP', True):
+        return warm_templates(app)
+
+    return {}
+
+
+def warm_templates(app):
+    """Compile every template the app can see.
+
+    Returns {template name: seconds taken}. Also surfaces template syntax
+    errors at startup rather than on some user's request.
+    """
+
+    env = app.jinja_env
+    timings = {}
+
+    for name in env.list_templates(extensions=['html']):
+        start = time.perf_counter()
+        env.get_template(name)
+        timings[name] = time.perf_counter() - start
+
+    return timings
+
+
+def render_page(template_name, **context):
+    """render_template(), streamed if STREAM_TEMPLATES is on."""
+
+    app = current_app._get_current_object()
+    if not app.config.get('STREAM_TEMPLATES'):
+        return render_template(template_name, **context)
+
+    template = app.jinja_env.get_template(template_name)
+    app.update_template_context(context)
+
+    # Response headers (and the session cookie) are sent before the body
+    # renders. Pop flashed messages now so the session is saved without them;
+    # the template still sees them, get_flashed_messages() caches per request.
+    get_flashed_messages()
+
+    def generate():
+        before_render_template.send(app, template=template, context=context)
+        stream = template.stream(context)
+        stream.enable_buffering(app.config.get('STREAM_BUFFER', 5))
+        yield from stream
+        template_rendered.send(app, template=template, context=context)
+
+    body = _with_request_context(generate())
+    resp = Response(body, mimetype='text/html')
+    resp.call_on_close(body.close)
+    return resp
+
+
+def _with_request_context(gen):
+    """Run `gen` inside this request's context, like stream_with_context().
+
+    Unlike stream_with_context(), the context is always popped once the
+    body is finished or the response is closed early, and that final pop
+    tears down the app context, which removes the scoped db session.
+    (stream_with_context() leaves it pushed whenever the context is
+    preserved, as the test client does, leaking it into later requests.)
+    """
+
+    ctx = _request_ctx_stack.top
+
+    def generator():
+        ctx.push()
+        try:
+            # the context is kept pushed from here on
+            yield None
+            yield from gen
+        finally:
+            gen.close()
+            ctx.pop()
+
+    wrapped = generator()
+    next(wrapped)
+    return wrapped
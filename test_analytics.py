@@ -0,0 +1,118 @@
+"""Analytics snapshot tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_analytics.py
+
+
+import os
+import tempfile
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+
+# testing sets up the test database; import it before the app
+from testing import DBTestCase
+from models import db, User, Message, Follows, Likes
+from app import app
+from analytics import (take_snapshot, Snapshot, per_user_counts, messages_per_day,
+                       likes_per_user_percentiles, follower_count_distribution)
+
+
+class AnalyticsTestCase(DBTestCase):
+    """Test snapshots and the aggregates computed from them."""
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+        users = [User.signup(f"user{n}", f"user{n}@test.com", "password", None)
+                 for n in range(4)]
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+
+        msgs = [Message(text="a", timestamp=datetime(2021, 3, 1, 9), user_id=self.user_ids[0]),
+                Message(text="b", timestamp=datetime(2021, 3, 1, 23), user_id=self.user_ids[1]),
+                Message(text="c", timestamp=datetime(2021, 3, 3, 12), user_id=self.user_ids[1])]
+        db.session.add_all(msgs)
+        db.session.commit()
+        msg_ids = [msg.id for msg in msgs]
+
+        # user0 likes everything; user1 likes one message
+        db.session.add_all(Likes(user_id=self.user_ids[0], message_id=msg_id)
+                           for msg_id in msg_ids)
+        db.session.add(Likes(user_id=self.user_ids[1], message_id=msg_ids[0]))
+        # everyone follows user0; user1 follows user2
+        db.session.add_all(Follows(user_being_followed_id=self.user_ids[0],
+                                   user_following_id=user_id)
+                           for user_id in self.user_ids[1:])
+        db.session.add(Follows(user_being_followed_id=self.user_ids[2],
+                               user_following_id=self.user_ids[1]))
+        db.session.commit()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def test_snapshot(self):
+        path = take_snapshot(self.dir, batch_size=2)
+        snapshot = Snapshot.latest(self.dir)
+
+        self.assertEqual(snapshot.path, path)
+        self.assertEqual(snapshot.meta['rows'],
+                         {'users': 4, 'messages': 3, 'likes': 4, 'follows': 4})
+        self.assertEqual(snapshot.column('users', 'id').tolist(), self.user_ids)
+
+        days, counts = messages_per_day(snapshot)
+        self.assertEqual([str(day) for day in days], ['2021-03-01', '2021-03-03'])
+        self.assertEqual(counts.tolist(), [2, 1])
+
+        # likes given per user: 3, 1, 0, 0
+        self.assertEqual(likes_per_user_percentiles(snapshot, (50, 100)), {50: 0.5, 100: 3.0})
+
+        # followers per user: 3, 0, 1, 0
+        edges, users = follower_count_distribution(snapshot)
+        self.assertEqual(edges.tolist(), [0, 1, 2, 4])
+        self.assertEqual(users.tolist(), [2, 1, 1])
+
+    def test_keeps_newest(self):
+        os.makedirs(os.path.join(self.dir, '20200101T000000'))
+        os.makedirs(os.path.join(self.dir, '20200102T000000'))
+
+        path = take_snapshot(self.dir, keep=2)
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['20200102T000000', os.path.basename(path), 'LATEST'])
+
+    def test_snapshots_in_same_second(self):
+        first = take_snapshot(self.dir)
+        second = take_snapshot(self.dir)
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(Snapshot.latest(self.dir).path, second)
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         [os.path.basename(first), os.path.basename(second), 'LATEST'])
+
+    def test_failed_snapshot_cleaned_up(self):
+        with mock.patch('analytics.read_columns', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                take_snapshot(self.dir)
+
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_per_user_counts_skips_unknown_users(self):
+        counts = per_user_counts(np.array([2, 5, 9]), np.array([5, 5, 7, 9, 12, 1]))
+        self.assertEqual(counts.tolist(), [0, 2, 1])
+
+    def test_report(self):
+        runner = app.test_cli_runner()
+        real_dir, app.config['ANALYTICS_DIR'] = app.config['ANALYTICS_DIR'], self.dir
+        try:
+            self.assertEqual(runner.invoke(args=['analytics-snapshot']).exit_code, 0)
+            result = runner.invoke(args=['analytics-report'])
+        finally:
+            app.config['ANALYTICS_DIR'] = real_dir
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('2021-03-01  2', result.output)
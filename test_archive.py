@@ -0,0 +1,77 @@
+"""Message archive tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_archive.py
+
+
+from datetime import datetime, timedelta
+
+# testing sets up the test database; import it before the app
+from testing import DBTestCase
+from models import db, Message, User, Likes, ArchivedMessage, ArchivedLike
+from archive import archive_messages, archive_cutoff
+from purge import purge_user
+
+
+class ArchiveTestCase(DBTestCase):
+    """Test moving old messages to the archive, and reading them back."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.u1 = User.signup("archiver", "arch@test.com", "password", None)
+        self.u2 = User.signup("liker", "liker@test.com", "password", None)
+        db.session.commit()
+
+        long_ago = datetime.utcnow() - timedelta(days=400)
+        self.old = [Message(text=f"old warble {n}", user_id=self.u1.id,
+                            timestamp=long_ago + timedelta(minutes=n))
+                    for n in range(5)]
+        self.new = Message(text="new warble", user_id=self.u1.id,
+                           timestamp=datetime.utcnow())
+        db.session.add_all(self.old + [self.new])
+        db.session.commit()
+
+        db.session.add(Likes(user_id=self.u2.id, message_id=self.old[0].id))
+        db.session.commit()
+
+        self.u1_id, self.u2_id = self.u1.id, self.u2.id
+        self.old_id = self.old[0].id
+
+    def test_archive_in_batches(self):
+        batches = []
+        moved = archive_messages(archive_cutoff(90), batch_size=2,
+                                 progress=batches.append)
+
+        self.assertEqual(moved, 5)
+        self.assertEqual(batches, [2, 4, 5])
+
+        self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(), 1)
+        self.assertEqual(ArchivedMessage.query.filter_by(user_id=self.u1_id).count(), 5)
+
+        # the like went along with its message
+        self.assertEqual(Likes.query.filter_by(user_id=self.u2_id).count(), 0)
+        like = ArchivedLike.query.filter_by(user_id=self.u2_id).one()
+        self.assertEqual(like.message_id, self.old_id)
+
+    def test_pages_fall_back_to_archive(self):
+        archive_messages(archive_cutoff(90))
+
+        resp = self.client.get(f"/messages/{self.old_id}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("old warble 0", resp.get_data(as_text=True))
+
+        html = self.client.get(f"/users/{self.u1_id}").get_data(as_text=True)
+        self.assertIn("new warble", html)
+        self.assertIn("old warble 4", html)
+
+        html = self.client.get(f"/users/{self.u2_id}/likes").get_data(as_text=True)
+        self.assertIn("old warble 0", html)
+
+    def test_purge_clears_archive(self):
+        archive_messages(archive_cutoff(90))
+        purge_user(self.u1_id)
+
+        self.assertEqual(ArchivedMessage.query.count(), 0)
+        self.assertEqual(ArchivedLike.query.count(), 0)
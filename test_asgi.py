@@ -0,0 +1,141 @@
+"""ASGI adapter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_asgi.py
+
+
+import asyncio
+import itertools
+import time
+from unittest import TestCase
+
+# testing sets up the test database; import it before the app
+import testing
+from asgi import AsgiAdapter
+from app import app
+
+
+def call(adapter, method, path, body=b'', headers=(), disconnect_after=None):
+    """Run one request through `adapter`; returns (status, headers, body chunks).
+
+    With `disconnect_after`, the client goes away once it has been sent
+    that many messages.
+    """
+
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+        'headers': [(k.encode(), v.encode()) for k, v in headers],
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+    }
+    sent = []
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    gone = None
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # like a server: nothing more until the client disconnects
+        await gone.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+        if len(sent) == disconnect_after:
+            gone.set()
+
+    async def run():
+        nonlocal gone
+        gone = asyncio.Event()
+        await adapter(scope, receive, send)
+
+    asyncio.run(run())
+    if disconnect_after is not None:
+        return sent
+
+    start = sent[0]
+    assert start['type'] == 'http.response.start'
+    chunks = [m['body'] for m in sent[1:]]
+    assert sent[-1]['more_body'] is False
+    return start['status'], dict(start['headers']), chunks
+
+
+class AsgiTestCase(TestCase):
+    """Test requests served through the ASGI adapter."""
+
+    def setUp(self):
+        self.adapter = AsgiAdapter(app, threads=2)
+
+    def tearDown(self):
+        self.adapter.executor.shutdown()
+
+    def test_get(self):
+        status, headers, chunks = call(self.adapter, 'GET', '/login')
+
+        self.assertEqual(status, 200)
+        self.assertTrue(headers[b'content-type'].startswith(b'text/html'))
+        self.assertIn(b'Welcome back.', b''.join(chunks))
+
+    def test_post_body(self):
+        status, _, chunks = call(
+            self.adapter, 'POST', '/login', b'username=asgiuser&password=',
+            headers=[('Content-Type', 'application/x-www-form-urlencoded')])
+
+        # the form comes back, filled in from the posted body
+        self.assertEqual(status, 200)
+        self.assertIn(b'value="asgiuser"', b''.join(chunks))
+
+    def test_lifespan(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(self.adapter({'type': 'lifespan'}, receive, send))
+        self.assertEqual(sent, ['lifespan.startup.complete',
+                                'lifespan.shutdown.complete'])
+
+    def test_write_callable(self):
+        def legacy_app(environ, start_response):
+            write = start_response('200 OK', [('Content-Type', 'text/plain')])
+            write(b'written, ')
+            return [b'returned']
+
+        adapter = AsgiAdapter(legacy_app, threads=1)
+        try:
+            status, _, chunks = call(adapter, 'GET', '/')
+        finally:
+            adapter.executor.shutdown()
+
+        self.assertEqual(status, 200)
+        self.assertEqual(b''.join(chunks), b'written, returned')
+
+    def test_disconnect_frees_thread(self):
+        closed = []
+
+        def endless_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/event-stream')])
+
+            def events():
+                try:
+                    for n in itertools.count():
+                        yield f"data: {n}\n\n".encode()
+                        time.sleep(0.01)
+                finally:
+                    closed.append(True)
+            return events()
+
+        adapter = AsgiAdapter(endless_app, threads=1)
+        try:
+            # returns (rather than streaming forever) once the client goes
+            sent = call(adapter, 'GET', '/feed/stream', disconnect_after=3)
+        finally:
+            adapter.executor.shutdown()
+
+        # abandoned part way, not finished
+        self.assertTrue(sent[-1]['more_body'])
+        self.assertEqual(closed, [True])
@@ -0,0 +1,82 @@
+"""Static asset build tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+# testing sets up the test database; import it before the app
+import testing
+from app import app
+from assets import build_assets, minify_css, minify_js, load_manifest
+
+
+class AssetBuildTestCase(TestCase):
+    """Test building and serving fingerprinted assets."""
+
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.static, 'stylesheets'))
+        with open(os.path.join(self.static, 'app.js'), 'w') as f:
+            f.write("// say hi\nconst a = 'x // y';\n\n    console.log(a)\n")
+        with open(os.path.join(self.static, 'stylesheets', 'style.css'), 'w') as f:
+            f.write("/* nav */\n.nav > li {\n  color: red;\n  width: 32px;\n}\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.static)
+
+    def test_minify(self):
+        self.assertEqual(minify_css(".nav > li {\n  color: red;\n}\n"),
+                         ".nav>li{color:red}")
+        self.assertEqual(minify_js("// c\n  const a = 'x // y';\n\n"),
+                         "const a = 'x // y';")
+
+    def test_build(self):
+        manifest = build_assets(self.static)
+
+        self.assertRegex(manifest['app.js'], r'^dist/app\.[0-9a-f]{12}\.js$')
+        self.assertEqual(load_manifest(self.static), manifest)
+
+        built = os.path.join(self.static, manifest['stylesheets/style.css'])
+        with open(built) as f:
+            self.assertEqual(f.read(), ".nav>li{color:red;width:32px}")
+        with gzip.open(built + '.gz') as f:
+            self.assertEqual(f.read(), b".nav>li{color:red;width:32px}")
+
+        # same content, same name; changed content, new name
+        self.assertEqual(build_assets(self.static), manifest)
+        with open(os.path.join(self.static, 'app.js'), 'a') as f:
+            f.write("console.log('more')\n")
+        self.assertNotEqual(build_assets(self.static)['app.js'], manifest['app.js'])
+
+    def test_serve_built_assets(self):
+        old_static = app.static_folder
+        app.static_folder = self.static
+        manifest = build_assets(self.static)
+        app.extensions['asset_manifest'] = manifest
+
+        try:
+            with app.test_request_context():
+                url = app.jinja_env.globals['static_url']('app.js')
+            self.assertEqual(url, '/static/' + manifest['app.js'])
+
+            client = app.test_client()
+            resp = client.get(url, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(resp.cache_control.max_age, 365 * 24 * 60 * 60)
+            self.assertIn('Accept-Encoding', resp.headers['Vary'])
+            self.assertIn(b"console.log(a)", gzip.decompress(resp.data))
+
+            resp = client.get(url, headers={'Accept-Encoding': 'gzip;q=0'})
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertIn(b"console.log(a)", resp.data)
+        finally:
+            app.static_folder = old_static
+            app.extensions['asset_manifest'] = load_manifest(old_static)
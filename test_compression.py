@@ -0,0 +1,112 @@
+"""Response compression tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_compression.py
+
+
+import gzip
+import zlib
+from unittest import TestCase
+
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+# testing sets up the test database; import it before the app
+import testing
+from app import app, compression
+from compression import CompressionMiddleware, accepted_encodings
+
+BIG = b'<p>warble</p>' * 200
+
+
+def make_app(body=BIG, mimetype='text/html', headers=None, stream=False):
+    def wsgi_app(environ, start_response):
+        resp = Response(iter([body[:100], body[100:]]) if stream else body,
+                        mimetype=mimetype, headers=headers)
+        return resp(environ, start_response)
+    return wsgi_app
+
+
+def get(wsgi_app, accept='gzip', **kwargs):
+    middleware = CompressionMiddleware(wsgi_app, **kwargs)
+    client = Client(middleware, Response)
+    return middleware, client.get('/', headers={'Accept-Encoding': accept})
+
+
+class CompressionMiddlewareTestCase(TestCase):
+    """Test which responses get compressed, and how."""
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip, br;q=0, deflate;q=0.5'),
+                         {'gzip', 'deflate'})
+        self.assertEqual(accepted_encodings(''), {''})
+
+    def test_gzip(self):
+        middleware, resp = get(make_app())
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(gzip.decompress(resp.data), BIG)
+
+        stats = middleware.stats.as_dict()['(none)']
+        self.assertEqual(stats['bytes_in'], len(BIG))
+        self.assertEqual(stats['bytes_out'], len(resp.data))
+        self.assertGreater(stats['bytes_saved'], 0)
+
+    def test_not_accepted(self):
+        _, resp = get(make_app(), accept='identity')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.data, BIG)
+
+    def test_small_responses_left_alone(self):
+        _, resp = get(make_app(body=b'tiny'))
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.data, b'tiny')
+
+    def test_binary_types_left_alone(self):
+        _, resp = get(make_app(mimetype='image/png'))
+        self.assertNotIn('Content-Encoding', resp.headers)
+
+    def test_no_transform(self):
+        _, resp = get(make_app(headers={'Cache-Control': 'no-transform'}))
+        self.assertNotIn('Content-Encoding', resp.headers)
+
+    def test_streamed(self):
+        _, resp = get(make_app(stream=True), min_size=50)
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', resp.headers)
+        self.assertEqual(gzip.decompress(resp.data), BIG)
+
+    def test_small_stream_sent_plain(self):
+        _, resp = get(make_app(body=b'x' * 150, stream=True), min_size=500)
+
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.headers['Content-Length'], '150')
+        self.assertEqual(resp.data, b'x' * 150)
+
+    def test_streamed_chunks_flushed(self):
+        """Each chunk can be decoded as soon as it arrives."""
+
+        middleware = CompressionMiddleware(make_app(stream=True), min_size=50)
+        app_iter, _, _ = Client(middleware).get(
+            '/', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        first = decoder.decompress(next(iter(app_iter)))
+        self.assertEqual(first, BIG[:100])
+
+
+class AppCompressionTestCase(TestCase):
+    """Test the middleware is wired into the app."""
+
+    def test_pages_compressed(self):
+        client = app.test_client()
+        resp = client.get('/', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn(b'Warbler', gzip.decompress(resp.data))
+
+        stats = compression.stats.as_dict()
+        self.assertIn('homepage', stats)
@@ -0,0 +1,89 @@
+"""Read-replica routing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_db_routing.py
+
+
+import tempfile
+
+# testing sets up the test database; import it before the app
+from testing import DBTestCase
+from models import db, User
+from app import app, CURR_USER_KEY
+from db_routing import STICKY_KEY
+
+
+class ReplicaRoutingTestCase(DBTestCase):
+    """Use a local SQLite file as a stand-in replica of the test database."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.replica_dir = tempfile.TemporaryDirectory()
+        replica_uri = f"sqlite:///{self.replica_dir.name}/replica.db"
+        db.configure_replicas(app, [replica_uri])
+
+        replica = app.extensions['db_replicas'][0]
+        db.Model.metadata.create_all(bind=replica)
+
+        # the "replica" is deliberately out of date with the primary
+        self.user = User(id=1111, username="primary", email="p@test.com",
+                         password="HASHED_PASSWORD")
+        db.session.add(self.user)
+        db.session.commit()
+
+        replica.execute(User.__table__.insert(), [
+            dict(id=1111, username="primary", email="p@test.com",
+                 password="HASHED_PASSWORD", is_admin=False),
+            dict(id=2222, username="replicaonly", email="r@test.com",
+                 password="HASHED_PASSWORD", is_admin=False),
+        ])
+
+    def tearDown(self):
+        db.configure_replicas(app, [])
+        self.replica_dir.cleanup()
+        super().tearDown()
+
+    def test_get_reads_replica(self):
+        with self.client as c:
+            resp = c.get('/users')
+            self.assertIn('@replicaonly', resp.get_data(as_text=True))
+
+    def test_post_writes_primary(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1111
+
+            resp = c.post('/messages/new', json={'msg_text': 'Hello primary'})
+            self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(len(User.query.get(1111).messages), 1)
+
+    def test_read_your_writes(self):
+        """After writing, our GETs go to the primary for a while."""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1111
+
+            c.post('/messages/new', json={'msg_text': 'Hello primary'})
+
+            with c.session_transaction() as sess:
+                self.assertIn(STICKY_KEY, sess)
+
+            resp = c.get('/users/1111')
+            html = resp.get_data(as_text=True)
+            self.assertIn('Hello primary', html)
+
+            resp = c.get('/users')
+            self.assertNotIn('@replicaonly', resp.get_data(as_text=True))
+
+    def test_no_replicas(self):
+        db.configure_replicas(app, [])
+
+        with self.client as c:
+            resp = c.get('/users')
+            html = resp.get_data(as_text=True)
+            self.assertIn('@primary', html)
+            self.assertNotIn('@replicaonly', html)
@@ -0,0 +1,108 @@
+"""Table export tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_export.py
+
+
+import csv
+import io
+import json
+from datetime import datetime
+
+# testing sets up the test database; import it before the app
+from testing import DBTestCase
+from models import db, User, Message, Follows, Likes, ArchivedMessage
+from app import app, CURR_USER_KEY
+from export import export_table
+from generator.helpers import MESSAGES_CSV_HEADERS, FOLLOWS_CSV_HEADERS
+
+
+class ExportTestCase(DBTestCase):
+    """Test exporting tables as CSV and NDJSON."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.u1 = User.signup("exporter", "exporter@test.com", "password", None)
+        self.u2 = User.signup("exported", "exported@test.com", "password", None)
+        db.session.commit()
+        self.u1_id, self.u2_id = self.u1.id, self.u2.id
+
+        self.old = ArchivedMessage(id=1, text="Archived", timestamp=datetime(2020, 1, 1),
+                                   user_id=self.u1_id)
+        db.session.add(self.old)
+        self.msgs = [Message(text=f"Warble {n}", timestamp=datetime(2021, 1, n + 1),
+                             user_id=self.u1_id) for n in range(5)]
+        db.session.add_all(self.msgs)
+        db.session.add(Follows(user_being_followed_id=self.u1_id, user_following_id=self.u2_id))
+        db.session.commit()
+        self.msg_ids = [msg.id for msg in self.msgs]
+
+        db.session.add(Likes(user_id=self.u2_id, message_id=self.msg_ids[0]))
+        db.session.commit()
+
+    def export(self, *args, **kwargs):
+        return ''.join(export_table(*args, **kwargs))
+
+    def test_messages_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export('messages', batch_size=2))))
+
+        self.assertEqual(rows[0], ['id'] + MESSAGES_CSV_HEADERS)
+        self.assertEqual([row[1] for row in rows[1:]],
+                         ['Archived'] + [f"Warble {n}" for n in range(5)])
+        self.assertEqual(rows[2][2], '2021-01-01 00:00:00')
+
+    def test_chunked(self):
+        chunks = list(export_table('messages', batch_size=2))
+        # header plus 6 rows, 2 rows to a chunk
+        self.assertEqual(len(chunks), 3)
+
+    def test_incremental(self):
+        rows = list(csv.DictReader(io.StringIO(
+            self.export('messages', since_id=self.msg_ids[2]))))
+        self.assertEqual([row['text'] for row in rows], ["Warble 3", "Warble 4"])
+
+        rows = list(csv.DictReader(io.StringIO(
+            self.export('messages', since=datetime(2021, 1, 4)))))
+        self.assertEqual([row['text'] for row in rows], ["Warble 4"])
+
+        with self.assertRaises(ValueError):
+            export_table('follows', since_id=1)
+
+    def test_ndjson(self):
+        lines = self.export('likes', 'ndjson').splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'user_id': self.u2_id, 'message_id': str(self.msg_ids[0])}])
+
+        users = [json.loads(line) for line in self.export('users', 'ndjson').splitlines()]
+        self.assertEqual([user['username'] for user in users], ['exporter', 'exported'])
+
+    def test_follows_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export('follows'))))
+        self.assertEqual(rows, [FOLLOWS_CSV_HEADERS, [str(self.u1_id), str(self.u2_id)]])
+
+    def test_admin_endpoint(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+        resp = self.client.get('/admin/export/messages')
+        self.assertEqual(resp.status_code, 302)
+
+        User.query.get(self.u1_id).is_admin = True
+        db.session.commit()
+
+        resp = self.client.get(f'/admin/export/messages?format=ndjson&since_id={self.msg_ids[3]}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        self.assertIn('attachment', resp.headers['Content-Disposition'])
+        self.assertEqual([json.loads(line)['text'] for line in resp.data.splitlines()],
+                         ["Warble 4"])
+
+        resp = self.client.get('/admin/export/follows?since_id=1')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_cli(self):
+        result = app.test_cli_runner().invoke(args=['export', 'follows'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn(','.join(FOLLOWS_CSV_HEADERS), result.output)
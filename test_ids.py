@@ -0,0 +1,73 @@
+"""Snowflake id tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_ids.py
+
+
+import threading
+from datetime import datetime
+from unittest import TestCase
+
+from testing import FakeClock
+from ids import (SnowflakeGenerator, id_for_datetime, datetime_for_id,
+                 MAX_SEQUENCE, WORKER_BITS, SEQUENCE_BITS)
+
+
+class SnowflakeTestCase(TestCase):
+    """Test id layout, ordering and uniqueness."""
+
+    def test_increasing(self):
+        clock = FakeClock()
+        gen = SnowflakeGenerator(worker_id=3, clock=clock)
+
+        ids = [gen() for _ in range(10)]
+        clock.now += 0.001
+        ids += [gen() for _ in range(10)]
+
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), 20)
+        self.assertEqual((ids[0] >> SEQUENCE_BITS) & ((1 << WORKER_BITS) - 1), 3)
+
+    def test_clock_going_backwards(self):
+        clock = FakeClock()
+        gen = SnowflakeGenerator(worker_id=1, clock=clock)
+
+        first = gen()
+        clock.now -= 5
+        self.assertGreater(gen(), first)
+
+    def test_sequence_exhausted_waits(self):
+        clock = FakeClock()
+        gen = SnowflakeGenerator(worker_id=1, clock=clock)
+
+        ids = [gen() for _ in range(MAX_SEQUENCE + 1)]
+
+        # the next id needs the next millisecond
+        timer = threading.Timer(0.05, lambda: setattr(clock, 'now', clock.now + 0.001))
+        timer.start()
+        ids.append(gen())
+        timer.join()
+
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_unique_across_threads(self):
+        gen = SnowflakeGenerator(worker_id=7)
+        results = []
+
+        def make():
+            results.extend(gen() for _ in range(2000))
+
+        threads = [threading.Thread(target=make) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(set(results)), 8000)
+
+    def test_datetime_round_trip(self):
+        dt = datetime(2017, 1, 21, 11, 4, 53, 522000)
+        self.assertEqual(datetime_for_id(id_for_datetime(dt, worker_id=5, sequence=9)), dt)
+        self.assertLess(id_for_datetime(dt), id_for_datetime(dt, sequence=1))
@@ -0,0 +1,212 @@
+"""Image proxy tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_images.py
+
+
+import io
+import ipaddress
+import os
+import tempfile
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase, mock
+
+from PIL import Image
+
+# testing sets up the test database; import it before the app
+import testing
+from app import app
+import images
+from images import proxy_url, fetch, get_thumbnail, prune_cache, ImageProxyError
+
+
+def make_png(width, height):
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(out, 'PNG')
+    return out.getvalue()
+
+
+class ImageServer(HTTPServer):
+    """Local stand-in for randomuser.me & co. Counts requests per path."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ImageHandler)
+        self.images = {'/big.png': make_png(600, 400)}
+        self.hits = {}
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_port}{path}"
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', 'http://169.254.169.254/latest/meta-data/')
+            self.end_headers()
+            return
+
+        body = self.server.images.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageProxyTestCase(TestCase):
+    """Test fetching, resizing and caching of remote images."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ImageServer()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        app.config['IMAGE_CACHE_DIR'] = self.cache_dir.name
+        # the stand-in image server is on localhost
+        app.config['IMAGE_ALLOW_PRIVATE'] = True
+        self.server.hits = {}
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['IMAGE_ALLOW_PRIVATE'] = False
+        self.cache_dir.cleanup()
+
+    def test_local_urls_pass_through(self):
+        url = '/static/images/default-pic.png'
+        self.assertEqual(proxy_url(app, url, 'timeline'), url)
+
+    def test_resize_and_cache(self):
+        proxied = proxy_url(app, self.server.url('/big.png'), 'timeline')
+        self.assertTrue(proxied.startswith('/images/timeline/'))
+
+        resp = self.client.get(proxied)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.cache_control.max_age, 365 * 24 * 60 * 60)
+        self.assertTrue(resp.cache_control.public)
+
+        img = Image.open(io.BytesIO(resp.data))
+        self.assertEqual(img.size, (96, 96))
+
+        # second request comes from disk, not the image server
+        resp = self.client.get(proxied)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.server.hits['/big.png'], 1)
+
+        # and revalidation by ETag is cheap
+        etag = resp.headers['ETag']
+        resp = self.client.get(proxied, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_header_keeps_aspect_ratio(self):
+        proxied = proxy_url(app, self.server.url('/big.png'), 'hero')
+        resp = self.client.get(proxied)
+
+        img = Image.open(io.BytesIO(resp.data))
+        self.assertEqual(img.size, (600, 400))
+
+    def test_tampered_token(self):
+        proxied = proxy_url(app, self.server.url('/big.png'), 'card')
+        resp = self.client.get(proxied[:-2] + 'xx')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_unknown_size(self):
+        proxied = proxy_url(app, self.server.url('/big.png'), 'huge')
+        resp = self.client.get(proxied)
+        self.assertEqual(resp.status_code, 404)
+
+    def test_fetch_failure_redirects_to_source(self):
+        source = self.server.url('/missing.png')
+        resp = self.client.get(proxy_url(app, source, 'card'))
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.location, source)
+
+    def test_failures_cached(self):
+        source = self.server.url('/missing.png')
+        for _ in range(3):
+            with self.assertRaisesRegex(ImageProxyError, '404'):
+                get_thumbnail(self.cache_dir.name, source, 'card', allow_private=True)
+
+        # a broken URL isn't fetched again on every view...
+        self.assertEqual(self.server.hits, {'/missing.png': 1})
+
+        # ...only once the failure is old enough
+        with self.assertRaises(ImageProxyError):
+            get_thumbnail(self.cache_dir.name, source, 'card', allow_private=True,
+                          failure_ttl=0)
+        self.assertEqual(self.server.hits, {'/missing.png': 2})
+
+    def test_prune(self):
+        cache = self.cache_dir.name
+        old, _ = get_thumbnail(cache, self.server.url('/big.png'), 'card', allow_private=True)
+        new, _ = get_thumbnail(cache, self.server.url('/big.png'), 'avatar', allow_private=True)
+        with self.assertRaises(ImageProxyError):
+            get_thumbnail(cache, self.server.url('/missing.png'), 'card', allow_private=True)
+
+        an_hour_ago = time.time() - 60 * 60
+        os.utime(old, (an_hour_ago, an_hour_ago))
+
+        # nothing to do within the limits
+        self.assertEqual(prune_cache(cache, max_bytes=10 ** 6, max_age=2 * 60 * 60,
+                                     failure_ttl=2 * 60 * 60), (0, 0))
+
+        # over the size limit: the least recently served goes first, with
+        # its index file, and the failure marker has expired
+        old_size = os.path.getsize(old)
+        deleted, freed = prune_cache(cache, max_bytes=os.path.getsize(new), failure_ttl=0)
+        self.assertEqual((deleted, freed), (3, old_size))
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+        # and is simply made again when next wanted
+        resp = self.client.get(proxy_url(app, self.server.url('/big.png'), 'card'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(os.path.exists(old))
+
+        # not served for too long
+        os.utime(new, (an_hour_ago, an_hour_ago))
+        self.assertEqual(prune_cache(cache, max_age=30 * 60)[0], 2)
+        self.assertFalse(os.path.exists(new))
+
+    def test_loopback_refused(self):
+        with self.assertRaises(ImageProxyError):
+            fetch(self.server.url('/big.png'))
+
+        app.config['IMAGE_ALLOW_PRIVATE'] = False
+        source = self.server.url('/big.png')
+        resp = self.client.get(proxy_url(app, source, 'card'))
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.location, source)
+
+        self.assertEqual(self.server.hits, {})
+
+    def test_redirect_to_internal_refused(self):
+        # pretend the image server is a public host
+        is_public = images._is_public
+        local = ipaddress.ip_address('127.0.0.1')
+        with mock.patch('images._is_public', lambda ip: ip == local or is_public(ip)):
+            with self.assertRaisesRegex(ImageProxyError, '169.254.169.254'):
+                fetch(self.server.url('/redirect'))
+
+        self.assertEqual(self.server.hits, {'/redirect': 1})
@@ -0,0 +1,166 @@
+"""Background job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from flask import Flask
+
+from jobs import Job, JobQueue, MemoryBackend, SqliteBackend, init_jobs
+from metrics import Registry
+
+
+class MemoryBackendTestCase(TestCase):
+    """Test the in-process backend."""
+
+    def test_due_order(self):
+        backend = MemoryBackend()
+        now = time.time()
+        backend.push(Job('later', {}, run_at=now + 60))
+        backend.push(Job('second', {}, run_at=now - 1))
+        backend.push(Job('first', {}, run_at=now - 2))
+
+        self.assertEqual(backend.depth(), 3)
+        self.assertEqual(backend.pop(timeout=0).name, 'first')
+        self.assertEqual(backend.pop(timeout=0).name, 'second')
+        # not due yet
+        self.assertIsNone(backend.pop(timeout=0.01))
+
+    def test_wakes_for_delayed_job(self):
+        backend = MemoryBackend()
+        backend.push(Job('soon', {}, run_at=time.time() + 0.05))
+        self.assertEqual(backend.pop(timeout=1).name, 'soon')
+
+
+class SqliteBackendTestCase(TestCase):
+    """Test the durable backend."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'jobs.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_survives_reopening(self):
+        SqliteBackend(self.path).push(Job('task', {'user_id': 5}))
+
+        backend = SqliteBackend(self.path)
+        job = backend.pop(timeout=0)
+        self.assertEqual((job.name, job.kwargs), ('task', {'user_id': 5}))
+        # claimed jobs aren't handed out twice
+        self.assertIsNone(backend.claim())
+        self.assertEqual(backend.depth(), 1)
+
+        backend.done(job)
+        self.assertEqual(backend.depth(), 0)
+
+    def test_expired_lease_reclaimed(self):
+        backend = SqliteBackend(self.path, lease=0.05)
+        backend.push(Job('task', {}))
+        job = backend.claim()
+
+        # its worker died; once the lease runs out it's handed out again
+        time.sleep(0.1)
+        self.assertEqual(backend.claim().id, job.id)
+
+    def test_retry_and_fail(self):
+        backend = SqliteBackend(self.path)
+        backend.push(Job('task', {}))
+
+        job = backend.claim()
+        job.attempts, job.run_at = 1, time.time() + 60
+        backend.retry(job)
+        self.assertIsNone(backend.claim())
+
+        backend._conn().execute("UPDATE jobs SET run_at = 0")
+        job = backend.claim()
+        self.assertEqual(job.attempts, 1)
+
+        backend.fail(job, 'boom')
+        self.assertIsNone(backend.claim())
+        self.assertEqual(backend.depth(), 0)
+
+
+class JobQueueTestCase(TestCase):
+    """Test running, retrying and instrumenting jobs."""
+
+    def setUp(self):
+        self.app = Flask('jobs_app')
+        self.registry = Registry()
+        self.queue = JobQueue(self.app, max_attempts=2, retry_delay=60, registry=self.registry)
+        self.calls = []
+
+        @self.queue.task('record')
+        def record(value):
+            self.calls.append(value)
+
+        @self.queue.task('explode')
+        def explode():
+            raise RuntimeError('boom')
+
+    def test_eager(self):
+        self.app.config['JOBS_EAGER'] = True
+        self.queue.enqueue('record', value=1)
+        self.assertEqual(self.calls, [1])
+
+        with self.assertRaises(KeyError):
+            self.queue.enqueue('missing')
+
+    def test_retries_then_fails(self):
+        backend = self.queue.backend
+        self.queue.run(Job('explode', {}))
+
+        # backed off, not due yet
+        self.assertIsNone(backend.pop(timeout=0))
+        job = backend._heap.pop()[2]
+        self.assertEqual(job.attempts, 1)
+
+        self.queue.run(job)
+        self.assertEqual(backend.depth(), 0)
+        self.assertEqual(backend.failed[0][1], "RuntimeError('boom')")
+
+        rendered = self.registry.render()
+        self.assertIn('warbler_jobs_total{job="explode",outcome="retried"} 1', rendered)
+        self.assertIn('warbler_jobs_total{job="explode",outcome="failed"} 1', rendered)
+
+    def test_workers(self):
+        done = threading.Event()
+
+        @self.queue.task('signal')
+        def signal():
+            done.set()
+
+        self.queue.enqueue('signal')
+        self.assertTrue(done.wait(5))
+        self.queue.stop()
+
+        # the worker records the run after the task returns
+        deadline = time.time() + 5
+        while ('warbler_jobs_total{job="signal",outcome="completed"} 1'
+               not in self.registry.render() and time.time() < deadline):
+            time.sleep(0.01)
+        rendered = self.registry.render()
+        self.assertIn('warbler_jobs_total{job="signal",outcome="completed"} 1', rendered)
+        self.assertIn('warbler_job_wait_seconds_count{job="signal"} 1', rendered)
+        self.assertIn('warbler_job_queue_depth{backend="memory"} 0', rendered)
+
+    def test_init_jobs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.app.config['JOBS_BACKEND'] = 'sqlite'
+            self.app.config['JOBS_SQLITE_PATH'] = os.path.join(tmp, 'jobs.db')
+            queue = init_jobs(self.app)
+
+            self.assertIs(self.app.extensions['jobs'], queue)
+            self.assertEqual(queue.serialize(), {'backend': 'sqlite', 'depth': 0, 'workers': 0})
+
+        self.app.config['JOBS_BACKEND'] = 'redis'
+        with self.assertRaises(ValueError):
+            init_jobs(self.app)
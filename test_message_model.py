@@ -5,37 +5,20 @@
 #    python -m unittest test_message_model.py
 
 
-import os
-from unittest import TestCase
 from sqlalchemy import exc
-from models import db, User, Message, Follows, Likes
-
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-
-# Now we can import app
 
+# testing sets up the test database; import it before the app
+from testing import DBTestCase
+from models import db, User, Message, Follows, Likes
 from app import app
 
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
-
-class UserModelTestCase(TestCase):
+class UserModelTestCase(DBTestCase):
     """Test methods for messages."""
 
     def setUp(self):
         """Create test client, add sample data."""
 
-        db.drop_all()
-        db.create_all()
+        super().setUp()
 
         u1 = User.signup("testuser1", "email1@test.com", "password1", None)
         uid1 = 1111
@@ -66,10 +49,6 @@ class UserModelTestCase(TestCase):
         msg1 = Message.query.get(msgid)
         self.msg1 = msg1
 
-    def tearDown(self):
-        res = super().tearDown()
-        db.session.rollback()
-        return res      
 
     def test_message_model(self):
         """Tests that message model works"""
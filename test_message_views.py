@@ -5,44 +5,22 @@
 #    FLASK_ENV=production python -m unittest test_message_views.py
 
 
-import os
-from unittest import TestCase
+from datetime import datetime
 
-from models import db, connect_db, Message, User
+# testing sets up the test database; import it before the app
+from testing import DBTestCase
+from models import db, connect_db, Message, User, Likes, ArchivedMessage
+from app import app, trending, trending_window, CURR_USER_KEY, do_login
+from ids import next_message_id
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-
-# Now we can import app
-
-from app import app, CURR_USER_KEY, do_login
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
-
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
-
-
-class MessageViewTestCase(TestCase):
+class MessageViewTestCase(DBTestCase):
     """Test views for messages."""
 
     def setUp(self):
         """Create test client, add sample data."""
 
-        db.drop_all()
-        db.create_all()
-
-        self.client = app.test_client()
+        super().setUp()
 
         self.testuser = User.signup(username="testuser",
                                     email="test@test.com",
@@ -71,7 +49,7 @@ class MessageViewTestCase(TestCase):
             # Make sure it redirects
             self.assertEqual(resp.status_code, 200)
  
-            msg = Message.query.filter_by(id=1).first()
+            msg = Message.query.filter_by(user_id=self.testuser_id).first()
             self.assertEqual(msg.text, "Hello")
 
     def test_add_no_session(self):
@@ -143,7 +121,6 @@ class MessageViewTestCase(TestCase):
 
             # msg added to db
             msg = Message.query.filter_by(text='My New Post').first()
-            self.assertEqual(msg.id, 1)
             self.assertEqual(msg.text, 'My New Post')        
             self.assertEqual(msg.user_id, 1234)
             
@@ -162,14 +139,14 @@ class MessageViewTestCase(TestCase):
 
             # Check that msg was succesfully added
             msg = Message.query.filter_by(text='My New Post').first()
-            self.assertEqual(msg.id, 1)
             self.assertEqual(msg.text, 'My New Post')        
             self.assertEqual(msg.user_id, 1234)
+            msg_id = msg.id
 
-            c.post('/messages/1/delete')
+            c.post(f'/messages/{msg_id}/delete')
 
             # Check that msg was succesfully deleted
-            self.assertEqual(Message.query.filter_by(id=1).first(), None)
+            self.assertEqual(Message.query.filter_by(id=msg_id).first(), None)
 
     def test_logged_out_add_message(self):
         """When logged out, are we prohibited from adding messages"""
@@ -237,3 +214,76 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn("Access unauthorized", str(resp.data))    
 
+
+    def test_trending(self):
+        """Do newly posted messages show up on the trending page and API?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post('/messages/new', json={'msg_text': 'Hot take'})
+
+            # force a fresh snapshot
+            trending._snapshot_at = None
+            resp = c.get('/trending')
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Hot take', resp.get_data(as_text=True))
+
+            resp = c.get('/api/trending')
+            self.assertEqual(resp.status_code, 200)
+            texts = [m['text'] for m in resp.json['messages']]
+            self.assertIn('Hot take', texts)
+
+    def test_trending_built_from_likes(self):
+        """The tracker is built from existing likes, archived messages included"""
+
+        liked = Message(text="Liked before a restart", user_id=self.testuser_id)
+        archived = ArchivedMessage(id=next_message_id(), text="Archived early",
+                                   timestamp=datetime.utcnow(), user_id=self.testuser_id)
+        db.session.add_all([liked, archived])
+        db.session.commit()
+        db.session.add(Likes(user_id=self.testuser_id, message_id=liked.id))
+        db.session.commit()
+        liked_id = liked.id
+
+        with app.test_request_context():
+            trending.load(trending_window())
+            trending.record_message(archived.id)
+        trending._snapshot_at = None
+
+        resp = self.client.get('/api/trending')
+        messages = {m['text']: m for m in resp.json['messages']}
+        self.assertEqual(messages["Liked before a restart"]['id'], str(liked_id))
+        self.assertAlmostEqual(messages["Liked before a restart"]['score'], 2.0, places=1)
+        self.assertIn("Archived early", messages)
+
+    def test_feed_paging(self):
+        """Feeds page by message id with ?before="""
+
+        msgs = [Message(text=f"warble {n}", user_id=self.testuser_id) for n in range(5)]
+        db.session.add_all(msgs)
+        db.session.commit()
+        ids = sorted(m.id for m in msgs)
+
+        # ids are handed out in creation order
+        self.assertEqual(ids, [m.id for m in msgs])
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            html = c.get(f'/?before={ids[2]}').get_data(as_text=True)
+            self.assertIn('warble 1', html)
+            self.assertIn('warble 0', html)
+            self.assertNotIn('warble 2', html)
+
+            html = c.get(f'/users/{self.testuser_id}?before={ids[4]}').get_data(as_text=True)
+            self.assertIn('warble 3', html)
+            self.assertNotIn('warble 4', html)
+
+            # past BIGINT, or not an id at all
+            for before in (2 ** 63, -1, 'abc'):
+                self.assertEqual(c.get(f'/?before={before}').status_code, 400)
+                self.assertEqual(
+                    c.get(f'/users/{self.testuser_id}?before={before}').status_code, 400)
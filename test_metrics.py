@@ -0,0 +1,131 @@
+"""Request metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+import threading
+from unittest import TestCase
+
+# testing sets up the test database; import it before the app
+from testing import DBTestCase
+from models import db, User
+from app import app, CURR_USER_KEY
+from metrics import Counter, Histogram, Registry
+
+
+class MetricTypesTestCase(TestCase):
+    """Test histograms, counters and their text exposition."""
+
+    def test_histogram_buckets(self):
+        registry = Registry()
+        hist = registry.register(Histogram('t_seconds', 'Test.', ['endpoint'],
+                                           buckets=(.1, 1)))
+        for value in (.05, .1, .5, 3):
+            hist.observe(value, 'home')
+
+        text = registry.render()
+        self.assertIn('# TYPE t_seconds histogram', text)
+        self.assertIn('t_seconds_bucket{endpoint="home",le="0.1"} 2', text)
+        self.assertIn('t_seconds_bucket{endpoint="home",le="1"} 3', text)
+        self.assertIn('t_seconds_bucket{endpoint="home",le="+Inf"} 4', text)
+        self.assertIn('t_seconds_sum{endpoint="home"} 3.65', text)
+        self.assertIn('t_seconds_count{endpoint="home"} 4', text)
+
+    def test_counter_across_threads(self):
+        registry = Registry()
+        counter = registry.register(Counter('t_total', 'Test.', ['status']))
+
+        def work():
+            for _ in range(1000):
+                counter.inc('200')
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc('200')
+
+        self.assertIn('t_total{status="200"} 8001', registry.render())
+        # the exited threads' shards were folded together
+        self.assertLessEqual(len(counter.labels('200')._live), 1)
+
+    def test_label_escaping(self):
+        registry = Registry()
+        counter = registry.register(Counter('t_total', 'Test.', ['path']))
+        counter.inc('say "hi"\\')
+        self.assertIn(r't_total{path="say \"hi\"\\"} 1', registry.render())
+
+
+class MetricsEndpointTestCase(DBTestCase):
+    """Test that requests are recorded and served on /metrics."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.signup("metered", "metered@test.com", "password", None)
+        db.session.commit()
+        self.user_id = self.user.id
+
+    def scrape(self):
+        resp = self.client.get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('text/plain', resp.content_type)
+        return resp.get_data(as_text=True)
+
+    def sample(self, text, prefix):
+        for line in text.splitlines():
+            if line.startswith(prefix + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0
+
+    def test_request_recorded(self):
+        count = 'warbler_request_seconds_count{endpoint="users_show"}'
+        ok = 'warbler_requests_total{endpoint="users_show",status="200"}'
+        before = self.scrape()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+        resp = self.client.get(f'/users/{self.user_id}')
+        self.assertEqual(resp.status_code, 200)
+        # requests are recorded once their body has been sent
+        body = resp.data
+
+        after = self.scrape()
+        self.assertEqual(self.sample(after, count), self.sample(before, count) + 1)
+        self.assertEqual(self.sample(after, ok), self.sample(before, ok) + 1)
+
+        db_time = 'warbler_db_seconds_sum{endpoint="users_show"}'
+        template_time = 'warbler_template_seconds_sum{endpoint="users_show"}'
+        size = 'warbler_response_bytes_sum{endpoint="users_show"}'
+        self.assertGreater(self.sample(after, db_time), self.sample(before, db_time))
+        self.assertGreater(self.sample(after, template_time), self.sample(before, template_time))
+        self.assertGreaterEqual(self.sample(after, size) - self.sample(before, size),
+                                len(body))
+
+        self.assertIn('warbler_user_counts_cache{stat="misses"}', after)
+
+    def test_not_found_recorded(self):
+        self.client.get('/no/such/page').data
+        self.assertIn('warbler_requests_total{endpoint="none",status="404"}', self.scrape())
+
+    def test_token(self):
+        app.config['METRICS_TOKEN'] = 'sekrit'
+        try:
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            resp = self.client.get('/metrics', headers={'Authorization': 'Bearer sekrit'})
+            self.assertEqual(resp.status_code, 200)
+        finally:
+            app.config['METRICS_TOKEN'] = None
+
+    def test_no_token_loopback_only(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', environ_base={'REMOTE_ADDR': '::1'})
+                         .status_code, 200)
+
+        resp = self.client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.9'})
+        self.assertEqual(resp.status_code, 403)
+        # a proxy on this host relaying someone else's request
+        resp = self.client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.9'})
+        self.assertEqual(resp.status_code, 403)
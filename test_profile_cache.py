@@ -0,0 +1,113 @@
+"""Profile cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_profile_cache.py
+
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+# testing sets up the test database; import it before the app
+from testing import DBTestCase
+from models import db, User, Message
+from app import CURR_USER_KEY, profile_cache
+from purge import PurgeJob
+from profile_cache import TieredStore
+from stores import LRUStore, SqliteStore
+
+
+class TieredStoreTestCase(TestCase):
+    """Test the LRU tier in front of the shared SQLite tier."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cache.db')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def make_store(self):
+        return TieredStore(LRUStore(), SqliteStore(self.path, serializer=json))
+
+    def test_shared_between_workers(self):
+        worker1, worker2 = self.make_store(), self.make_store()
+
+        worker1.set('profile:1', {'username': 'a'})
+        self.assertEqual(worker2.get('profile:1'), {'username': 'a'})
+        # now copied into worker2's own tier
+        self.assertEqual(worker2.get('profile:1'), {'username': 'a'})
+
+        stats = worker2.stats.as_dict()
+        self.assertEqual(stats['local_hits'], 1)
+        self.assertEqual(stats['shared_hits'], 1)
+
+    def test_delete_reaches_shared_tier(self):
+        worker1, worker2 = self.make_store(), self.make_store()
+        worker1.set('messages:1', [3, 2, 1])
+
+        worker1.delete('messages:1')
+        self.assertIsNone(worker2.get('messages:1'))
+
+
+class ProfileCacheViewTestCase(DBTestCase):
+    """Test that profile pages are served from the cache and kept fresh."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.signup("cached", "cached@test.com", "password", None)
+        db.session.commit()
+        self.user_id = self.user.id
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def profile_page(self):
+        resp = self.client.get(f'/users/{self.user_id}')
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_data(as_text=True)
+
+    def test_second_view_is_cached(self):
+        self.profile_page()
+        hits = profile_cache.stats.as_dict()['local_hits']
+        self.profile_page()
+        self.assertEqual(profile_cache.stats.as_dict()['local_hits'], hits + 2)
+
+    def test_new_and_deleted_messages(self):
+        self.assertNotIn('Fresh warble', self.profile_page())
+
+        self.client.post('/messages/new', json={'msg_text': 'Fresh warble'})
+        self.assertIn('Fresh warble', self.profile_page())
+
+        msg_id = Message.query.filter_by(text='Fresh warble').one().id
+        self.client.post(f'/messages/{msg_id}/delete')
+        self.assertNotIn('Fresh warble', self.profile_page())
+
+    def test_profile_edit(self):
+        self.profile_page()
+
+        self.client.post('/users/profile', data={
+            'username': 'cached',
+            'email': 'cached@test.com',
+            'bio': 'Freshly edited',
+            'password': 'password',
+        })
+        self.assertIn('Freshly edited', self.profile_page())
+
+    def test_missing_user(self):
+        self.assertEqual(self.client.get('/users/987654').status_code, 404)
+
+    def test_admin_purge(self):
+        target = User.signup("purged", "purged@test.com", "password", None)
+        User.query.get(self.user_id).is_admin = True
+        db.session.commit()
+        target_id = target.id
+
+        self.assertEqual(self.client.get(f'/users/{target_id}').status_code, 200)
+
+        resp = self.client.post('/admin/users/purge', json={'user_ids': [target_id]})
+        PurgeJob.jobs[resp.json['id']].thread.join(5)
+
+        self.assertEqual(self.client.get(f'/users/{target_id}').status_code, 404)
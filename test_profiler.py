@@ -0,0 +1,105 @@
+"""Sampling profiler tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_profiler.py
+
+
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from flask import Flask
+
+from profiler import Profile, Profiler, init_profiler, PROFILE_HEADER
+
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def read_folded(path):
+    with open(path) as f:
+        return [line.rsplit(' ', 1) for line in f.read().splitlines()]
+
+
+class ProfilerTestCase(TestCase):
+    """Test sampling, writing and rotating profiles."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_stacks_written(self):
+        profiler = Profiler(self.dir, interval=1)
+        profile = profiler.start('users_show')
+        spin(0.1)
+        profiler.stop(profile)
+
+        lines = read_folded(os.path.join(self.dir, 'users_show.folded'))
+        self.assertTrue(any('test_profiler.py:spin' in stack for stack, _ in lines))
+        self.assertEqual(sum(int(count) for _, count in lines), profile.samples)
+        self.assertGreater(profile.samples, 0)
+        self.assertEqual(profiler.stats.as_dict()['profiled'], 1)
+
+    def test_max_active(self):
+        profiler = Profiler(self.dir, max_active=0)
+        self.assertIsNone(profiler.start('home'))
+        self.assertEqual(profiler.stats.as_dict()['skipped'], 1)
+
+    def test_rotation(self):
+        profiler = Profiler(self.dir, max_bytes=1, keep=2)
+        for n in range(4):
+            # written directly, so every profile has samples
+            profile = Profile(thread_id=None, endpoint='home')
+            profile.stacks[f'app.py:home;app.py:step{n}'] = 1
+            profiler.write(profile)
+
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['home.folded', 'home.folded.1', 'home.folded.2'])
+        self.assertEqual(profiler.stats.as_dict()['rotations'], 3)
+        self.assertEqual(read_folded(os.path.join(self.dir, 'home.folded.2')),
+                         [['app.py:home;app.py:step1', '1']])
+
+    def test_wants(self):
+        never = Profiler(self.dir, token='sekrit')
+        self.assertTrue(never.wants({PROFILE_HEADER: 'sekrit'}))
+        self.assertFalse(never.wants({PROFILE_HEADER: 'guess'}))
+        self.assertFalse(never.wants({}))
+
+        always = Profiler(self.dir, sample_rate=1)
+        self.assertTrue(always.wants({}))
+
+
+class ProfiledAppTestCase(TestCase):
+    """Test that init_profiler profiles requests sending the token."""
+
+    def test_profiled_request(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app = Flask('profiled_app')
+            app.config.update(PROFILE_TOKEN='sekrit', PROFILE_DIR=directory,
+                              PROFILE_INTERVAL=1)
+
+            @app.route('/slow')
+            def slow():
+                spin(0.05)
+                return 'done'
+
+            self.assertIsNone(init_profiler(Flask('profiled_app')))
+            profiler = init_profiler(app)
+            client = app.test_client()
+
+            client.get('/slow')
+            self.assertEqual(os.listdir(directory), [])
+
+            client.get('/slow', headers={PROFILE_HEADER: 'sekrit'})
+            stacks = [stack for stack, _ in read_folded(os.path.join(directory, 'slow.folded'))]
+            self.assertTrue(any('test_profiler.py:slow;test_profiler.py:spin' in stack
+                                for stack in stacks))
+            self.assertEqual(profiler.stats.as_dict()['profiled'], 1)
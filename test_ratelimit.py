@@ -0,0 +1,152 @@
+"""Rate limiting tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_ratelimit.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+# testing sets up the test database; import it before the app
+from testing import DBTestCase, FakeClock
+from models import db, User, Message, Likes
+from app import app, limiter, CURR_USER_KEY
+from ratelimit import Limit, MemoryBuckets, SqliteBuckets, parse_limit
+
+
+class BucketsTestCase(TestCase):
+    """Test parsing budgets and the token bucket stores."""
+
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit('30/minute'), Limit(0.5, 30))
+        self.assertIsNone(parse_limit(''))
+        for bad in ('10', '10/fortnight', 'ten/minute', '0/second'):
+            with self.assertRaises(ValueError):
+                parse_limit(bad)
+
+    def check_bucket(self, buckets, clock):
+        # 2 tokens, one back every 10 seconds
+        def take(key):
+            return buckets.take([(key, 0.1, 2)])
+
+        self.assertEqual(take('k'), 0)
+        self.assertEqual(take('k'), 0)
+        self.assertAlmostEqual(take('k'), 10)
+        # other keys have their own bucket
+        self.assertEqual(take('other'), 0)
+
+        clock.now += 4
+        self.assertAlmostEqual(take('k'), 6)
+        clock.now += 6
+        self.assertEqual(take('k'), 0)
+
+        # refills no further than capacity
+        clock.now += 1000
+        self.assertEqual(take('k'), 0)
+        self.assertEqual(take('k'), 0)
+        self.assertGreater(take('k'), 0)
+
+    def check_all_or_nothing(self, buckets, clock):
+        user, total = ('user', 0.1, 5), ('total', 1, 1)
+        self.assertEqual(buckets.take([user, total]), 0)
+
+        # the total is exhausted; retrying doesn't drain the user's bucket
+        for _ in range(10):
+            self.assertAlmostEqual(buckets.take([user, total]), 1)
+
+        clock.now += 1
+        for _ in range(4):
+            self.assertEqual(buckets.take([user, total]), 0)
+            clock.now += 1
+
+    def test_memory(self):
+        clock = FakeClock()
+        self.check_bucket(MemoryBuckets(clock=clock), clock)
+        self.check_all_or_nothing(MemoryBuckets(clock=clock), clock)
+
+    def test_memory_drops_idle_buckets(self):
+        buckets = MemoryBuckets(max_keys=2)
+        for key in ('a', 'b', 'a', 'c'):
+            buckets.take([(key, 1, 5)])
+        self.assertEqual(list(buckets._buckets), ['a', 'c'])
+
+    def test_sqlite(self):
+        clock = FakeClock()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ratelimit.db')
+            self.check_bucket(SqliteBuckets(path, clock=clock), clock)
+
+            # shared with other processes' stores on the same file
+            self.assertGreater(SqliteBuckets(path, clock=clock).take([('k', 0.1, 2)]), 0)
+
+            self.check_all_or_nothing(SqliteBuckets(path, clock=clock), clock)
+
+
+class RateLimitViewsTestCase(DBTestCase):
+    """Test limits on posting and liking."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.u1 = User.signup("limited", "limited@test.com", "password", None)
+        self.u2 = User.signup("poster", "poster@test.com", "password", None)
+        db.session.commit()
+        self.u1_id, self.u2_id = self.u1.id, self.u2.id
+
+        self.real_limits = dict(limiter.limits)
+
+    def tearDown(self):
+        limiter.limits.update(self.real_limits)
+        super().tearDown()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_messages_per_user(self):
+        limiter.limits['messages'] = (Limit(1 / 60, 2), None)
+
+        self.login(self.u1_id)
+        for n in range(2):
+            resp = self.client.post("/messages/new", json={"msg_text": f"Hello {n}"})
+            self.assertEqual(resp.status_code, 200)
+
+        resp = self.client.post("/messages/new", json={"msg_text": "Too many"})
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers['Retry-After'], '60')
+        self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(), 2)
+
+        # someone else still has their budget
+        self.login(self.u2_id)
+        resp = self.client.post("/messages/new", json={"msg_text": "Hello"})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_likes_total(self):
+        msg = Message(text="Like me", user_id=self.u2_id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        limiter.limits['likes'] = (None, Limit(1, 1))
+
+        self.login(self.u1_id)
+        resp = self.client.post("/users/like", json={"msg_id": msg_id})
+        self.assertEqual(resp.json, {'result': 'like added'})
+
+        resp = self.client.post("/users/like", json={"msg_id": msg_id})
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers['Retry-After'], '1')
+        self.assertEqual(Likes.query.filter_by(user_id=self.u1_id).count(), 1)
+
+    def test_disabled(self):
+        limiter.limits['messages'] = (Limit(1 / 60, 1), None)
+        app.config['RATELIMIT_ENABLED'] = False
+        try:
+            self.login(self.u1_id)
+            for n in range(3):
+                resp = self.client.post("/messages/new", json={"msg_text": f"Hello {n}"})
+                self.assertEqual(resp.status_code, 200)
+        finally:
+            app.config['RATELIMIT_ENABLED'] = True
@@ -0,0 +1,176 @@
+"""Realtime feed tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_realtime.py
+
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+# testing sets up the test database; import it before the app
+from testing import DBTestCase
+from models import db, User, Follows, Message
+from app import app, realtime, CURR_USER_KEY
+from realtime import Hub, SqliteBroker, RESYNC, max_connections
+
+
+def event(author_id, n=0):
+    return {'id': str(n), 'author_id': author_id, 'text': f"warble {n}"}
+
+
+class HubTestCase(TestCase):
+    """Test fan-out, backpressure and the SQLite broker."""
+
+    def test_only_followers_get_events(self):
+        hub = Hub()
+        fan = hub.subscribe(1, authors=[10, 1])
+        other = hub.subscribe(2, authors=[20, 2])
+
+        hub.publish(event(10))
+
+        self.assertEqual(fan.get(timeout=0)['author_id'], 10)
+        self.assertIsNone(other.get(timeout=0))
+        self.assertEqual(hub.stats.as_dict()['connections'], 2)
+
+        hub.unsubscribe(fan)
+        hub.unsubscribe(fan)
+        self.assertEqual(hub.stats.as_dict()['connections'], 1)
+
+    def test_slow_client_resyncs(self):
+        hub = Hub(queue_size=3)
+        sub = hub.subscribe(1, authors=[10])
+
+        for n in range(5):
+            hub.publish(event(10, n))
+
+        got = [sub.get(timeout=0) for _ in range(3)]
+        self.assertEqual([e['id'] for e in got[:2]], ['1', '2'])
+        self.assertIs(got[2], RESYNC)
+
+        # refused once the queue was full (the first was queued, then
+        # evicted to make way for the resync marker)
+        self.assertEqual(hub.stats.as_dict()['dropped'], 2)
+
+    def test_connection_cap(self):
+        hub = Hub(max_connections=1)
+        self.assertIsNotNone(hub.subscribe(1, [1]))
+        self.assertIsNone(hub.subscribe(2, [2]))
+        self.assertEqual(hub.stats.as_dict()['rejected'], 1)
+
+    def test_cap_leaves_threads_free(self):
+        self.assertEqual(max_connections(16), 4)
+        # a single-threaded worker can't spare one
+        self.assertEqual(max_connections(1), 0)
+        self.assertEqual(max_connections(16, configured=8), 8)
+        with self.assertRaises(ValueError):
+            max_connections(16, configured=16)
+
+    def test_sqlite_broker_reaches_other_processes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'realtime.db')
+            worker1, worker2 = Hub(), Hub()
+            worker1.broker = SqliteBroker(worker1, path, poll_interval=60)
+            worker2.broker = SqliteBroker(worker2, path, poll_interval=60)
+
+            sub = worker2.subscribe(1, authors=[10])
+            worker1.publish(event(10))
+            worker2.broker.poll()
+
+            self.assertEqual(sub.get(timeout=0)['author_id'], 10)
+            worker1.close()
+            worker2.close()
+
+
+class FeedStreamTestCase(DBTestCase):
+    """Test the /feed/stream endpoint."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.reader = User.signup("reader", "reader@test.com", "password", None)
+        self.writer = User.signup("writer", "writer@test.com", "password", None)
+        db.session.commit()
+        db.session.add(Follows(user_being_followed_id=self.writer.id,
+                               user_following_id=self.reader.id))
+        db.session.commit()
+        self.reader_id, self.writer_id = self.reader.id, self.writer.id
+
+        app.config['REALTIME_ENABLED'] = True
+        self.real_cap = realtime.max_connections
+        realtime.max_connections = 1
+
+    def tearDown(self):
+        app.config['REALTIME_ENABLED'] = False
+        realtime.max_connections = self.real_cap
+        super().tearDown()
+
+    def login(self, client=None):
+        with (client or self.client).session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.reader_id
+
+    def test_logged_out(self):
+        resp = self.client.get('/feed/stream')
+        self.assertEqual(resp.status_code, 401)
+
+    def test_disabled(self):
+        app.config['REALTIME_ENABLED'] = False
+        self.login()
+
+        self.assertEqual(self.client.get('/feed/stream').status_code, 404)
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertNotIn('data-stream', html)
+        self.assertIn('data-poll="/feed/new"', html)
+
+    def test_at_capacity(self):
+        self.login()
+        first = self.client.get('/feed/stream', buffered=False)
+        self.assertIn('data-stream="/feed/stream"', self.client.get('/').get_data(as_text=True))
+
+        # refused, not queued behind the open stream; the page polls instead
+        other_tab = app.test_client()
+        self.login(other_tab)
+        resp = other_tab.get('/feed/stream')
+        self.assertEqual(resp.status_code, 503)
+        first.close()
+
+    def test_poll(self):
+        old = Message(text="Seen already", user_id=self.writer_id)
+        db.session.add(old)
+        db.session.commit()
+        old_id = old.id
+        for text in ("First new", "Second new"):
+            db.session.add(Message(text=text, user_id=self.writer_id))
+            db.session.commit()
+
+        self.login()
+        resp = self.client.get(f'/feed/new?after={old_id}')
+        self.assertEqual([m['text'] for m in resp.json['messages']], ["First new", "Second new"])
+        self.assertEqual(resp.json['messages'][0]['username'], 'writer')
+
+        self.assertEqual(self.client.get('/feed/new').status_code, 400)
+
+    def test_new_message_pushed(self):
+        self.login()
+
+        resp = self.client.get('/feed/stream', buffered=False)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        self.assertIn('no-transform', resp.headers['Cache-Control'])
+        body = iter(resp.response)
+        self.assertIn(b'retry:', next(body))
+
+        writer = app.test_client()
+        with writer.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.writer_id
+        writer.post('/messages/new', json={'msg_text': 'Live warble'})
+
+        chunk = next(body).decode()
+        self.assertIn('event: message', chunk)
+        data = json.loads(chunk.split('data: ', 1)[1])
+        self.assertEqual(data['text'], 'Live warble')
+        self.assertEqual(data['username'], 'writer')
+
+        resp.close()
+        self.assertEqual(app.extensions['realtime'].stats.as_dict()['connections'], 0)
@@ -0,0 +1,130 @@
+"""Key/value store tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_stores.py
+
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from testing import FakeClock
+from stores import LRUStore, SqliteStore
+
+
+class LRUStoreTestCase(TestCase):
+    """Test the in-process LRU store."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.store = LRUStore(max_entries=2, clock=self.clock)
+
+    def test_get_set(self):
+        self.assertIsNone(self.store.get('a'))
+        self.store.set('a', 1)
+        self.assertEqual(self.store.get('a'), 1)
+
+        self.assertEqual(self.store.stats.as_dict(), {
+            'hits': 1, 'misses': 1, 'writes': 1, 'deletes': 0, 'evictions': 0})
+
+    def test_evicts_least_recently_used(self):
+        self.store.set('a', 1)
+        self.store.set('b', 2)
+        self.store.get('a')
+        self.store.set('c', 3)
+
+        self.assertEqual(self.store.get('a'), 1)
+        self.assertIsNone(self.store.get('b'))
+        self.assertEqual(self.store.stats.evictions, 1)
+
+    def test_ttl(self):
+        self.store.set('a', 1, ttl=10)
+        self.clock.now += 9
+        self.assertEqual(self.store.get('a'), 1)
+        self.clock.now += 1
+        self.assertIsNone(self.store.get('a'))
+
+    def test_delete(self):
+        self.store.set('a', 1)
+        self.store.delete('a')
+        self.assertIsNone(self.store.get('a'))
+        self.assertEqual(self.store.stats.deletes, 1)
+
+
+class SqliteStoreTestCase(TestCase):
+    """Test the SQLite-file store."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'store.db')
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def make_store(self, **kwargs):
+        return SqliteStore(self.path, serializer=json, clock=self.clock, **kwargs)
+
+    def test_get_set(self):
+        store = self.make_store()
+        store.set('a', {'x': [1, 2]})
+        self.assertEqual(store.get('a'), {'x': [1, 2]})
+
+        # visible from a separate store on the same file (another worker)
+        self.assertEqual(self.make_store().get('a'), {'x': [1, 2]})
+
+    def test_ttl(self):
+        store = self.make_store()
+        store.set('a', 1, ttl=10)
+        self.clock.now += 10
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(store.purge_expired(), 1)
+
+    def test_batched_writes(self):
+        store = self.make_store(batch_size=3, write_interval=60)
+        other = self.make_store()
+
+        store.set('a', 1)
+        store.set('b', 2)
+        store.delete('a')
+
+        # this process sees buffered writes at once...
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(store.get('b'), 2)
+        self.assertIsNone(other.get('b'))
+
+        # ...other processes once the batch fills up
+        store.set('c', 3)
+        self.assertEqual(other.get('b'), 2)
+        self.assertEqual(other.get('c'), 3)
+
+    def test_write_interval(self):
+        store = self.make_store(batch_size=100, write_interval=1)
+        other = self.make_store()
+
+        store.set('a', 1)
+        self.assertIsNone(other.get('a'))
+
+        self.clock.now += 1
+        store.set('b', 2)
+        self.assertEqual(other.get('a'), 1)
+
+    def test_readable_while_flushing(self):
+        store = self.make_store(batch_size=100, write_interval=60)
+        store.set('a', 1)
+
+        # another thread reading while the batch is on its way to SQLite
+        seen = []
+        write = store._write
+
+        def write_and_read(entries):
+            seen.append(store.get('a'))
+            write(entries)
+
+        store._write = write_and_read
+        store.flush()
+
+        self.assertEqual(seen, [1])
+        self.assertEqual(store.get('a'), 1)
@@ -0,0 +1,189 @@
+"""Trending tracker tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from testing import FakeClock
+from trending import TrendingTracker, SqliteTrendingTracker, HALF_LIFE
+
+
+class TrendingTrackerTestCase(TestCase):
+    """Test ranking and decay of trending messages."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tracker = TrendingTracker(snapshot_interval=0, clock=self.clock)
+
+    def test_ranked_by_likes(self):
+        for msg_id in (1, 2, 3):
+            self.tracker.record_message(msg_id)
+
+        self.tracker.record_like(2, user_id=10)
+        self.tracker.record_like(2, user_id=11)
+        self.tracker.record_like(3, user_id=10)
+
+        self.assertEqual([m for m, _ in self.tracker.top()], [2, 3, 1])
+
+    def test_unlike(self):
+        self.tracker.record_message(1)
+        self.tracker.record_message(2)
+        self.tracker.record_like(1, user_id=10)
+        self.tracker.record_unlike(1, user_id=10)
+        self.tracker.record_like(2, user_id=10)
+
+        self.assertEqual(self.tracker.top()[0][0], 2)
+
+        # unliking something we never saw is a no-op
+        self.tracker.record_unlike(99, user_id=10)
+        self.tracker.record_unlike(2, user_id=11)
+        self.assertEqual(len(self.tracker), 2)
+        self.assertAlmostEqual(dict(self.tracker.top())[2], 2.0)
+
+    def test_unlike_after_decay(self):
+        """An unlike takes back what that like is worth now, no more."""
+
+        self.tracker.record_message(1)
+        for user_id in (10, 11, 12):
+            self.tracker.record_like(1, user_id=user_id)
+
+        self.clock.now += HALF_LIFE
+        self.tracker.record_like(1, user_id=13)
+        self.tracker.record_unlike(1, user_id=10)
+
+        # post and two likes at half weight, plus a fresh like
+        self.assertAlmostEqual(dict(self.tracker.top())[1], 2.5)
+
+        self.tracker.record_unlike(1, user_id=13)
+        self.assertAlmostEqual(dict(self.tracker.top())[1], 1.5)
+
+    def test_unlike_after_rebase(self):
+        self.tracker.window = HALF_LIFE * 1000
+        self.tracker.record_message(1)
+        self.tracker.record_like(1, user_id=10)
+
+        self.clock.now += HALF_LIFE * 600
+        self.tracker.record_message(2)
+        self.tracker.record_unlike(1, user_id=10)
+
+        # only message 1's post is left, 600 half-lives on
+        scores = dict(self.tracker.top())
+        self.assertAlmostEqual(scores[1] * 2 ** 600, 1.0)
+        self.assertAlmostEqual(scores[2], 1.0)
+
+    def test_decay(self):
+        """A like now is worth twice a like one half-life ago."""
+
+        self.tracker.record_message(1)
+        self.tracker.record_like(1, user_id=10)
+        self.tracker.record_like(1, user_id=11)
+
+        self.clock.now += HALF_LIFE
+        self.tracker.record_message(2)
+        self.tracker.record_like(2, user_id=10)
+        self.tracker.record_like(2, user_id=11)
+
+        self.assertEqual([m for m, _ in self.tracker.top()], [2, 1])
+        scores = dict(self.tracker.top())
+        self.assertAlmostEqual(scores[1], 1.5)
+        self.assertAlmostEqual(scores[2], 3.0)
+
+    def test_rebase_keeps_order(self):
+        self.tracker.record_message(1)
+        self.tracker.record_like(1, user_id=10)
+
+        # far enough out that the epoch has to be rebased
+        self.clock.now += HALF_LIFE * 600
+        self.tracker.window = HALF_LIFE * 1000
+        self.tracker.record_message(2)
+
+        self.assertEqual([m for m, _ in self.tracker.top()], [2, 1])
+
+    def test_window(self):
+        self.tracker.record_message(1)
+        self.clock.now += self.tracker.window + 1
+        self.tracker.record_message(2)
+
+        self.assertEqual([m for m, _ in self.tracker.top()], [2])
+        self.assertEqual(len(self.tracker), 1)
+
+    def test_snapshot_interval(self):
+        self.tracker.snapshot_interval = 30
+        self.tracker.record_message(1)
+        self.assertEqual(len(self.tracker.top()), 1)
+
+        # not visible until the next snapshot
+        self.tracker.record_message(2)
+        self.assertEqual(len(self.tracker.top()), 1)
+
+        self.clock.now += 30
+        self.assertEqual(len(self.tracker.top()), 2)
+
+    def test_forget(self):
+        self.tracker.record_message(1)
+        self.tracker.record_message(2)
+        self.tracker.top()
+
+        self.tracker.forget(1)
+        self.assertEqual([m for m, _ in self.tracker.top()], [2])
+
+
+class SqliteTrendingTrackerTestCase(TrendingTrackerTestCase):
+    """The same, with scores in a SQLite file; plus sharing it."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'trending.db')
+        self.clock = FakeClock()
+        self.tracker = self.make_tracker()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def make_tracker(self):
+        return SqliteTrendingTracker(self.path, snapshot_interval=0, clock=self.clock)
+
+    def test_shared_by_workers(self):
+        other_worker = self.make_tracker()
+
+        self.tracker.record_message(1)
+        self.tracker.record_message(2)
+        other_worker.record_like(2, user_id=10)
+        self.assertEqual([m for m, _ in self.tracker.top()], [2, 1])
+
+        # an unlike handled by a different worker than the like
+        self.tracker.record_unlike(2, user_id=10)
+        self.assertAlmostEqual(dict(other_worker.top())[2], 1.0)
+
+    def test_load(self):
+        self.assertFalse(self.tracker.is_loaded())
+        self.tracker.record_message(99)
+
+        now = self.clock.now
+        self.tracker.load([(1, now - HALF_LIFE, [10, 11]), (2, now, [])])
+
+        self.assertTrue(self.make_tracker().is_loaded())
+        # likes count from when their message was posted
+        self.assertEqual(dict(self.tracker.top()), {1: 1.5, 2: 1.0})
+
+        # and can be taken back
+        self.tracker.record_unlike(1, user_id=10)
+        self.assertAlmostEqual(dict(self.tracker.top())[1], 1.0)
+
+
+class TrackerLoadTestCase(TestCase):
+    """Test building the in-memory tracker from existing likes."""
+
+    def test_load(self):
+        clock = FakeClock()
+        tracker = TrendingTracker(snapshot_interval=0, clock=clock)
+        self.assertFalse(tracker.is_loaded())
+
+        tracker.load([(1, clock.now - HALF_LIFE, [10, 11]), (2, clock.now, [])])
+        self.assertTrue(tracker.is_loaded())
+        self.assertEqual(dict(tracker.top()), {1: 1.5, 2: 1.0})
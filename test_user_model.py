@@ -6,28 +6,13 @@
 
 
 
-import os
-from unittest import TestCase
-from sqlalchemy import exc
-from models import db, User, Message, Follows
-
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-
-# Now we can import app
+from sqlalchemy import event, exc
 
+# testing sets up the test database; import it before the app
+from testing import DBTestCase
+from models import db, User, Message, Follows
 from app import app
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
+from signals import profile_updated
 
 def create_user():
     u = User(
@@ -42,14 +27,13 @@ def create_user():
 
     return u
 
-class UserModelTestCase(TestCase):
+class UserModelTestCase(DBTestCase):
     """Test methods for User."""
 
     def setUp(self):
         """Create test client, add sample data."""
 
-        db.drop_all()
-        db.create_all()
+        super().setUp()
 
         u1 = User.signup("testuser1", "email1@test.com", "password1", None)
         uid1 = 1111
@@ -70,10 +54,6 @@ class UserModelTestCase(TestCase):
         self.u2 = u2
         self.uid2 = uid2
 
-    def tearDown(self):
-        res = super().tearDown()
-        db.session.rollback()
-        return res    
 
     def test_user_model(self):
         """Does basic model work?"""
@@ -176,6 +156,24 @@ class UserModelTestCase(TestCase):
         User.signup('testuser3', 'email1@test.com', 'pass1', None)
         self.assertRaises(exc.IntegrityError, db.session.commit)
 
+    def test_unique_ignoring_case(self):
+        """usernames and emails differing only in case collide"""
+
+        User.signup('TestUser1', 'other@test.com', 'pass1', None)
+        self.assertRaises(exc.IntegrityError, db.session.commit)
+        db.session.rollback()
+
+        User.signup('other', 'EMAIL1@test.com', 'pass1', None)
+        self.assertRaises(exc.IntegrityError, db.session.commit)
+
+    def test_taken(self):
+        """taken() finds usernames and emails in use, ignoring case"""
+
+        self.assertEqual(User.taken(username='TESTUSER1', email='Email2@Test.com'),
+                         ['username', 'email'])
+        self.assertEqual(User.taken(username='nobody', email='nobody@test.com'), [])
+        self.assertEqual(User.taken(username='testuser1', exclude_id=self.uid1), [])
+
     def test_invalid_password(self):
         """user signup with invalid password"""
    
@@ -216,6 +214,38 @@ class UserModelTestCase(TestCase):
         self.assertEqual(self.u1.location, 'new_loc')
         self.assertEqual(self.u1.bio, 'new_bio')
 
+    def test_edit_user_writes_only_changes(self):
+        """Only changed columns are updated, and unchanged profiles not at all"""
+
+        statements = []
+        sent = []
+
+        def record(conn, cursor, statement, *args):
+            if statement.startswith('UPDATE users'):
+                statements.append(statement)
+
+        def received(user, changes, previous):
+            sent.append((changes, previous))
+
+        event.listen(self.connection, 'before_cursor_execute', record)
+        profile_updated.connect(received)
+        try:
+            changes = self.u1.edit_user('testuser1', 'email1@test.com', '/static/images/default-pic.png',
+                                        '/static/images/warbler-hero.jpg', '', None)
+            self.assertEqual(changes, {})
+            self.assertEqual(statements, [])
+            self.assertEqual(sent, [])
+
+            changes = self.u1.edit_user('testuser1', 'email1@test.com', '/static/images/default-pic.png',
+                                        '/static/images/warbler-hero.jpg', '', 'new_bio')
+            self.assertEqual(changes, {'bio': 'new_bio'})
+            self.assertEqual(len(statements), 1)
+            self.assertNotIn('username', statements[0])
+            self.assertEqual(sent, [({'bio': 'new_bio'}, {'bio': None})])
+        finally:
+            event.remove(self.connection, 'before_cursor_execute', record)
+            profile_updated.disconnect(received)
+
     def test_delete_user(self):
         """Tests that we can delete a user"""
 
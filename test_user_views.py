@@ -6,51 +6,29 @@
 
 
 
-import os
-from unittest import TestCase
-
-from flask import session
-from models import db, connect_db, Message, User, Likes, Follows
+from flask import session, _request_ctx_stack
+from flask.json.tag import TaggedJSONSerializer
 from bs4 import BeautifulSoup
 from sqlalchemy import exc
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-from app import app, CURR_USER_KEY
-
-
-# Now we can import app
-
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
-
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
+# testing sets up the test database; import it before the app
+from testing import DBTestCase
+from models import db, connect_db, Message, User, Likes, Follows
+from app import app, session_store, user_counts, trending, CURR_USER_KEY, FOLLOW_PAGE_SIZE
+from purge import PurgeJob
+from stores import SqliteStore
 
 default_image = '/static/images/default-pic.png'
 default_header_image = '/static/images/warbler-hero.jpg'
 
 
-class MessageViewTestCase(TestCase):
+class MessageViewTestCase(DBTestCase):
     """Test views for messages."""
 
     def setUp(self):
         """Create test client, add sample data."""
 
-        db.drop_all()
-        db.create_all()
-
-        self.client = app.test_client()
+        super().setUp()
 
         self.testuser = User.signup(username="testuser",
                                     email="test@test.com",
@@ -76,10 +54,6 @@ class MessageViewTestCase(TestCase):
 
         db.session.commit()
 
-    def tearDown(self):
-        resp = super().tearDown()
-        db.session.rollback()
-        return
 
     def test_users_index(self):
         with self.client as c:
@@ -223,6 +197,31 @@ class MessageViewTestCase(TestCase):
             html = resp.get_data(as_text=True)
             self.assertIn('Username or email already taken', html)       
 
+    def test_signup_taken_ignoring_case(self):
+        """Tests that a username differing only in case is turned away"""
+
+        with self.client as c:
+            resp = c.post("/signup", data={
+                'username': 'TestUser',
+                'password': 'billy758',
+                'email': 'billy@gmail.com',
+                'image_url': None
+            })
+
+            self.assertIn('Username or email already taken', resp.get_data(as_text=True))
+            self.assertIsNone(User.query.filter_by(email='billy@gmail.com').first())
+
+    def test_availability(self):
+        """Tests the signup form's username/email availability check"""
+
+        resp = self.client.get('/api/availability?username=TESTUSER&email=new@test.com')
+        self.assertEqual(resp.json, {'username': False, 'email': True})
+
+        resp = self.client.get('/api/availability?email=test2@test.com')
+        self.assertEqual(resp.json, {'email': False})
+
+        self.assertEqual(self.client.get('/api/availability').status_code, 400)
+
     def test_signup_bad_password(self):
         """Tests that we can't signup with a password less than 6 characters"""
 
@@ -510,3 +509,306 @@ class MessageViewTestCase(TestCase):
 
 
 
+    def test_delete_user(self):
+        """Does deleting our account remove our messages, likes and follows?"""
+
+        self.setup_likes()
+        # someone else likes one of testuser's messages
+        msg = Message.query.filter_by(text="trending warble").first()
+        db.session.add(Likes(user_id=self.u1_id, message_id=msg.id))
+        self.u2.following.append(self.testuser)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post('/users/delete')
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(resp.location, 'http://localhost/signup')
+
+        self.assertIsNone(User.query.get(self.testuser_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.testuser_id).count(), 0)
+        self.assertEqual(Likes.query.filter_by(user_id=self.testuser_id).count(), 0)
+        self.assertEqual(Likes.query.filter_by(user_id=self.u1_id).count(), 0)
+        self.assertEqual(Follows.query.filter(
+            (Follows.user_following_id == self.testuser_id) |
+            (Follows.user_being_followed_id == self.testuser_id)).count(), 0)
+
+        # other users' data is untouched
+        self.assertIsNotNone(Message.query.get(9876))
+        self.assertEqual(len(User.query.get(self.u2_id).following), 1)
+
+    def test_delete_user_updates_caches(self):
+        """Deleting an account updates the counts of those it followed or was
+        followed by, and drops its messages from trending"""
+
+        self.setup_likes()
+        msg = Message.query.filter_by(text="trending warble").first()
+        msg_id = msg.id
+        self.u2.following.append(self.testuser)
+        self.testuser.following.append(self.u3)
+        db.session.commit()
+
+        trending.record_message(msg_id)
+        trending.record_like(msg_id, self.u1_id)
+        self.assertEqual(user_counts.get(self.u2_id)['following'], 2)
+        self.assertEqual(user_counts.get(self.u3_id)['followers'], 2)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.post('/users/delete')
+
+        self.assertEqual(user_counts.get(self.u2_id)['following'], 1)
+        self.assertEqual(user_counts.get(self.u3_id)['followers'], 1)
+        self.assertNotIn(msg_id, dict(trending.top()))
+
+    def test_delete_user_not_deferred(self):
+        """Deleting an account doesn't wait on the background job queue"""
+
+        app.config['JOBS_EAGER'] = False
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser_id
+
+                c.post('/users/delete')
+        finally:
+            app.config['JOBS_EAGER'] = True
+
+        self.assertIsNone(User.query.get(self.testuser_id))
+
+    def test_admin_purge_requires_admin(self):
+        """Non-admins can't purge users"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post('/admin/users/purge', json={'user_ids': [self.u1_id]})
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertIsNotNone(User.query.get(self.u1_id))
+
+    def test_admin_purge(self):
+        """Admins can purge users in the background and poll its progress"""
+
+        User.query.get(self.testuser_id).is_admin = True
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post('/admin/users/purge', json={'user_ids': [self.u1_id, self.u2_id]})
+            self.assertEqual(resp.status_code, 202)
+            job_id = resp.json['id']
+            PurgeJob.jobs[job_id].thread.join(5)
+
+            resp = c.get(f'/admin/purge/{job_id}')
+            self.assertEqual(resp.json['status'], 'finished')
+            self.assertEqual((resp.json['done'], resp.json['total']), (2, 2))
+            self.assertGreater(resp.json['rows_deleted'], 0)
+
+        self.assertIsNone(User.query.get(self.u1_id))
+        self.assertIsNone(User.query.get(self.u2_id))
+
+        # finished jobs are forgotten after a while
+        PurgeJob.prune(keep=-1)
+        self.assertNotIn(job_id, PurgeJob.jobs)
+
+    def test_session_cookie_is_only_an_id(self):
+        """Session data stays on the server; the cookie is a bare session id"""
+
+        with self.client as c:
+            resp = c.post("/login", data={
+                'username': 'testuser',
+                'password': 'testuser'
+            })
+
+            cookie = resp.headers['Set-Cookie']
+            self.assertTrue(cookie.startswith('session='))
+            sid = cookie.split(';')[0][len('session='):]
+            self.assertLess(len(sid), 40)
+            self.assertNotIn('.', sid)
+
+            # the flashed greeting lives in the store, not the cookie
+            resp = c.get('/')
+            self.assertIn('Hello, testuser!', resp.get_data(as_text=True))
+            self.assertNotIn('Set-Cookie', resp.headers)
+
+    def test_login_rotates_session_id(self):
+        """Logging in gets a fresh session id"""
+
+        with self.client as c:
+            resp = c.get('/users/3333/following')
+            old_cookie = resp.headers['Set-Cookie'].split(';')[0]
+
+            resp = c.post("/login", data={
+                'username': 'testuser',
+                'password': 'testuser'
+            })
+            new_cookie = resp.headers['Set-Cookie'].split(';')[0]
+
+            self.assertNotEqual(old_cookie, new_cookie)
+
+    def test_anonymous_session_not_stored(self):
+        """Logged-out sessions stay in a signed cookie, out of the store"""
+
+        writes = session_store.stats.writes
+        with self.client as c:
+            resp = c.get('/users/3333/following', follow_redirects=True)
+            self.assertIn('Access unauthorized.', resp.get_data(as_text=True))
+
+        self.assertEqual(session_store.stats.writes, writes)
+
+    def test_login_visible_to_other_workers(self):
+        """A login is written through even when session writes are batched"""
+
+        batch_size = session_store.batch_size
+        session_store.batch_size = 100
+        try:
+            resp = self.client.post("/login", data={
+                'username': 'testuser',
+                'password': 'testuser'
+            })
+            sid = resp.headers['Set-Cookie'].split(';')[0][len('session='):]
+        finally:
+            session_store.batch_size = batch_size
+
+        other_worker = SqliteStore(session_store.path, TaggedJSONSerializer(), table='sessions')
+        self.assertEqual(other_worker.get(sid)[CURR_USER_KEY], self.testuser_id)
+
+    def test_streamed_likes_page(self):
+        """With STREAM_TEMPLATES on, pages stream and flashes still show once"""
+
+        self.setup_likes()
+        app.config['STREAM_TEMPLATES'] = True
+        try:
+            with self.client as c:
+                c.post("/login", data={
+                    'username': 'testuser',
+                    'password': 'testuser'
+                })
+
+                resp = c.get(f'/users/{self.testuser_id}/likes')
+                self.assertTrue(resp.is_streamed)
+
+                html = resp.get_data(as_text=True)
+                self.assertIn('likable warble', html)
+                self.assertIn('Hello, testuser!', html)
+
+                resp = c.get(f'/users/{self.testuser_id}/likes')
+                self.assertNotIn('Hello, testuser!', resp.get_data(as_text=True))
+
+            # nothing left pushed for the next test to trip over
+            self.assertIsNone(_request_ctx_stack.top)
+        finally:
+            app.config['STREAM_TEMPLATES'] = False
+
+    def test_many_users_like_one_message(self):
+        """A message can be liked by more than one user"""
+
+        m = Message(id=1111, text="The earth is round", user_id=self.u1_id)
+        db.session.add(m)
+        db.session.add(Likes(user_id=self.u2_id, message_id=1111))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post('/users/like', json={'msg_id': '1111'})
+            self.assertEqual(resp.json['result'], 'like added')
+            self.assertEqual(Likes.query.filter_by(message_id=1111).count(), 2)
+
+            resp = c.post('/users/like', json={'msg_id': '1111'})
+            self.assertEqual(resp.json['result'], 'like removed')
+            self.assertIsNone(Likes.query.get((self.testuser_id, 1111)))
+            self.assertIsNotNone(Likes.query.get((self.u2_id, 1111)))
+
+    def test_profile_unchanged_skips_password_check(self):
+        """Submitting an unchanged profile saves nothing and needs no password"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post('/users/profile', data={
+                'username': 'testuser',
+                'email': 'test@test.com',
+                'image_url': default_image,
+                'header_image_url': default_header_image,
+                'password': 'wrong-password',
+            }, follow_redirects=True)
+
+            html = resp.get_data(as_text=True)
+            self.assertIn('Nothing changed', html)
+            self.assertNotIn('Incorrect Password', html)
+
+    def test_profile_edit(self):
+        """Changed fields are saved once the password checks out"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.post('/users/profile', data={
+                'username': 'testuser',
+                'email': 'test@test.com',
+                'bio': 'Warbling away',
+                'password': 'testuser',
+            })
+
+            self.assertEqual(User.query.get(self.testuser_id).bio, 'Warbling away')
+
+    def test_followers_paginated(self):
+        """Followers come a page at a time, with follow buttons per row"""
+
+        fans = [User(username=f"fan{n:02}", email=f"fan{n}@test.com", password="x")
+                for n in range(FOLLOW_PAGE_SIZE + 2)]
+        db.session.add_all(fans)
+        db.session.commit()
+        db.session.add_all(Follows(user_being_followed_id=self.testuser_id,
+                                   user_following_id=fan.id) for fan in fans)
+        db.session.add(Follows(user_being_followed_id=fans[0].id,
+                               user_following_id=self.testuser_id))
+        db.session.commit()
+        first_fan, last_ids = fans[0].id, [fan.id for fan in fans[-2:]]
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            html = c.get(f'/users/{self.testuser_id}/followers').get_data(as_text=True)
+            self.assertEqual(html.count('class="card user-card"'), FOLLOW_PAGE_SIZE)
+            self.assertIn(f'action="/users/stop-following/{first_fan}"', html)
+            self.assertEqual(html.count('>Unfollow<'), 1)
+
+            soup = BeautifulSoup(html, 'html.parser')
+            more = soup.find('a', string='More')['href']
+
+            html = c.get(more).get_data(as_text=True)
+            self.assertEqual(html.count('class="card user-card"'), 2)
+            for fan_id in last_ids:
+                self.assertIn(f'href="/users/{fan_id}"', html)
+
+    def test_counts_follow_changes(self):
+        """Cached totals are refreshed when the user follows someone"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            html = c.get(f'/users/{self.testuser_id}').get_data(as_text=True)
+            self.assertIn(f'<a href="/users/{self.testuser_id}/following">0</a>', html)
+
+            c.post(f'/users/follow/{self.u1_id}')
+
+            html = c.get(f'/users/{self.testuser_id}').get_data(as_text=True)
+            self.assertIn(f'<a href="/users/{self.testuser_id}/following">1</a>', html)
+            html = c.get(f'/users/{self.u1_id}').get_data(as_text=True)
+            self.assertIn(f'<a href="/users/{self.u1_id}/followers">1</a>', html)
@@ -0,0 +1,143 @@
+"""Shared setup for the test suite.
+
+Import this BEFORE `app` in a test module. It points the app at the test
+database (TEST_DATABASE_URL, by default postgresql:///warbler_test) and
+turns bcrypt down to its cheapest setting, since every test user is
+created through User.signup().
+
+Test cases that touch the database should subclass DBTestCase:
+
+- the schema is created once per run, not once per test
+- each test runs inside a transaction (plus a SAVEPOINT that the app's own
+  commits and rollbacks operate on) which is rolled back afterwards, so
+  tests leave nothing behind and don't need to drop/recreate tables
+
+run_tests.py runs the test modules in parallel, each worker against its
+own database.
+"""
+
+import os
+from unittest import TestCase
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = os.environ.get(
+    'TEST_DATABASE_URL', "postgresql:///warbler_test")
+
+# background threads (PurgeJob) join the test's transaction, so on SQLite
+# they have to be allowed to use its connection
+if os.environ['DATABASE_URL'].startswith('sqlite'):
+    os.environ['DATABASE_URL'] += (
+        ('&' if '?' in os.environ['DATABASE_URL'] else '?') + 'check_same_thread=false')
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+# a shared trending file would mix in other test runs' messages
+os.environ.setdefault('TRENDING_BACKEND', 'memory')
+
+from flask import _app_ctx_stack
+from sqlalchemy import event, orm
+
+from app import app
+from models import db
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# Run background jobs inline, so a test sees their effects as soon as the
+# request returns
+
+app.config['JOBS_EAGER'] = True
+
+_schema_created = False
+
+
+class FakeClock:
+    """Clock we can move by hand; pass it wherever code takes `clock=`."""
+
+    def __init__(self, now=1_600_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def create_schema():
+    """Create fresh tables, once per test run."""
+
+    global _schema_created
+    if _schema_created:
+        return
+
+    engine = db.engine
+    if engine.dialect.name == 'sqlite':
+        _fix_sqlite_savepoints(engine)
+
+    db.drop_all()
+    db.create_all()
+    db.session.remove()
+    _schema_created = True
+
+
+def _fix_sqlite_savepoints(engine):
+    """Let pysqlite do SAVEPOINTs properly (see the SQLAlchemy SQLite docs)."""
+
+    @event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def do_begin(conn):
+        conn.execute("BEGIN")
+
+    engine.dispose()
+
+
+class DBTestCase(TestCase):
+    """Test case whose database changes are rolled back after each test."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        create_schema()
+
+    def setUp(self):
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+
+        # every session the app opens during this test (they're removed at
+        # the end of each request) joins our transaction inside a SAVEPOINT
+        make_session = db.create_session({'bind': self.connection, 'binds': {}})
+
+        def session_factory():
+            session = make_session()
+            session.begin_nested()
+            event.listen(session, 'after_transaction_end', _restart_savepoint)
+            return session
+
+        self._real_session = db.session
+        db.session = orm.scoped_session(
+            session_factory, scopefunc=_app_ctx_stack.__ident_func__)
+
+        # cached rows from an earlier test's (rolled back) data would leak in
+        for cache in app.extensions.get('caches', {}).values():
+            cache.clear()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.session = self._real_session
+
+        # closing the connection rolls back everything the test did
+        self.connection.close()
+
+
+def _restart_savepoint(session, transaction):
+    """When the app commits or rolls back our SAVEPOINT, open a new one."""
+
+    if transaction.nested and not transaction._parent.nested:
+        session.expire_all()
+        session.begin_nested()
@@ -0,0 +1,338 @@
+"""Incrementally maintained trending ranking for warbles.
+
+Scores are updated from like/post events, so the trending page never has
+to aggregate the `likes` table at request time. Where they're kept is
+TRENDING_BACKEND:
+
+- sqlite (the default): SqliteTrendingTracker, a SQLite file at
+  TRENDING_SQLITE_PATH shared by every worker process on the host, so
+  they all rank every like and agree on the result
+- memory: TrendingTracker, in this process only
+
+Either way, each process reads its top messages into an in-memory
+snapshot at most every `snapshot_interval` seconds. A tracker that has
+never been loaded (a new process, or a new SQLite file) is built from
+the messages in the window and their likes before it's first read;
+`likes` doesn't say when a like was made, so those likes count as made
+when their message was posted.
+
+Each event adds `weight * 2 ** ((t - epoch) / half_life)` to a message's
+score. Because every score is scaled against the same epoch, relative
+order between messages never changes as time passes -- an older like is
+simply worth less than a newer one -- so nothing has to be re-decayed.
+
+The time of each like is kept too, so an unlike takes back exactly what
+that like added, however much it has decayed since.
+"""
+
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from signals import user_purged
+
+HALF_LIFE = 6 * 60 * 60
+WINDOW = 7 * 24 * 60 * 60
+SNAPSHOT_INTERVAL = 30
+SNAPSHOT_SIZE = 100
+
+# Weight of the post itself, so brand new warbles can show up before
+# anyone has liked them.
+POST_WEIGHT = 1.0
+LIKE_WEIGHT = 1.0
+
+# Rebase scores before the exponent gets anywhere near float overflow.
+MAX_EXPONENT = 512
+
+
+class TrendingTracker:
+    """Decayed like counts per message, with a periodically rebuilt snapshot."""
+
+    def __init__(self, half_life=HALF_LIFE, window=WINDOW,
+                 snapshot_interval=SNAPSHOT_INTERVAL, snapshot_size=SNAPSHOT_SIZE,
+                 clock=time.time):
+        self.half_life = half_life
+        self.window = window
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_size = snapshot_size
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._epoch = clock()
+        # message id -> [score, posted_at]
+        self._scores = {}
+        # message id -> {user id: liked at}
+        self._likes = {}
+        self._snapshot = []
+        self._snapshot_at = None
+        self._loaded = False
+
+    def _weight(self, weight, when):
+        return weight * 2 ** ((when - self._epoch) / self.half_life)
+
+    def _rebase(self, now):
+        """Move the epoch up to `now`, scaling existing scores down to match."""
+
+        factor = 2 ** ((self._epoch - now) / self.half_life)
+        for entry in self._scores.values():
+            entry[0] *= factor
+        self._epoch = now
+
+    def _add(self, msg_id, weight, when, posted_at=None):
+        if (when - self._epoch) / self.half_life > MAX_EXPONENT:
+            self._rebase(when)
+
+        entry = self._scores.get(msg_id)
+        if entry is None:
+            entry = self._scores[msg_id] = [0.0, posted_at or when]
+        entry[0] = max(entry[0] + self._weight(weight, when), 0.0)
+
+    def record_message(self, msg_id, posted_at=None):
+        """Start tracking a newly posted message."""
+
+        when = posted_at if posted_at is not None else self.clock()
+        with self._lock:
+            self._add(msg_id, POST_WEIGHT, when, posted_at=when)
+
+    def record_like(self, msg_id, user_id, posted_at=None):
+        """Count `user_id`'s like of `msg_id`."""
+
+        now = self.clock()
+        with self._lock:
+            likes = self._likes.setdefault(msg_id, {})
+            if user_id in likes:
+                return
+            likes[user_id] = now
+            self._add(msg_id, LIKE_WEIGHT, now, posted_at=posted_at)
+
+    def record_unlike(self, msg_id, user_id):
+        """Take back `user_id`'s like of `msg_id`, at the weight it was
+        added with. Likes we never counted are ignored."""
+
+        with self._lock:
+            liked_at = self._likes.get(msg_id, {}).pop(user_id, None)
+            if liked_at is not None and msg_id in self._scores:
+                self._add(msg_id, -LIKE_WEIGHT, liked_at)
+
+    def forget(self, *msg_ids):
+        """Stop tracking deleted messages."""
+
+        with self._lock:
+            for msg_id in msg_ids:
+                self._scores.pop(msg_id, None)
+                self._likes.pop(msg_id, None)
+            self._snapshot = [(m, s) for m, s in self._snapshot if m not in msg_ids]
+
+    def is_loaded(self):
+        """Has load() been called?"""
+
+        return self._loaded
+
+    def load(self, messages):
+        """Replace what we're tracking with `messages`: (msg_id, posted_at,
+        [ids of users who liked it]) for each message in the window."""
+
+        with self._lock:
+            self._epoch = self.clock()
+            self._scores = {}
+            self._likes = {}
+            for msg_id, posted_at, likers in messages:
+                self._add(msg_id, POST_WEIGHT, posted_at, posted_at=posted_at)
+                for user_id in likers:
+                    self._likes.setdefault(msg_id, {})[user_id] = posted_at
+                    self._add(msg_id, LIKE_WEIGHT, posted_at)
+            self._snapshot_at = None
+            self._loaded = True
+
+    def _build_snapshot(self, now):
+        cutoff = now - self.window
+        expired = [m for m, (_, posted) in self._scores.items() if posted < cutoff]
+        for msg_id in expired:
+            del self._scores[msg_id]
+            self._likes.pop(msg_id, None)
+
+        top = heapq.nlargest(self.snapshot_size, self._scores.items(),
+                             key=lambda item: item[1][0])
+        # Report scores relative to `now` so they read as "current likes".
+        scale = 2 ** ((self._epoch - now) / self.half_life)
+        self._snapshot = [(msg_id, entry[0] * scale) for msg_id, entry in top]
+        self._snapshot_at = now
+
+    def top(self, limit=None):
+        """Return [(msg_id, score), ...], best first, from the latest snapshot.
+
+        The snapshot is rebuilt at most once every `snapshot_interval` seconds.
+        """
+
+        now = self.clock()
+        with self._lock:
+            if (self._snapshot_at is None
+                    or now - self._snapshot_at >= self.snapshot_interval):
+                self._build_snapshot(now)
+            snapshot = self._snapshot
+
+        return snapshot[:limit] if limit else list(snapshot)
+
+    def __len__(self):
+        return len(self._scores)
+
+
+class SqliteTrendingTracker(TrendingTracker):
+    """Decayed like counts in a SQLite file, shared by every process on the host.
+
+    The same scoring as TrendingTracker; the epoch is kept in the file too,
+    so every process scales scores the same way.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS scores ("
+                         "message_id INTEGER PRIMARY KEY, score REAL NOT NULL, "
+                         "posted_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_scores_score ON scores (score)")
+            conn.execute("CREATE TABLE IF NOT EXISTS likes ("
+                         "message_id INTEGER NOT NULL, user_id INTEGER NOT NULL, "
+                         "liked_at REAL NOT NULL, PRIMARY KEY (message_id, user_id))")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)",
+                         (self.clock(),))
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # autocommit; _transaction() manages transactions
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _add_row(self, conn, msg_id, weight, when, posted_at=None):
+        epoch = conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+        if (when - epoch) / self.half_life > MAX_EXPONENT:
+            conn.execute("UPDATE scores SET score = score * ?",
+                         (2 ** ((epoch - when) / self.half_life),))
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'epoch'", (when,))
+            epoch = when
+
+        added = weight * 2 ** ((when - epoch) / self.half_life)
+        updated = conn.execute("UPDATE scores SET score = max(score + ?, 0.0) "
+                               "WHERE message_id = ?", (added, msg_id)).rowcount
+        if not updated:
+            conn.execute("INSERT INTO scores (message_id, score, posted_at) VALUES (?, ?, ?)",
+                         (msg_id, max(added, 0.0), posted_at or when))
+
+    def record_message(self, msg_id, posted_at=None):
+        when = posted_at if posted_at is not None else self.clock()
+        with self._transaction() as conn:
+            self._add_row(conn, msg_id, POST_WEIGHT, when, posted_at=when)
+
+    def record_like(self, msg_id, user_id, posted_at=None):
+        now = self.clock()
+        with self._transaction() as conn:
+            added = conn.execute("INSERT OR IGNORE INTO likes (message_id, user_id, liked_at) "
+                                 "VALUES (?, ?, ?)", (msg_id, user_id, now)).rowcount
+            if added:
+                self._add_row(conn, msg_id, LIKE_WEIGHT, now, posted_at=posted_at)
+
+    def record_unlike(self, msg_id, user_id):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT liked_at FROM likes WHERE message_id = ? AND user_id = ?",
+                               (msg_id, user_id)).fetchone()
+            if row is None:
+                return
+            conn.execute("DELETE FROM likes WHERE message_id = ? AND user_id = ?",
+                         (msg_id, user_id))
+            tracked = conn.execute("SELECT 1 FROM scores WHERE message_id = ?",
+                                   (msg_id,)).fetchone()
+            if tracked:
+                self._add_row(conn, msg_id, -LIKE_WEIGHT, row[0])
+
+    def forget(self, *msg_ids):
+        rows = [(msg_id,) for msg_id in msg_ids]
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM scores WHERE message_id = ?", rows)
+            conn.executemany("DELETE FROM likes WHERE message_id = ?", rows)
+        with self._lock:
+            self._snapshot = [(m, s) for m, s in self._snapshot if m not in msg_ids]
+
+    def is_loaded(self):
+        # by this or any other process; once it is, it stays so
+        if not self._loaded:
+            self._loaded = self._conn().execute(
+                "SELECT 1 FROM meta WHERE key = 'loaded'").fetchone() is not None
+        return self._loaded
+
+    def load(self, messages):
+        now = self.clock()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM scores")
+            conn.execute("DELETE FROM likes")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('epoch', ?)", (now,))
+            for msg_id, posted_at, likers in messages:
+                self._add_row(conn, msg_id, POST_WEIGHT, posted_at, posted_at=posted_at)
+                for user_id in likers:
+                    conn.execute("INSERT INTO likes (message_id, user_id, liked_at) "
+                                 "VALUES (?, ?, ?)", (msg_id, user_id, posted_at))
+                    self._add_row(conn, msg_id, LIKE_WEIGHT, posted_at)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('loaded', ?)", (now,))
+
+        with self._lock:
+            self._snapshot_at = None
+            self._loaded = True
+
+    def _build_snapshot(self, now):
+        with self._transaction() as conn:
+            expired = "SELECT message_id FROM scores WHERE posted_at < ?"
+            cutoff = now - self.window
+            conn.execute(f"DELETE FROM likes WHERE message_id IN ({expired})", (cutoff,))
+            conn.execute("DELETE FROM scores WHERE posted_at < ?", (cutoff,))
+
+            epoch = conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+            top = conn.execute("SELECT message_id, score FROM scores "
+                               "ORDER BY score DESC LIMIT ?", (self.snapshot_size,)).fetchall()
+
+        scale = 2 ** ((epoch - now) / self.half_life)
+        self._snapshot = [(msg_id, score * scale) for msg_id, score in top]
+        self._snapshot_at = now
+
+    def __len__(self):
+        return self._conn().execute("SELECT count(*) FROM scores").fetchone()[0]
+
+
+def init_trending(app):
+    """Create the tracker named by TRENDING_BACKEND."""
+
+    backend = app.config.setdefault('TRENDING_BACKEND', 'sqlite')
+    if backend == 'memory':
+        tracker = TrendingTracker()
+    elif backend == 'sqlite':
+        tracker = SqliteTrendingTracker(app.config.setdefault(
+            'TRENDING_SQLITE_PATH', os.path.join(app.root_path, 'trending.db')))
+    else:
+        raise ValueError(f"Unknown TRENDING_BACKEND {backend!r}")
+
+    def forget_purged_messages(user_id, message_ids=(), **extra):
+        tracker.forget(*message_ids)
+
+    user_purged.connect(forget_purged_messages, weak=False)
+
+    app.extensions['trending'] = tracker
+    return tracker